@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+压测脚本：测量 agent 模式下每个请求的 Agent 准备耗时
+
+- before: 每次请求清空缓存，等价于旧实现（读配置 + 构建 ChatOpenAI + create_agent 编译）
+- after:  进程级缓存命中，只做一次配置文件 stat
+
+用法:
+    python scripts/bench_agent_setup.py [-n 200]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+os.environ.setdefault("COZE_WORKSPACE_PATH", str(ROOT))
+os.environ.setdefault("COZE_WORKLOAD_IDENTITY_API_KEY", "bench")
+os.environ.setdefault("COZE_INTEGRATION_MODEL_BASE_URL", "http://127.0.0.1:9/v1")
+
+from coze_coding_utils.runtime_ctx.context import new_context
+
+from agents.agent import build_agent
+from utils.helper.agent_cache import clear_agent_cache
+
+
+def _measure(n: int, cached: bool):
+    costs = []
+    build_agent(new_context(method="bench"))  # 预热 import 与 checkpointer
+    for _ in range(n):
+        if not cached:
+            clear_agent_cache()
+        ctx = new_context(method="bench")
+        t0 = time.perf_counter()
+        build_agent(ctx)
+        costs.append((time.perf_counter() - t0) * 1000)
+    costs.sort()
+    return statistics.mean(costs), costs[int(len(costs) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-request agent setup latency")
+    parser.add_argument("-n", type=int, default=200)
+    args = parser.parse_args()
+
+    for label, cached in (("before", False), ("after", True)):
+        mean_ms, p99_ms = _measure(args.n, cached)
+        print(f"{label:<8} mean={mean_ms:.3f}ms p99={p99_ms:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
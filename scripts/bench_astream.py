@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+压测脚本：对比 GraphService.astream 原生异步路径与线程桥接路径
+
+在 50/200/500 并发流下分别统计：
+- 峰值线程数
+- 峰值 RSS
+- 首 token 耗时 (TTFT) 的 p50/p99
+
+使用模拟图代替真实模型：同步路径用 time.sleep 模拟阻塞的 LLM socket，
+异步路径用 asyncio.sleep 模拟，保证两条路径的时间特征一致。
+
+用法:
+    python scripts/bench_astream.py [--concurrency 50,200,500] [--tokens 20]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加src目录到路径，并以 agent 模式导入，避免加载 graphs.graph
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+os.environ.setdefault("COZE_PROJECT_TYPE", "agent")
+
+import psutil
+from langchain_core.messages import AIMessageChunk
+from coze_coding_utils.runtime_ctx.context import new_context
+
+import main
+
+
+FIRST_TOKEN_DELAY = 0.5  # 模拟模型首 token 延迟（秒）
+TOKEN_INTERVAL = 0.02  # 模拟 token 间隔（秒）
+
+
+class FakeGraph:
+    """模拟 CompiledStateGraph 的 stream/astream（stream_mode="messages"）"""
+
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+
+    def _chunk(self, i: int):
+        meta = {"langgraph_node": "model"}
+        if i == self.tokens - 1:
+            meta["chunk_position"] = "last"
+        return AIMessageChunk(content=f"tok{i} ", id="bench"), meta
+
+    def stream(self, *args, **kwargs):
+        time.sleep(FIRST_TOKEN_DELAY)
+        for i in range(self.tokens):
+            yield self._chunk(i)
+            time.sleep(TOKEN_INTERVAL)
+
+    async def astream(self, *args, **kwargs):
+        await asyncio.sleep(FIRST_TOKEN_DELAY)
+        for i in range(self.tokens):
+            yield self._chunk(i)
+            await asyncio.sleep(TOKEN_INTERVAL)
+
+
+def _payload(i: int):
+    return {
+        "type": "query",
+        "session_id": f"bench-{i}",
+        "content": {"query": {"prompt": [{"type": "text", "content": {"text": "hi"}}]}},
+    }
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+async def _one_stream(graph, i, ttfts):
+    ctx = new_context(method="bench")
+    t0 = time.perf_counter()
+    got_first = False
+    async for msg in main.service.astream(_payload(i), graph, run_config={}, ctx=ctx):
+        if not got_first and msg.type == "answer":
+            ttfts.append(time.perf_counter() - t0)
+            got_first = True
+
+
+async def _run_level(concurrency: int, tokens: int):
+    proc = psutil.Process()
+    graph = FakeGraph(tokens)
+    ttfts = []
+    peak = {"threads": threading.active_count(), "rss": proc.memory_info().rss}
+    done = asyncio.Event()
+
+    async def sampler():
+        while not done.is_set():
+            peak["threads"] = max(peak["threads"], threading.active_count())
+            peak["rss"] = max(peak["rss"], proc.memory_info().rss)
+            await asyncio.sleep(0.05)
+
+    sampler_task = asyncio.create_task(sampler())
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_one_stream(graph, i, ttfts) for i in range(concurrency)))
+    wall = time.perf_counter() - t0
+    done.set()
+    await sampler_task
+
+    return {
+        "threads": peak["threads"],
+        "rss_mb": peak["rss"] / 1024 / 1024,
+        "ttft_p50_ms": _percentile(ttfts, 50) * 1000,
+        "ttft_p99_ms": _percentile(ttfts, 99) * 1000,
+        "wall_s": wall,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark GraphService.astream")
+    parser.add_argument("--concurrency", type=str, default="50,200,500")
+    parser.add_argument("--tokens", type=int, default=20)
+    args = parser.parse_args()
+    levels = [int(x) for x in args.concurrency.split(",") if x]
+
+    print(f"{'mode':<8}{'conc':>6}{'threads':>9}{'rss_mb':>9}{'p50_ms':>9}{'p99_ms':>9}{'wall_s':>8}")
+    for mode, enabled in (("thread", False), ("async", True)):
+        main.ASYNC_STREAM_ENABLED = enabled
+        for n in levels:
+            r = asyncio.run(_run_level(n, args.tokens))
+            print(
+                f"{mode:<8}{n:>6}{r['threads']:>9}{r['rss_mb']:>9.1f}"
+                f"{r['ttft_p50_ms']:>9.1f}{r['ttft_p99_ms']:>9.1f}{r['wall_s']:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main_cli()
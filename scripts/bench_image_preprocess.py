@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+压测脚本：截图预处理的体积收益与对 analyze_image 端到端耗时的影响
+
+离线模式只做预处理，报告每张图的原始/处理后大小、预处理耗时，以及按上行带宽估算的传输耗时节省；
+--live 模式对每张图分别在关闭/开启预处理时调用 APKImageAnalyzerAgent.analyze_image，
+报告端到端耗时（需要模型相关环境变量）。
+
+用法:
+    python scripts/bench_image_preprocess.py assets/ [--max-edge 1568] [--format webp] [--quality 80]
+    python scripts/bench_image_preprocess.py assets/a.png --live
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from utils.file import image_preprocess
+from utils.file.image_preprocess import preprocess_image
+
+_IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+
+def _collect(paths):
+    for p in map(Path, paths):
+        if p.is_dir():
+            yield from sorted(f for f in p.iterdir() if f.suffix.lower() in _IMAGE_EXTENSIONS)
+        else:
+            yield p
+
+
+def _offline(files, args):
+    # base64 后体积约为 4/3
+    bytes_per_ms = args.uplink_mbps * 1e6 / 8 / 1000
+    total_in = total_out = 0
+    print(f"{'image':<32} {'orig KB':>9} {'out KB':>9} {'ratio':>7} {'prep ms':>8} {'upload ms saved':>16}")
+    for f in files:
+        data = f.read_bytes()
+        r = preprocess_image(data, "image/png", max_edge=args.max_edge, fmt=args.format, quality=args.quality)
+        saved_ms = r.saved_bytes * 4 / 3 / bytes_per_ms
+        total_in += r.original_bytes
+        total_out += r.output_bytes
+        print(
+            f"{f.name[:32]:<32} {r.original_bytes / 1024:>9.1f} {r.output_bytes / 1024:>9.1f} "
+            f"{r.output_bytes / max(1, r.original_bytes):>7.2f} {r.elapsed_ms:>8.1f} {saved_ms:>16.1f}"
+        )
+    if total_in:
+        print(f"\ntotal: {total_in / 1024:.1f} KB -> {total_out / 1024:.1f} KB "
+              f"(saved {(total_in - total_out) / 1024:.1f} KB, {1 - total_out / total_in:.0%})")
+
+
+def _live(files, args):
+    from agents.apk_image_analyzer_agent import get_analyzer
+
+    analyzer = get_analyzer()
+    timings = {False: [], True: []}
+    for f in files:
+        for enabled in (False, True):
+            image_preprocess.IMAGE_PREPROCESS_ENABLED = enabled
+            t0 = time.perf_counter()
+            analyzer.analyze_image(str(f.resolve()))
+            timings[enabled].append((time.perf_counter() - t0) * 1000)
+        print(f"{f.name}: original {timings[False][-1]:.0f}ms, preprocessed {timings[True][-1]:.0f}ms")
+    off, on = statistics.mean(timings[False]), statistics.mean(timings[True])
+    print(f"\nanalyze_image mean: original {off:.0f}ms, preprocessed {on:.0f}ms ({(off - on) / off:+.0%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="图片文件或目录")
+    parser.add_argument("--max-edge", type=int, default=image_preprocess.IMAGE_MAX_EDGE)
+    parser.add_argument("--format", choices=["webp", "jpeg"], default=image_preprocess.IMAGE_FORMAT)
+    parser.add_argument("--quality", type=int, default=image_preprocess.IMAGE_QUALITY)
+    parser.add_argument("--uplink-mbps", type=float, default=20.0, help="估算传输耗时使用的上行带宽")
+    parser.add_argument("--live", action="store_true", help="调用模型测量 analyze_image 端到端耗时")
+    args = parser.parse_args()
+
+    files = list(_collect(args.paths))
+    if not files:
+        sys.exit("no images found")
+    if args.live:
+        _live(files, args)
+    else:
+        # 离线模式使用空的临时缓存目录，每张图都重新编码
+        image_preprocess.IMAGE_CACHE_DIR = tempfile.mkdtemp(prefix="bench_image_preprocess_")
+        _offline(files, args)
+
+
+if __name__ == "__main__":
+    main()
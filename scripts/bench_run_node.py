@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+压测脚本：测量 GraphService.run_node 对一个空操作节点的调度开销
+
+- uncached: 每次调用前清空单节点图缓存，等价于旧实现（每次建图 + 编译 + 构建 LangGraphParser）
+- cached:   命中单节点图 LRU 缓存
+
+用法:
+    python scripts/bench_run_node.py [-n 500]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+# 以 agent 模式导入 main，避免加载 graphs.graph，随后替换为压测用的图
+os.environ.setdefault("COZE_PROJECT_TYPE", "agent")
+
+from pydantic import BaseModel
+from langgraph.graph import StateGraph, END
+from coze_coding_utils.runtime_ctx.context import new_context
+
+import main
+
+
+class EchoInput(BaseModel):
+    text: str = ""
+
+
+class EchoOutput(BaseModel):
+    text: str = ""
+
+
+def echo_node(state: EchoInput) -> EchoOutput:
+    """
+    title: 回显
+    desc: 压测用的空操作节点
+    """
+    return EchoOutput(text=state.text)
+
+
+def _build_graph():
+    g = StateGraph(EchoInput, input_schema=EchoInput, output_schema=EchoOutput)
+    g.add_node("echo_node", echo_node)
+    g.set_entry_point("echo_node")
+    g.add_edge("echo_node", END)
+    return g.compile()
+
+
+async def _measure(n: int, cached: bool):
+    costs = []
+    await main.service.run_node("echo_node", {"text": "warmup"}, new_context(method="bench"))
+    for _ in range(n):
+        if not cached:
+            main.service._get_node_graph.cache_clear()
+        ctx = new_context(method="bench")
+        t0 = time.perf_counter()
+        await main.service.run_node("echo_node", {"text": "hi"}, ctx)
+        costs.append((time.perf_counter() - t0) * 1000)
+    costs.sort()
+    return statistics.mean(costs), costs[int(len(costs) * 0.99) - 1]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark GraphService.run_node overhead")
+    parser.add_argument("-n", type=int, default=500)
+    args = parser.parse_args()
+
+    main.service.graph = _build_graph()
+    for label, cached in (("uncached", False), ("cached", True)):
+        mean_ms, p99_ms = asyncio.run(_measure(args.n, cached))
+        print(f"{label:<9} mean={mean_ms:.3f}ms p99={p99_ms:.3f}ms")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+压测脚本：测量单条 ServerMessage 的 SSE 序列化耗时
+
+- json:   旧实现，ServerMessage.dict()（递归 asdict 拷贝）+ json.dumps
+- orjson: utils.messages.serializer.sse_event，直接序列化 dataclass
+
+用法:
+    python scripts/bench_serialization.py [-n 100000]
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from utils.messages.server import (
+    ServerMessage,
+    ServerMessageContent,
+    ToolRequestDetail,
+    MESSAGE_TYPE_ANSWER,
+    MESSAGE_TYPE_TOOL_REQUEST,
+)
+from utils.messages.serializer import sse_event
+
+
+def _legacy_sse_event(sm: ServerMessage) -> str:
+    return f"event: message\ndata: {json.dumps(sm.dict(), ensure_ascii=False, default=str)}\n\n"
+
+
+def _samples():
+    base = dict(session_id="s-1", query_msg_id="q-1", reply_id="r-1", msg_id="m-1", log_id="log-1")
+    token = ServerMessage(
+        type=MESSAGE_TYPE_ANSWER, sequence_id=42, content=ServerMessageContent(answer="你好"), **base
+    )
+    tool = ServerMessage(
+        type=MESSAGE_TYPE_TOOL_REQUEST,
+        sequence_id=43,
+        content=ServerMessageContent(
+            tool_request=ToolRequestDetail(
+                tool_call_id="call-1",
+                tool_name="read_image_file",
+                parameters={"file_path": "/tmp/a.png", "options": {"detail": "high"}},
+            )
+        ),
+        **base,
+    )
+    return {"answer_token": token, "tool_request": tool}
+
+
+def _measure(fn, sm, n: int) -> float:
+    fn(sm)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn(sm)
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ServerMessage SSE serialization")
+    parser.add_argument("-n", type=int, default=100000)
+    args = parser.parse_args()
+
+    for name, sm in _samples().items():
+        assert json.loads(sse_event(sm).split("data: ", 1)[1]) == sm.dict()
+        legacy_us = _measure(_legacy_sse_event, sm, args.n)
+        fast_us = _measure(sse_event, sm, args.n)
+        print(
+            f"{name:<13} json={legacy_us:.2f}us/msg orjson={fast_us:.2f}us/msg "
+            f"speedup={legacy_us / fast_us:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
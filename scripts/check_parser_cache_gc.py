@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+检查脚本：LangGraphParser 缓存不会阻止编译图被回收
+
+get_graph_parser 按编译图实例缓存解析结果（WeakKeyDictionary）。解析器若强引用图本身，
+被单节点图 LRU 淘汰的图、配置变更后重新编译的 agent 都会一直留在内存里。
+本脚本构建并丢弃若干个编译图，gc 后检查缓存条目和图实例均已释放。
+
+用法:
+    python scripts/check_parser_cache_gc.py [-n 5]
+"""
+
+import argparse
+import gc
+import sys
+import weakref
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from pydantic import BaseModel
+from langgraph.graph import StateGraph, END
+
+from utils.log import parser as graph_parser
+
+
+class State(BaseModel):
+    x: int = 0
+
+
+def route(state: State) -> str:
+    """title: 路由"""
+    return "done"
+
+
+def build_graph():
+    def step(state: State) -> State:
+        """title: 步骤"""
+        return State(x=state.x + 1)
+
+    g = StateGraph(State)
+    g.add_node("step", step)
+    g.add_node("finish", step)
+    g.set_entry_point("step")
+    g.add_conditional_edges("step", route, {"done": "finish"})
+    g.add_edge("finish", END)
+    return g.compile()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=5, help="构建并丢弃的图数量")
+    args = ap.parse_args()
+
+    refs = []
+    for _ in range(args.n):
+        app = build_graph()
+        p = graph_parser.get_graph_parser(app)
+        assert graph_parser.get_graph_parser(app) is p, "同一个编译图应返回同一个解析器"
+        refs.append(weakref.ref(app))
+    del app, p
+    gc.collect()
+
+    alive = sum(1 for r in refs if r() is not None)
+    entries = len(graph_parser._parser_cache)
+    print(f"graphs alive: {alive}/{args.n}, parser cache entries: {entries}")
+    if alive or entries:
+        print("FAIL: 编译图或解析器缓存条目未被回收")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+本地模拟模型服务：OpenAI 兼容的 chat completions 接口，用于离线压测
+
+不访问真实模型网关，按配置的节奏输出 token：
+- 首 token 耗时（TTFT）与输出速度（tokens/s），可加随机抖动
+- 思考内容（reasoning_content 增量，与 doubao/deepseek 思考模型一致）
+- 请求带 tools 时按概率输出工具调用
+- 错误注入：请求直接失败（429/500/503 等）或流式输出中途断开
+- stream_options.include_usage 时在末尾返回 usage
+
+把服务指向它：
+    python scripts/fake_model_server.py --port 9100 --ttft-ms 800 --tps 40
+    COZE_INTEGRATION_MODEL_BASE_URL=http://127.0.0.1:9100/v1 python src/main.py
+
+build_agent 与 APKImageAnalyzerAgent 都通过 COZE_INTEGRATION_MODEL_BASE_URL 连接模型，无需改代码。
+单个请求可以用请求头覆盖配置，便于在同一次压测中混合不同场景：
+    X-Fake-TTFT-Ms, X-Fake-TPS, X-Fake-Output-Tokens, X-Fake-Thinking-Tokens,
+    X-Fake-Tool-Call-Rate, X-Fake-Error-Rate, X-Fake-Midstream-Error-Rate
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from dataclasses import dataclass, fields, replace
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_SAMPLE_TOKENS = (
+    "根据 构建 日志 ， 错误 发生 在 KAPT 阶段 。 Room 编译器 无法 解析 实体 类 的 字段 类型 ， "
+    "请 检查 @Entity 注解 与 TypeConverter 是否 注册 ， 然后 清理 缓存 后 重新 构建 。 "
+).split(" ")
+_THINKING_TOKENS = "先 看 What went wrong 段落 ， 再 对照 Caused by 定位 根因 。 ".split(" ")
+
+
+@dataclass
+class FakeModelConfig:
+    ttft_ms: float = float(os.getenv("FAKE_MODEL_TTFT_MS", "500"))
+    tps: float = float(os.getenv("FAKE_MODEL_TPS", "50"))
+    # TTFT 与 token 间隔的随机抖动比例
+    jitter: float = float(os.getenv("FAKE_MODEL_JITTER", "0.1"))
+    output_tokens: int = int(os.getenv("FAKE_MODEL_OUTPUT_TOKENS", "200"))
+    # 请求开启 thinking 时输出的思考 token 数
+    thinking_tokens: int = int(os.getenv("FAKE_MODEL_THINKING_TOKENS", "0"))
+    # 请求带 tools 且上一条不是工具结果时，输出工具调用的概率
+    tool_call_rate: float = float(os.getenv("FAKE_MODEL_TOOL_CALL_RATE", "0"))
+    error_rate: float = float(os.getenv("FAKE_MODEL_ERROR_RATE", "0"))
+    error_status: int = int(os.getenv("FAKE_MODEL_ERROR_STATUS", "500"))
+    midstream_error_rate: float = float(os.getenv("FAKE_MODEL_MIDSTREAM_ERROR_RATE", "0"))
+    seed: Optional[int] = None
+
+
+_HEADER_OVERRIDES = {
+    "x-fake-ttft-ms": "ttft_ms",
+    "x-fake-tps": "tps",
+    "x-fake-output-tokens": "output_tokens",
+    "x-fake-thinking-tokens": "thinking_tokens",
+    "x-fake-tool-call-rate": "tool_call_rate",
+    "x-fake-error-rate": "error_rate",
+    "x-fake-error-status": "error_status",
+    "x-fake-midstream-error-rate": "midstream_error_rate",
+}
+
+
+class _Stats:
+    def __init__(self):
+        self.requests = 0
+        self.streams = 0
+        self.errors_injected = 0
+        self.midstream_errors = 0
+        self.tool_calls = 0
+        self.tokens = 0
+
+
+def _request_config(base: FakeModelConfig, request: Request) -> FakeModelConfig:
+    types = {f.name: f.type for f in fields(FakeModelConfig)}
+    overrides: Dict[str, Any] = {}
+    for header, name in _HEADER_OVERRIDES.items():
+        value = request.headers.get(header)
+        if value is not None:
+            overrides[name] = (int if types[name] in (int, "int") else float)(value)
+    return replace(base, **overrides) if overrides else base
+
+
+def _estimate_prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    # 与 utils.build_log.estimate_tokens 相同的粗略估算，图片按固定值计
+    total = 0
+    for msg in messages:
+        content = msg.get("content")
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+        for part in parts:
+            if isinstance(part, dict) and part.get("type") == "text":
+                text = part.get("text") or ""
+                wide = (len(text.encode("utf-8")) - len(text)) // 2
+                total += (len(text) - wide) // 4 + wide
+            else:
+                total += 1000
+    return total
+
+
+def _thinking_enabled(body: Dict[str, Any]) -> bool:
+    thinking = body.get("thinking")
+    return isinstance(thinking, dict) and thinking.get("type") == "enabled"
+
+
+def _fake_arguments(tool: Dict[str, Any]) -> str:
+    """按 JSON Schema 的必填字段生成参数"""
+    params = (tool.get("function") or {}).get("parameters") or {}
+    props = params.get("properties") or {}
+    args = {}
+    for name in params.get("required") or []:
+        kind = (props.get(name) or {}).get("type")
+        args[name] = {"integer": 1, "number": 1.0, "boolean": True, "array": [], "object": {}}.get(kind, "fake")
+    return json.dumps(args, ensure_ascii=False)
+
+
+def _plan_tool_call(body: Dict[str, Any], cfg: FakeModelConfig, rng: random.Random) -> Optional[Dict[str, Any]]:
+    tools = body.get("tools") or []
+    messages = body.get("messages") or []
+    if not tools or (messages and messages[-1].get("role") == "tool"):
+        return None
+    if rng.random() >= cfg.tool_call_rate:
+        return None
+    tool = rng.choice(tools)
+    return {
+        "index": 0,
+        "id": f"call_{uuid.uuid4().hex[:24]}",
+        "type": "function",
+        "function": {"name": (tool.get("function") or {}).get("name", "tool"), "arguments": _fake_arguments(tool)},
+    }
+
+
+class _Pacer:
+    """按绝对时间点输出，避免 sleep 误差累积"""
+
+    def __init__(self, cfg: FakeModelConfig, rng: random.Random):
+        self.cfg = cfg
+        self.rng = rng
+        self.next_at = time.monotonic()
+
+    def _jittered(self, seconds: float) -> float:
+        return max(0.0, seconds * (1 + self.rng.uniform(-self.cfg.jitter, self.cfg.jitter)))
+
+    async def first(self):
+        self.next_at += self._jittered(self.cfg.ttft_ms / 1000)
+        await asyncio.sleep(max(0.0, self.next_at - time.monotonic()))
+
+    async def next(self):
+        if self.cfg.tps > 0:
+            self.next_at += self._jittered(1 / self.cfg.tps)
+            await asyncio.sleep(max(0.0, self.next_at - time.monotonic()))
+
+
+def create_app(config: FakeModelConfig) -> FastAPI:
+    app = FastAPI()
+    stats = _Stats()
+    rng = random.Random(config.seed)
+
+    def chunk(completion_id: str, model: str, delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def stream(body: Dict[str, Any], cfg: FakeModelConfig) -> AsyncIterator[str]:
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = body.get("model") or "fake-model"
+        pacer = _Pacer(cfg, rng)
+        tool_call = _plan_tool_call(body, cfg, rng)
+        thinking = cfg.thinking_tokens if _thinking_enabled(body) else 0
+        # 中途断开发生在输出到一半时
+        fail_at = (thinking + cfg.output_tokens) // 2 if rng.random() < cfg.midstream_error_rate else -1
+        emitted = 0
+
+        await pacer.first()
+        yield chunk(completion_id, model, {"role": "assistant", "content": ""})
+        for i in range(thinking):
+            if emitted == fail_at:
+                stats.midstream_errors += 1
+                raise ConnectionResetError("fake model: injected mid-stream failure")
+            yield chunk(completion_id, model, {"reasoning_content": _THINKING_TOKENS[i % len(_THINKING_TOKENS)]})
+            emitted += 1
+            await pacer.next()
+
+        if tool_call is not None:
+            stats.tool_calls += 1
+            yield chunk(completion_id, model, {"tool_calls": [tool_call]})
+            finish_reason, output = "tool_calls", 0
+        else:
+            finish_reason, output = "stop", cfg.output_tokens
+            for i in range(output):
+                if emitted == fail_at:
+                    stats.midstream_errors += 1
+                    raise ConnectionResetError("fake model: injected mid-stream failure")
+                yield chunk(completion_id, model, {"content": _SAMPLE_TOKENS[i % len(_SAMPLE_TOKENS)]})
+                emitted += 1
+                await pacer.next()
+        yield chunk(completion_id, model, {}, finish_reason)
+        stats.tokens += emitted
+
+        if (body.get("stream_options") or {}).get("include_usage"):
+            prompt_tokens = _estimate_prompt_tokens(body.get("messages") or [])
+            completion_tokens = emitted + (1 if tool_call else 0)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "completion_tokens_details": {"reasoning_tokens": thinking},
+            }
+            data = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [], "usage": usage}
+            yield f"data: {json.dumps(data)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    async def complete(body: Dict[str, Any], cfg: FakeModelConfig) -> Dict[str, Any]:
+        tool_call = _plan_tool_call(body, cfg, rng)
+        thinking = cfg.thinking_tokens if _thinking_enabled(body) else 0
+        output = 0 if tool_call else cfg.output_tokens
+        pacer = _Pacer(cfg, rng)
+        await pacer.first()
+        if cfg.tps > 0:
+            await asyncio.sleep((thinking + output) / cfg.tps)
+        message: Dict[str, Any] = {
+            "role": "assistant",
+            "content": "".join(_SAMPLE_TOKENS[i % len(_SAMPLE_TOKENS)] for i in range(output)),
+        }
+        if thinking:
+            message["reasoning_content"] = "".join(_THINKING_TOKENS[i % len(_THINKING_TOKENS)] for i in range(thinking))
+        if tool_call is not None:
+            stats.tool_calls += 1
+            message["tool_calls"] = [{k: v for k, v in tool_call.items() if k != "index"}]
+        stats.tokens += thinking + output
+        prompt_tokens = _estimate_prompt_tokens(body.get("messages") or [])
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model") or "fake-model",
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_call else "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": thinking + output,
+                "total_tokens": prompt_tokens + thinking + output,
+            },
+        }
+
+    @app.post("/chat/completions")
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        cfg = _request_config(config, request)
+        stats.requests += 1
+        if rng.random() < cfg.error_rate:
+            stats.errors_injected += 1
+            await asyncio.sleep(cfg.ttft_ms / 1000 * rng.random())
+            return JSONResponse(
+                status_code=cfg.error_status,
+                content={"error": {"message": "fake model: injected error", "type": "fake_error", "code": str(cfg.error_status)}},
+            )
+        if body.get("stream"):
+            stats.streams += 1
+            return StreamingResponse(stream(body, cfg), media_type="text/event-stream")
+        return await complete(body, cfg)
+
+    @app.get("/models")
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "fake-model", "object": "model", "owned_by": "fake"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return {**vars(stats), "config": vars(config)}
+
+    return app
+
+
+def main():
+    defaults = FakeModelConfig()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft-ms", type=float, default=defaults.ttft_ms)
+    parser.add_argument("--tps", type=float, default=defaults.tps, help="每秒输出 token 数，0 表示不限速")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter)
+    parser.add_argument("--output-tokens", type=int, default=defaults.output_tokens)
+    parser.add_argument("--thinking-tokens", type=int, default=defaults.thinking_tokens)
+    parser.add_argument("--tool-call-rate", type=float, default=defaults.tool_call_rate)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    parser.add_argument("--midstream-error-rate", type=float, default=defaults.midstream_error_rate)
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，固定后错误注入与工具调用可复现")
+    args = parser.parse_args()
+
+    config = FakeModelConfig(**{f.name: getattr(args, f.name) for f in fields(FakeModelConfig)})
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,16 +5,20 @@ set -e
 
 WORK_DIR="${COZE_WORKSPACE_PATH:-.}"
 PORT=8000
+WORKERS="${HTTP_WORKERS:-1}"
 
 usage() {
-  echo "用法: $0 -p <端口>"
+  echo "用法: $0 -p <端口> [-w <worker进程数>]"
 }
 
-while getopts "p:h" opt; do
+while getopts "p:w:h" opt; do
   case "$opt" in
     p)
       PORT="$OPTARG"
       ;;
+    w)
+      WORKERS="$OPTARG"
+      ;;
     h)
       usage
       exit 0
@@ -28,4 +32,4 @@ while getopts "p:h" opt; do
 done
 
 
-python ${WORK_DIR}/src/main.py -m http -p $PORT
+python ${WORK_DIR}/src/main.py -m http -p $PORT -w $WORKERS
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+启动耗时报告：以 python -X importtime 方式导入服务入口模块，按累计耗时列出最重的导入
+
+先导入一次预热（文件系统缓存、.pyc 编译），再导入 --runs 次，取中位数与预算比较，
+避免首次冷启动的抖动导致误报；明细表取中位数那一次的结果。
+超过预算时以非零状态码退出，可直接作为 CI 检查使用。
+
+用法:
+    python scripts/import_time_report.py [--module main] [--top 25] [--budget-ms 1500] [--runs 3]
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+SRC = ROOT / "src"
+
+# 默认预算（毫秒），可通过环境变量覆盖
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+
+# import time:       self [us] |  cumulative | imported package
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def collect(module: str):
+    """在独立解释器中导入 module，返回 [(模块名, 自身耗时us, 累计耗时us, 层级)]"""
+    env = dict(os.environ)
+    env.setdefault("COZE_WORKSPACE_PATH", str(ROOT))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(SRC), env.get("PYTHONPATH")]))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=str(SRC), env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr[-4000:])
+        raise SystemExit(f"import {module} failed with exit code {proc.returncode}")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            self_us, cum_us, indent, name = m.groups()
+            # 每层缩进 2 个空格，首层带 1 个前导空格
+            rows.append((name, int(self_us), int(cum_us), max(0, (len(indent) - 1) // 2)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import time of the service entry module")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_TIME_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=3, help="预热后计时的导入次数，取中位数")
+    args = parser.parse_args()
+
+    def total_of(rows):
+        return next((cum for name, _, cum, _ in rows if name == args.module), sum(s for _, s, _, _ in rows))
+
+    # 预热一次，不计入结果
+    collect(args.module)
+    runs = sorted((collect(args.module) for _ in range(max(1, args.runs))), key=total_of)
+    rows = runs[len(runs) // 2]
+    totals = [total_of(r) for r in runs]
+    total = statistics.median(totals)
+
+    # 按顶层包汇总各模块自身耗时（累计耗时会在父子模块间重复计算）
+    top_level = {}
+    for name, self_us, _, _ in rows:
+        root = name.split(".")[0]
+        top_level[root] = top_level.get(root, 0) + self_us
+
+    print(f"{'cumulative(ms)':>14}  {'self(ms)':>9}  module")
+    for name, self_us, cum_us, level in sorted(rows, key=lambda r: r[2], reverse=True)[:args.top]:
+        print(f"{cum_us / 1000:>14.1f}  {self_us / 1000:>9.1f}  {'  ' * level}{name}")
+
+    print("\nby top-level package (self time):")
+    for root, self_us in sorted(top_level.items(), key=lambda kv: kv[1], reverse=True)[:args.top]:
+        print(f"{self_us / 1000:>14.1f}  {root}")
+
+    total_ms = total / 1000
+    runs_ms = ", ".join(f"{t / 1000:.0f}" for t in totals)
+    print(f"\nimport {args.module}: median {total_ms:.1f}ms over {len(totals)} warm runs [{runs_ms}] (budget {args.budget_ms:.0f}ms)")
+    if total_ms > args.budget_ms:
+        print(f"FAIL: import time exceeds budget by {total_ms - args.budget_ms:.1f}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
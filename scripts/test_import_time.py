@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+测试脚本：服务入口模块的导入耗时不超过预算
+
+运行 import_time_report.py（预热后取多次导入的中位数），超过 IMPORT_TIME_BUDGET_MS 时失败。
+
+用法:
+    python -m pytest scripts/test_import_time.py
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+SCRIPT = Path(__file__).parent / "import_time_report.py"
+
+
+def test_import_time_within_budget():
+    proc = subprocess.run(
+        [sys.executable, str(SCRIPT), "--top", "10"],
+        capture_output=True, text=True, timeout=600,
+    )
+    assert proc.returncode == 0, proc.stdout[-4000:] + proc.stderr[-4000:]
+
+
+if __name__ == "__main__":
+    test_import_time_within_budget()
+    print("OK")
@@ -1,45 +1,25 @@
 import os
-import json
 from typing import Annotated
 from langchain.agents import create_agent
 from langchain_openai import ChatOpenAI
 from langgraph.graph import MessagesState
-from langgraph.graph.message import add_messages
 from langchain_core.messages import AnyMessage
-from coze_coding_utils.runtime_ctx.context import default_headers
 from storage.memory.memory_saver import get_memory_saver
+from utils.helper.agent_cache import load_llm_config, get_or_build_agent, RequestHeadersMiddleware
+from utils.helper.http_pool import get_sync_client, get_async_client
+from utils.build_log.middleware import BuildLogReducerMiddleware, ErrorAnswerCacheMiddleware
+from utils.history import compact_messages
+from utils.budget.token_budget import TokenBudgetMiddleware
+from utils.helper.prompt_prefix import compile_prompt, PromptPrefixMiddleware
 
 LLM_CONFIG = "config/agent_llm_config.json"
 
-# 默认保留最近 20 轮对话 (40 条消息)
 # 对于错误分析场景，需要记住之前的上下文，以便追踪问题解决进度
-MAX_MESSAGES = 40
-
-def _windowed_messages(old, new):
-    """滑动窗口: 只保留最近 MAX_MESSAGES 条消息"""
-    return add_messages(old, new)[-MAX_MESSAGES:] # type: ignore
-
+# 历史按 token 预算保留（HISTORY_TOKEN_BUDGET），较早轮次中的大段构建日志压缩为错误区域摘要，原文可按引用取回
 class AgentState(MessagesState):
-    messages: Annotated[list[AnyMessage], _windowed_messages]
+    messages: Annotated[list[AnyMessage], compact_messages]
 
-def build_agent(ctx=None):
-    """
-    构建Android构建错误分析Agent
-    
-    该Agent专门用于分析Android构建错误日志，提供专业的解决方案。
-    使用思考模型进行深度推理，能够识别KAPT、依赖冲突、缓存问题等常见错误。
-    """
-    workspace_path = os.getenv("COZE_WORKSPACE_PATH", "/workspace/projects")
-    config_path = os.path.join(workspace_path, LLM_CONFIG)
-    
-    # 读取配置文件
-    with open(config_path, 'r', encoding='utf-8') as f:
-        cfg = json.load(f)
-    
-    # 获取API配置
-    api_key = os.getenv("COZE_WORKLOAD_IDENTITY_API_KEY")
-    base_url = os.getenv("COZE_INTEGRATION_MODEL_BASE_URL")
-    
+def _compile_agent(cfg, api_key, base_url):
     # 创建LLM实例
     # 使用doubao-seed-1-6-thinking-250715思考模型进行深度错误分析
     # 启用thinking模式以支持复杂推理
@@ -50,23 +30,57 @@ def build_agent(ctx=None):
         temperature=cfg['config'].get('temperature', 0.7),
         streaming=True,
         timeout=cfg['config'].get('timeout', 600),
+        # 共享连接池，跨 Agent 与重新编译复用到模型网关的连接
+        http_client=get_sync_client(),
+        http_async_client=get_async_client(),
+        # 流式输出时也返回 usage，用于 token 统计与预算
+        stream_usage=True,
         extra_body={
             "thinking": {
                 "type": cfg['config'].get('thinking', 'enabled')
             }
         },
-        default_headers=default_headers(ctx) if ctx else {}
     )
-    
+
     # 创建Agent
     # 该Agent不使用工具，完全依赖大语言模型的分析能力
     # 通过精心设计的System Prompt，植入Android构建错误的知识库
-    agent = create_agent(
+    # System Prompt 编译一次，保证每轮、每个会话的前缀字节一致，提高服务端前缀缓存命中
+    compiled = compile_prompt(cfg.get("sp"))
+    return create_agent(
         model=llm,
-        system_prompt=cfg.get("sp"),
+        system_prompt=compiled.system_prompt,
         tools=[],  # 无需工具，直接使用LLM分析能力
         checkpointer=get_memory_saver(),
         state_schema=AgentState,
+        middleware=[
+            RequestHeadersMiddleware(),  # 请求级 headers 在调用时注入，不随请求重建 Agent
+            TokenBudgetMiddleware(),  # 会话/项目 token 预算检查与用量累计
+            ErrorAnswerCacheMiddleware(),  # 相同错误特征复用已有分析结果，需在精简之前基于原始日志计算特征
+            BuildLogReducerMiddleware(),  # 大段构建日志只把错误区域发给模型
+            PromptPrefixMiddleware(compiled),  # 记录前缀缓存命中
+        ],
     )
+
+
+def build_agent(ctx=None):
+    """
+    构建Android构建错误分析Agent
+    
+    该Agent专门用于分析Android构建错误日志，提供专业的解决方案。
+    使用思考模型进行深度推理，能够识别KAPT、依赖冲突、缓存问题等常见错误。
+
+    编译结果按配置文件哈希和模型设置做进程级缓存，ctx 中的请求头在每次模型调用时注入。
+    """
+    workspace_path = os.getenv("COZE_WORKSPACE_PATH", "/workspace/projects")
+    config_path = os.path.join(workspace_path, LLM_CONFIG)
+    
+    # 读取配置文件（文件未变化时命中缓存）
+    cfg, cfg_hash = load_llm_config(config_path)
+    
+    # 获取API配置
+    api_key = os.getenv("COZE_WORKLOAD_IDENTITY_API_KEY")
+    base_url = os.getenv("COZE_INTEGRATION_MODEL_BASE_URL")
     
-    return agent
+    cache_key = (cfg_hash, api_key, base_url)
+    return get_or_build_agent(__name__, cache_key, lambda: _compile_agent(cfg, api_key, base_url))
@@ -4,28 +4,102 @@ APK测试图片分析Agent
 """
 import os
 import json
-from typing import Annotated
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Annotated, Any, AsyncIterator, Iterable, Iterator
 from langchain.agents import create_agent
 from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage
 from langchain_openai import ChatOpenAI
 from langgraph.graph import MessagesState
-from langgraph.graph.message import add_messages
-from coze_coding_utils.runtime_ctx.context import default_headers, new_context
+from coze_coding_utils.runtime_ctx.context import new_context
 from coze_coding_dev_sdk import LLMClient
 from storage.memory.memory_saver import get_memory_saver
+from utils.helper.agent_cache import load_llm_config, get_or_build_agent, RequestHeadersMiddleware
+from utils.helper.http_pool import get_sync_client, get_async_client
+from utils.history import compact_messages
+from utils.budget.token_budget import TokenBudgetMiddleware
+from utils.helper.prompt_prefix import compile_prompt, PromptPrefixMiddleware
+from utils.error import ErrorCode, classify_error
 from tools.image_reader_tool import read_image_file, list_available_images, get_image_dimensions
 
 LLM_CONFIG = "config/apk_image_analyzer_config.json"
 
-# 默认保留最近 20 轮对话 (40 条消息)
-MAX_MESSAGES = 40
+# 历史按 token 预算保留（HISTORY_TOKEN_BUDGET），较早轮次中的 base64 图片替换为引用，原文可按引用取回
+class AgentState(MessagesState):
+    messages: Annotated[list[AnyMessage], compact_messages]
 
-def _windowed_messages(old, new):
-    """滑动窗口: 只保留最近 MAX_MESSAGES 条消息"""
-    return add_messages(old, new)[-MAX_MESSAGES:]
 
-class AgentState(MessagesState):
-    messages: Annotated[list[AnyMessage], _windowed_messages]
+# 批量分析：同时分析的图片数上限、每秒请求数上限（0 表示不限）、瞬时错误重试次数
+APK_ANALYZE_CONCURRENCY = int(os.getenv("APK_ANALYZE_CONCURRENCY", "8"))
+APK_ANALYZE_RATE_LIMIT = float(os.getenv("APK_ANALYZE_RATE_LIMIT", "5"))
+APK_ANALYZE_MAX_RETRIES = int(os.getenv("APK_ANALYZE_MAX_RETRIES", "2"))
+_RETRY_BACKOFF_BASE = 1.0  # 秒，按 1s、2s、4s ... 退避
+
+DEFAULT_QUESTION = "请分析这张APK测试截图，识别问题并提供优化建议"
+
+# 限流、超时、连接类错误可重试
+_TRANSIENT_ERROR_CODES = {
+    ErrorCode.API_LLM_RATE_LIMIT,
+    ErrorCode.API_NETWORK_TIMEOUT,
+    ErrorCode.API_NETWORK_CONNECTION,
+    ErrorCode.API_NETWORK_BROKEN_PIPE,
+    ErrorCode.API_NETWORK_REMOTE_PROTOCOL,
+}
+
+
+class ImageReadError(ValueError):
+    """图片读取失败，不重试"""
+
+
+@dataclass
+class ImageAnalysisResult:
+    """单张图片的分析结果"""
+    index: int  # 在输入列表中的位置
+    image_path: str
+    ok: bool
+    result: str = ""
+    error: str = ""
+    attempts: int = 0
+    elapsed_ms: int = 0
+
+
+class _RateLimiter:
+    """均匀间隔限流：reserve() 预约下一个发送时间点，返回需要等待的秒数；同步与异步路径共用"""
+
+    def __init__(self, rate_per_sec: float):
+        self.interval = 1.0 / rate_per_sec if rate_per_sec > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self.interval
+            return at - now
+
+
+def _is_transient(error: Exception) -> bool:
+    return classify_error(error).code in _TRANSIENT_ERROR_CODES
+
+
+def _extract_text(response: Any) -> str:
+    if isinstance(response.content, str):
+        return response.content
+    elif isinstance(response.content, list):
+        if response.content and isinstance(response.content[0], str):
+            return " ".join(response.content)
+        else:
+            text_parts = [item.get("text", "") for item in response.content
+                         if isinstance(item, dict) and item.get("type") == "text"]
+            return " ".join(text_parts)
+    else:
+        return str(response.content)
 
 
 class APKImageAnalyzerAgent:
@@ -34,7 +108,8 @@ class APKImageAnalyzerAgent:
     def __init__(self):
         self.workspace_path = os.getenv("COZE_WORKSPACE_PATH", "/workspace/projects")
         self.config = self._load_config()
-        self.llm_client = None
+        # LLMClient 不保证线程安全，每个线程各持有一个
+        self._local = threading.local()
     
     def _load_config(self):
         """加载配置文件"""
@@ -43,30 +118,23 @@ class APKImageAnalyzerAgent:
             return json.load(f)
     
     def _get_llm_client(self, ctx=None):
-        """获取LLM客户端"""
-        if self.llm_client is None:
+        """获取当前线程的LLM客户端，可在多个线程中并发使用"""
+        client = getattr(self._local, "llm_client", None)
+        if client is None:
             # 不传递config参数，使用默认环境变量配置
-            self.llm_client = LLMClient(
+            client = LLMClient(
                 ctx=ctx if ctx else new_context(method="analyze_image")
             )
-        return self.llm_client
-    
-    def analyze_image(self, image_path: str, question: str = "请分析这张APK测试截图，识别问题并提供优化建议") -> str:
-        """
-        分析APK测试图片
-        
-        Args:
-            image_path: 图片文件路径
-            question: 分析问题
-            
-        Returns:
-            分析结果
-        """
+            self._local.llm_client = client
+        return client
+
+    def _analyze_once(self, image_path: str, question: str) -> str:
+        """分析一张图片，失败时抛出异常"""
         # 读取图片
         image_result = read_image_file.invoke({"image_path": image_path})
         
         if image_result.startswith("错误："):
-            return image_result
+            raise ImageReadError(image_result)
         
         # 构建消息
         messages = [
@@ -86,30 +154,135 @@ class APKImageAnalyzerAgent:
         ]
         
         # 调用多模态模型
-        try:
-            client = self._get_llm_client()
-            response = client.invoke(
-                messages=messages,
-                model=self.config['config'].get("model", "doubao-seed-1-6-vision-250815"),
-                temperature=self.config['config'].get('temperature', 0.7),
-                max_completion_tokens=self.config['config'].get('max_completion_tokens', 10000)
-            )
-            
-            # 提取文本内容
-            if isinstance(response.content, str):
-                return response.content
-            elif isinstance(response.content, list):
-                if response.content and isinstance(response.content[0], str):
-                    return " ".join(response.content)
-                else:
-                    text_parts = [item.get("text", "") for item in response.content 
-                                 if isinstance(item, dict) and item.get("type") == "text"]
-                    return " ".join(text_parts)
-            else:
-                return str(response.content)
+        client = self._get_llm_client()
+        response = client.invoke(
+            messages=messages,
+            model=self.config['config'].get("model", "doubao-seed-1-6-vision-250815"),
+            temperature=self.config['config'].get('temperature', 0.7),
+            max_completion_tokens=self.config['config'].get('max_completion_tokens', 10000)
+        )
         
+        # 提取文本内容
+        return _extract_text(response)
+    
+    def analyze_image(self, image_path: str, question: str = DEFAULT_QUESTION) -> str:
+        """
+        分析APK测试图片
+        
+        Args:
+            image_path: 图片文件路径
+            question: 分析问题
+            
+        Returns:
+            分析结果
+        """
+        try:
+            return self._analyze_once(image_path, question)
+        except ImageReadError as e:
+            return str(e)
         except Exception as e:
             return f"分析失败：{str(e)}"
+
+    def _analyze_with_retry(
+        self, index: int, image_path: str, question: str, limiter: _RateLimiter, max_retries: int
+    ) -> ImageAnalysisResult:
+        t0 = time.monotonic()
+        attempts = 0
+        while True:
+            attempts += 1
+            time.sleep(limiter.reserve())
+            try:
+                text = self._analyze_once(image_path, question)
+                return ImageAnalysisResult(index, image_path, True, result=text, attempts=attempts,
+                                           elapsed_ms=int((time.monotonic() - t0) * 1000))
+            except Exception as e:
+                if attempts > max_retries or not _is_transient(e):
+                    return ImageAnalysisResult(index, image_path, False, error=str(e), attempts=attempts,
+                                               elapsed_ms=int((time.monotonic() - t0) * 1000))
+                time.sleep(_RETRY_BACKOFF_BASE * 2 ** (attempts - 1))
+
+    async def _aanalyze_with_retry(
+        self, index: int, image_path: str, question: str, limiter: _RateLimiter, max_retries: int
+    ) -> ImageAnalysisResult:
+        t0 = time.monotonic()
+        attempts = 0
+        while True:
+            attempts += 1
+            await asyncio.sleep(limiter.reserve())
+            try:
+                # LLMClient 只有同步接口，放到线程中执行；每个线程使用自己的客户端
+                text = await asyncio.to_thread(self._analyze_once, image_path, question)
+                return ImageAnalysisResult(index, image_path, True, result=text, attempts=attempts,
+                                           elapsed_ms=int((time.monotonic() - t0) * 1000))
+            except Exception as e:
+                if attempts > max_retries or not _is_transient(e):
+                    return ImageAnalysisResult(index, image_path, False, error=str(e), attempts=attempts,
+                                               elapsed_ms=int((time.monotonic() - t0) * 1000))
+                await asyncio.sleep(_RETRY_BACKOFF_BASE * 2 ** (attempts - 1))
+
+    def analyze_images(
+        self,
+        image_paths: Iterable[str],
+        question: str = DEFAULT_QUESTION,
+        max_concurrency: int = APK_ANALYZE_CONCURRENCY,
+        rate_limit: float = APK_ANALYZE_RATE_LIMIT,
+        ordered: bool = True,
+        max_retries: int = APK_ANALYZE_MAX_RETRIES,
+    ) -> Iterator[ImageAnalysisResult]:
+        """
+        并发分析多张图片，逐个产出结果
+
+        Args:
+            image_paths: 图片文件路径列表
+            question: 分析问题
+            max_concurrency: 同时分析的图片数上限
+            rate_limit: 每秒发起的模型请求数上限，0 表示不限
+            ordered: True 按输入顺序产出，False 按完成顺序产出
+            max_retries: 限流、超时等瞬时错误的重试次数
+
+        Returns:
+            ImageAnalysisResult 迭代器；单张失败不影响其它图片
+        """
+        paths = list(image_paths)
+        limiter = _RateLimiter(rate_limit)
+        executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="apk-analyze")
+        try:
+            futures = [
+                executor.submit(self._analyze_with_retry, i, path, question, limiter, max_retries)
+                for i, path in enumerate(paths)
+            ]
+            for future in (futures if ordered else as_completed(futures)):
+                yield future.result()
+        finally:
+            # 调用方提前停止迭代时，未开始的任务直接取消
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def aanalyze_images(
+        self,
+        image_paths: Iterable[str],
+        question: str = DEFAULT_QUESTION,
+        max_concurrency: int = APK_ANALYZE_CONCURRENCY,
+        rate_limit: float = APK_ANALYZE_RATE_LIMIT,
+        ordered: bool = True,
+        max_retries: int = APK_ANALYZE_MAX_RETRIES,
+    ) -> AsyncIterator[ImageAnalysisResult]:
+        """analyze_images 的异步版本，参数与返回含义相同"""
+        paths = list(image_paths)
+        limiter = _RateLimiter(rate_limit)
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def run(i: int, path: str) -> ImageAnalysisResult:
+            async with semaphore:
+                return await self._aanalyze_with_retry(i, path, question, limiter, max_retries)
+
+        tasks = [asyncio.create_task(run(i, path)) for i, path in enumerate(paths)]
+        try:
+            for task in (tasks if ordered else asyncio.as_completed(tasks)):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
     
     def list_images(self) -> str:
         """列出可用的图片文件"""
@@ -131,21 +304,7 @@ def get_analyzer():
     return _analyzer_instance
 
 
-def build_agent(ctx=None):
-    """
-    构建Agent（用于LangGraph）
-    
-    注意：此Agent主要用于多模态图片分析，使用专门的LLMClient
-    """
-    workspace_path = os.getenv("COZE_WORKSPACE_PATH", "/workspace/projects")
-    config_path = os.path.join(workspace_path, LLM_CONFIG)
-    
-    with open(config_path, 'r', encoding='utf-8') as f:
-        cfg = json.load(f)
-    
-    api_key = os.getenv("COZE_WORKLOAD_IDENTITY_API_KEY")
-    base_url = os.getenv("COZE_INTEGRATION_MODEL_BASE_URL")
-    
+def _compile_agent(cfg, api_key, base_url):
     # 创建LLM（用于常规对话）
     llm = ChatOpenAI(
         model=cfg['config'].get("model", "doubao-seed-1-6-vision-250815"),
@@ -154,21 +313,48 @@ def build_agent(ctx=None):
         temperature=cfg['config'].get('temperature', 0.7),
         streaming=True,
         timeout=cfg['config'].get('timeout', 600),
+        # 共享连接池，跨 Agent 与重新编译复用到模型网关的连接
+        http_client=get_sync_client(),
+        http_async_client=get_async_client(),
+        # 流式输出时也返回 usage，用于 token 统计与预算
+        stream_usage=True,
         extra_body={
             "thinking": {
                 "type": cfg['config'].get('thinking', 'disabled')
             }
         },
-        default_headers=default_headers(ctx) if ctx else {}
     )
     
     # 注意：图片分析使用专门的LLMClient，不在create_agent中处理
     # Agent主要用于工具调用和对话管理
+    tools = [read_image_file, list_available_images, get_image_dimensions]
+    # system prompt 与工具 schema 编译一次，保证每次请求的前缀字节一致，提高服务端前缀缓存命中
+    compiled = compile_prompt(cfg.get("sp"), tools)
     
     return create_agent(
         model=llm,
-        system_prompt=cfg.get("sp"),
-        tools=[read_image_file, list_available_images, get_image_dimensions],
+        system_prompt=compiled.system_prompt,
+        tools=tools,
         checkpointer=get_memory_saver(),
         state_schema=AgentState,
+        middleware=[RequestHeadersMiddleware(), TokenBudgetMiddleware(), PromptPrefixMiddleware(compiled)],
     )
+
+
+def build_agent(ctx=None):
+    """
+    构建Agent（用于LangGraph）
+    
+    注意：此Agent主要用于多模态图片分析，使用专门的LLMClient
+    编译结果按配置文件哈希和模型设置缓存，请求头在模型调用时注入
+    """
+    workspace_path = os.getenv("COZE_WORKSPACE_PATH", "/workspace/projects")
+    config_path = os.path.join(workspace_path, LLM_CONFIG)
+    
+    cfg, cfg_hash = load_llm_config(config_path)
+    
+    api_key = os.getenv("COZE_WORKLOAD_IDENTITY_API_KEY")
+    base_url = os.getenv("COZE_INTEGRATION_MODEL_BASE_URL")
+    
+    cache_key = (cfg_hash, api_key, base_url)
+    return get_or_build_agent(__name__, cache_key, lambda: _compile_agent(cfg, api_key, base_url))
@@ -0,0 +1,6 @@
+"""pytest 配置：模块以 src 为根导入（与服务运行时一致）"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
@@ -1,19 +1,28 @@
 import argparse
 import asyncio
+import functools
 import json
+import os
 import traceback
 import logging
-from typing import Any, Dict, Iterable, AsyncIterable, AsyncGenerator, Optional
+import importlib
+from typing import Any, Dict, Iterable, AsyncIterable, AsyncGenerator, Optional, TYPE_CHECKING
+import signal
+import sys
+import socket
 import threading
 import contextvars
-import cozeloop
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
 import uvicorn
 import time
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from starlette.background import BackgroundTask
 from langchain_core.runnables import RunnableConfig
-from langgraph.graph import StateGraph, END
-from langgraph.graph.state import CompiledStateGraph
 
 from coze_coding_utils.runtime_ctx.context import new_context, Context
 from utils.helper import graph_helper
@@ -21,11 +30,27 @@ from utils.log.node_log import LOG_FILE
 from utils.log.write_log import setup_logging, request_context
 from utils.log.config import LOG_LEVEL
 from utils.messages.server import (
-    create_message_end_dict,
-    create_message_error_dict,
+    create_message_end,
+    create_message_error,
     MESSAGE_END_CODE_CANCELED,
+    MESSAGE_END_CODE_SLOW_CONSUMER,
+)
+from utils.messages.serializer import dumps_message, sse_event
+from utils.stream import StreamQueue, coalesce_answer_messages, stream_queue_stats, with_stop_on_cancel
+from utils.stream.coalesce import coalesce_answer_stream, resolve_coalesce_ms, COALESCE_HEADER
+from utils.admission import AdmissionController, AdmissionRejected, Permit, PRIORITY_HEADER, PRIORITY_BATCH
+from storage.run_registry.run_registry import RunRegistry, RUN_REGISTRY_POLL_INTERVAL
+from storage.result_cache.result_cache import (
+    ResultCache,
+    IdempotencyConflict,
+    payload_fingerprint,
+    IDEMPOTENCY_HEADER,
+    RESULT_CACHE_ENABLED,
 )
 from utils.error import ErrorClassifier, classify_error
+from utils.build_log.answer_cache import answer_cache
+from utils.helper import http_pool
+from utils.budget import TokenBudgetExceeded, budget_scope
 
 setup_logging(
     log_file=LOG_FILE,
@@ -41,27 +66,232 @@ from utils.helper.agent_helper import (
     to_stream_input,
     to_client_message,
     agent_iter_server_messages,
+    agent_aiter_server_messages,
 )
 from utils.openai.handler import OpenAIChatHandler
-from utils.log.parser import LangGraphParser
+from utils.ws import WebSocketRunHandler
+from utils.log.parser import get_graph_parser
 from utils.log.err_trace import extract_core_stack
-from utils.log.loop_trace import init_run_config, init_agent_config
+from utils.log.loop_trace import init_run_config, init_agent_config, flush_traces
+
+if TYPE_CHECKING:
+    from langgraph.graph.state import CompiledStateGraph
 
 
 # 超时配置常量
 TIMEOUT_SECONDS = 900  # 15分钟
 
+# 流式执行是否走原生异步路径（graph.astream），关闭时退回每请求一个线程的桥接方式
+ASYNC_STREAM_ENABLED = os.getenv("ASYNC_STREAM_ENABLED", "true").lower() != "false"
+
+# HTTP worker 进程数；大于 1 时启用跨进程 run 登记表，保证 /cancel 可以路由到持有任务的 worker
+HTTP_WORKERS = int(os.getenv("HTTP_WORKERS", "1"))
+
+# /run_batch 默认并发数与上限、单批最大条目数
+RUN_BATCH_CONCURRENCY = int(os.getenv("RUN_BATCH_CONCURRENCY", "4"))
+RUN_BATCH_MAX_CONCURRENCY = int(os.getenv("RUN_BATCH_MAX_CONCURRENCY", "32"))
+RUN_BATCH_MAX_ITEMS = int(os.getenv("RUN_BATCH_MAX_ITEMS", "1000"))
+
+# /node_run 单节点图缓存容量
+NODE_GRAPH_CACHE_SIZE = int(os.getenv("NODE_GRAPH_CACHE_SIZE", "128"))
+
+# 停机排空：等待在跑 run 完成的最长时间（秒），超时后取消并向客户端发送 message_end
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "30"))
+# 取消后等待取消帧发出、生产者线程退出的宽限时间（秒）
+DRAIN_CANCEL_GRACE = float(os.getenv("DRAIN_CANCEL_GRACE", "5"))
+
+# 启动后在后台线程预加载图/agent 模块，/health 无需等待
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
+
 class GraphService:
     def __init__(self):
-        if not graph_helper.is_agent_proj():
-            self.graph = graph_helper.get_graph_instance("graphs.graph")
+        # 工作流图在首次使用（或启动预热）时加载，缩短 import main 的耗时
+        self._graph: Optional["CompiledStateGraph"] = None
+        self._graph_lock = threading.Lock()
 
         # 用于跟踪正在运行的任务（使用asyncio.Task）
         self.running_tasks: Dict[str, asyncio.Task] = {}
+        # 流式生产者线程，排空时等待其退出
+        self._producer_threads: set = set()
+        # 排空中：不再接受新 run，就绪检查失败
+        self.draining = False
+        # 跨进程 run 登记表，仅多 worker 模式下启用
+        self.run_registry: Optional[RunRegistry] = RunRegistry() if HTTP_WORKERS > 1 else None
+        # 登记表写入（sqlite，可能等待写锁）放到单线程中按提交顺序执行，不阻塞事件循环
+        self._registry_executor: Optional[ThreadPoolExecutor] = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="run-registry") if self.run_registry is not None else None
+        )
         # 错误分类器
         self.error_classifier = ErrorClassifier()
+        # 单节点图缓存（按 node_id），编译结果可复用，替换 graph 时清空；KeyError 不会被缓存
+        self._get_node_graph = functools.lru_cache(maxsize=NODE_GRAPH_CACHE_SIZE)(self._build_node_graph)
+        self._code_version: Optional[str] = None
+        self._llm_config_paths: Optional[list] = None
 
     
+    @property
+    def graph(self) -> Optional["CompiledStateGraph"]:
+        if self._graph is None and not graph_helper.is_agent_proj():
+            with self._graph_lock:
+                if self._graph is None:
+                    self._graph = graph_helper.get_graph_instance("graphs.graph")
+        return self._graph
+
+    @graph.setter
+    def graph(self, value: "CompiledStateGraph"):
+        with self._graph_lock:
+            self._graph = value
+            # 单节点图从旧图编译而来，替换后不能再复用
+            self._get_node_graph.cache_clear()
+
+    def warmup(self):
+        """预加载图或 agent 模块，在后台线程中执行"""
+        t0 = time.time()
+        if graph_helper.is_agent_proj():
+            importlib.import_module("agents.agent")
+        else:
+            _ = self.graph
+        # 提前选择内容存储后端（可能需要探测数据库配置），避免首次历史压缩时阻塞
+        from storage.content_store.content_store import content_store
+        _ = content_store.backend
+        logger.info(f"Warmup finished in {int((time.time() - t0) * 1000)}ms")
+
+    def start_producer(self, target) -> threading.Thread:
+        """启动并登记流式生产者线程"""
+        def run():
+            try:
+                target()
+            finally:
+                self._producer_threads.discard(thread)
+
+        thread = threading.Thread(target=run, daemon=True)
+        self._producer_threads.add(thread)
+        thread.start()
+        return thread
+
+    async def drain(self, timeout: float):
+        """
+        停机排空：等待在跑 run 完成，超过 timeout 后取消剩余 run
+
+        流式 run 被取消时由各自的处理逻辑向客户端发送取消 message_end。
+        最后等待生产者线程退出并刷新日志与 trace 缓冲。
+        """
+        self.draining = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        logger.info(
+            f"Draining {len(self.running_tasks)} in-flight runs and {len(self._producer_threads)} "
+            f"producer threads, timeout {timeout}s"
+        )
+        while True:
+            live = {t for t in self.running_tasks.values() if not t.done()}
+            remaining = deadline - loop.time()
+            if not live or remaining <= 0:
+                break
+            await asyncio.wait(live, timeout=remaining)
+
+        if live:
+            logger.warning(f"Drain timeout reached, cancelling {len(live)} runs")
+            for task in live:
+                task.cancel()
+            await asyncio.wait(live, timeout=DRAIN_CANCEL_GRACE)
+
+        threads = list(self._producer_threads)
+        if threads:
+            def join_all():
+                end = time.monotonic() + DRAIN_CANCEL_GRACE
+                for t in threads:
+                    t.join(max(0.0, end - time.monotonic()))
+            await asyncio.to_thread(join_all)
+            alive = sum(1 for t in threads if t.is_alive())
+            if alive:
+                logger.warning(f"{alive} producer threads still running after drain")
+
+        flush_traces()
+        for handler in logging.getLogger().handlers:
+            handler.flush()
+        logger.info("Drain finished")
+
+    def _registry_write(self, fn, run_id: str):
+        """异步执行登记表写入；单线程保证同一 run 的登记与注销按顺序完成"""
+        def write():
+            try:
+                fn(run_id)
+            except Exception as e:
+                logger.warning(f"Run registry {fn.__name__} failed for run_id: {run_id}: {e}")
+
+        self._registry_executor.submit(write)
+
+    def register_task(self, run_id: str, task: asyncio.Task):
+        self.running_tasks[run_id] = task
+        if self.run_registry is not None:
+            self._registry_write(self.run_registry.register, run_id)
+
+    def unregister_task(self, run_id: str):
+        if self.running_tasks.pop(run_id, None) is not None and self.run_registry is not None:
+            self._registry_write(self.run_registry.unregister, run_id)
+
+    async def watch_remote_cancels(self):
+        """轮询登记表，执行其它 worker 转发过来的取消指令"""
+        while True:
+            await asyncio.sleep(RUN_REGISTRY_POLL_INTERVAL)
+            try:
+                run_ids = await asyncio.to_thread(self.run_registry.take_cancels)
+            except Exception as e:
+                logger.warning(f"Failed to poll run registry: {e}")
+                continue
+            for run_id in run_ids:
+                logger.info(f"Received forwarded cancel for run_id: {run_id}")
+                await self.cancel_run(run_id)
+
+    def worker_stats(self) -> Dict[str, Any]:
+        """各 worker 当前在跑的 run 数量"""
+        if self.run_registry is None:
+            worker_id = f"{socket.gethostname()}:{os.getpid()}"
+            return {
+                "worker_id": worker_id,
+                "workers": [{"worker_id": worker_id, "pid": os.getpid(), "live_runs": len(self.running_tasks)}],
+            }
+        return {"worker_id": self.run_registry.worker_id, "workers": self.run_registry.worker_stats()}
+
+    def code_version(self) -> str:
+        """代码版本：优先使用发布版本 hash，否则取图/agent 源码的摘要（进程内只计算一次）"""
+        if self._code_version is None:
+            version = os.getenv("COZE_PROJECT_COMMIT_HASH", "")
+            if not version:
+                src_dir = Path(__file__).resolve().parent
+                files = sorted([*src_dir.joinpath("graphs").rglob("*.py"), *src_dir.joinpath("agents").rglob("*.py")])
+                digest = hashlib.sha256()
+                for f in files:
+                    digest.update(str(f.relative_to(src_dir.parent)).encode("utf-8"))
+                    digest.update(f.read_bytes())
+                version = digest.hexdigest()[:16]
+            self._code_version = version
+        return self._code_version
+
+    def graph_version(self) -> str:
+        """
+        图版本：代码版本 + 各 LLM 配置文件的内容摘要，每次调用重新计算
+
+        配置文件经 load_llm_config 按 mtime/size 缓存，未变化时不读盘；
+        修改提示词或模型后 agent 会重新编译，版本随之变化，结果缓存不再命中旧配置的结果。
+        """
+        from utils.helper.agent_cache import load_llm_config
+
+        if self._llm_config_paths is None:
+            # 与 agent 读取配置的目录一致
+            config_dir = Path(os.getenv("COZE_WORKSPACE_PATH", "/workspace/projects")) / "config"
+            self._llm_config_paths = sorted(str(p) for p in config_dir.glob("*.json"))
+        digest = hashlib.sha256(self.code_version().encode("utf-8"))
+        for path in self._llm_config_paths:
+            try:
+                _, cfg_hash = load_llm_config(path)
+            except (OSError, ValueError):
+                continue
+            digest.update(path.encode("utf-8"))
+            digest.update(cfg_hash.encode("utf-8"))
+        return digest.hexdigest()[:16]
+
     def _get_graph(self, ctx=Context):
         if graph_helper.is_agent_proj():
             return graph_helper.get_agent_instance("agents.agent", ctx)
@@ -71,13 +301,13 @@ class GraphService:
     
     @staticmethod
     def _sse_event(data: Any) -> str:
-        return f"event: message\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+        return sse_event(data)
 
     # 流式运行（原始迭代器）：本地调用使用
     def stream(self, payload: Dict[str, Any], run_config: RunnableConfig, ctx=Context) -> Iterable[Any]:
         client_msg, session_id = to_client_message(payload)
         run_config["recursion_limit"] = 100
-        run_config["configurable"] = {"thread_id": session_id}
+        run_config["configurable"] = {"thread_id": session_id, **budget_scope(payload)}
         stream_input = to_stream_input(client_msg)
         t0 = time.time()
         try:
@@ -91,10 +321,10 @@ class GraphService:
                 log_id=ctx.logid,
             )
             for sm in server_msgs_iter:
-                yield sm.dict()
+                yield sm
         except asyncio.CancelledError:
             logger.info(f"Stream cancelled for run_id: {ctx.run_id}")
-            end_msg = create_message_end_dict(
+            end_msg = create_message_end(
                 code=MESSAGE_END_CODE_CANCELED,
                 message="Stream execution cancelled",
                 session_id=client_msg.session_id,
@@ -109,7 +339,7 @@ class GraphService:
         except Exception as ex:
             # 使用错误分类器获取错误码
             err = self.error_classifier.classify(ex, {"node_name": "stream"})
-            error_msg = create_message_error_dict(
+            error_msg = create_message_error(
                 code=str(err.code) if err is not None else "exception",
                 message=str(ex),
                 session_id=client_msg.session_id,
@@ -133,7 +363,8 @@ class GraphService:
             graph = self._get_graph(ctx)
             # custom tracer
             run_config = init_run_config(graph, ctx)
-            run_config["configurable"] = {"thread_id": ctx.run_id}
+            # thread_id 为 run_id；token 预算按 payload 中的 session_id / project_id 计量
+            run_config["configurable"] = {"thread_id": ctx.run_id, **budget_scope(payload)}
 
             # 直接调用，LangGraph会在当前任务上下文中执行
             # 如果当前任务被取消，LangGraph的执行也会被取消
@@ -155,13 +386,23 @@ class GraphService:
             raise
         finally:
             # 清理任务记录
-            self.running_tasks.pop(run_id, None)
+            self.unregister_task(run_id)
 
     # 流式运行（SSE 格式化）：HTTP 路由使用
-    async def stream_sse(self, payload: Dict[str, Any], ctx=None) -> AsyncGenerator[str, None]:
+    async def stream_sse(self, payload: Dict[str, Any], ctx=None, coalesce_ms: int = 0) -> AsyncGenerator[str, None]:
         if ctx is None:
             ctx = new_context(method="stream_sse")
 
+        messages = self.stream_messages(payload, ctx, coalesce_ms=coalesce_ms)
+        try:
+            async for msg in messages:
+                yield self._sse_event(msg)
+        finally:
+            # 立即关闭内层生成器，保证任务登记与 tracer 及时清理
+            await messages.aclose()
+
+    # 流式运行（消息对象）：SSE 与 WebSocket 共用
+    async def stream_messages(self, payload: Dict[str, Any], ctx: Context, coalesce_ms: int = 0) -> AsyncGenerator[Any, None]:
         run_id = ctx.run_id
         logger.info(f"Starting stream with run_id: {run_id}")
         graph = self._get_graph(ctx)
@@ -170,16 +411,21 @@ class GraphService:
         else:
             run_config = init_run_config(graph, ctx)  # vibeflow
 
+        stream = self.astream(payload, graph, run_config=run_config, ctx=ctx)
+        if coalesce_ms > 0:
+            # 合并同一消息的连续 answer 增量，减少 SSE 帧数
+            stream = coalesce_answer_stream(stream, window_ms=coalesce_ms)
+
         try:
-            async for chunk in self.astream(payload, graph, run_config=run_config, ctx=ctx):
-                yield self._sse_event(chunk)
+            async for msg in stream:
+                yield msg
         finally:
             # 清理任务记录
-            self.running_tasks.pop(run_id, None)
-            cozeloop.flush()
+            self.unregister_task(run_id)
+            flush_traces()
 
     # 取消执行 - 使用asyncio的标准方式
-    def cancel_run(self, run_id: str, ctx: Optional[Context] = None) -> Dict[str, Any]:
+    async def cancel_run(self, run_id: str, ctx: Optional[Context] = None) -> Dict[str, Any]:
         """
         取消指定run_id的执行
 
@@ -208,6 +454,14 @@ class GraphService:
                     "run_id": run_id,
                     "message": "Task has already completed"
                 }
+        elif self.run_registry is not None and (owner := await asyncio.to_thread(self.run_registry.request_cancel, run_id)):
+            # 任务由其它 worker 持有，转发取消指令
+            logger.info(f"Forwarded cancellation for run_id: {run_id} to worker {owner}")
+            return {
+                "status": "success",
+                "run_id": run_id,
+                "message": f"Cancellation signal forwarded to worker {owner}"
+            }
         else:
             logger.warning(f"No active task found for run_id: {run_id}")
             return {
@@ -221,21 +475,27 @@ class GraphService:
         if ctx is None or Context.run_id == "":
             ctx = new_context(method="node_run")
 
+        # 单节点图按 node_id 做 LRU 缓存，重复调用跳过建图和编译
+        _graph = self._get_node_graph(node_id)
+
+        run_config = init_run_config(_graph, ctx)
+        return await _graph.ainvoke(payload, config=run_config)
+
+    def _build_node_graph(self, node_id: str) -> "CompiledStateGraph":
+        """构建并编译只包含指定节点的单节点图（结果由 _get_node_graph 缓存）"""
+        from langgraph.graph import StateGraph, END
         node_func, input_cls, output_cls = graph_helper.get_graph_node_func_with_inout(self.graph.get_graph(), node_id)
         if node_func is None or input_cls is None:
             raise KeyError(f"node_id '{node_id}' not found")
         assert self.graph is not None, "Graph is not initialized"
-        parser = LangGraphParser(self.graph)
+        parser = get_graph_parser(self.graph)
         metadata = parser.get_node_metadata(node_id) or {}
 
         _g = StateGraph(input_cls, input_schema=input_cls, output_schema=output_cls)
         _g.add_node("sn", node_func, metadata=metadata)
         _g.set_entry_point("sn")
         _g.add_edge("sn", END)
-        _graph = _g.compile()
-
-        run_config = init_run_config(_graph, ctx)
-        return await _graph.ainvoke(payload, config=run_config)
+        return _g.compile()
 
     # 获取工作流的出入参Schema
     def graph_inout_schema(self) -> Any:
@@ -246,19 +506,82 @@ class GraphService:
 
         return {"input_schema": _graph_input.model_json_schema(), "output_schema": _graph_output.model_json_schema()}
 
-    async def astream(self, payload: Dict[str, Any], graph: CompiledStateGraph, run_config: RunnableConfig, ctx=Context) -> AsyncIterable[Any]:
+    async def astream(self, payload: Dict[str, Any], graph: "CompiledStateGraph", run_config: RunnableConfig, ctx=Context) -> AsyncIterable[Any]:
         client_msg, session_id = to_client_message(payload)
         run_config["recursion_limit"] = 100
-        run_config["configurable"] = {"thread_id": session_id}
+        run_config["configurable"] = {"thread_id": session_id, **budget_scope(payload)}
         stream_input = to_stream_input(client_msg)
 
-        # 使用后台线程拉取同步流，并通过事件循环安全地推送到异步队列
-        loop = asyncio.get_running_loop()
-        q: asyncio.Queue = asyncio.Queue()
+        # 优先使用 graph.astream 在事件循环内原生异步执行；仅当图不支持异步流时退回线程桥接
+        if ASYNC_STREAM_ENABLED and hasattr(graph, "astream"):
+            stream_iter = self._astream_native(graph, stream_input, client_msg, run_config, ctx)
+        else:
+            stream_iter = self._astream_thread(graph, stream_input, client_msg, run_config, ctx)
+
+        async for item in stream_iter:
+            yield item
+
+    async def _astream_native(self, graph: "CompiledStateGraph", stream_input: Dict[str, Any], client_msg, run_config: RunnableConfig, ctx=Context) -> AsyncIterable[Any]:
+        start_time = time.time()
+        last_seq = 0
+        try:
+            items = graph.astream(stream_input, stream_mode="messages", config=run_config, context=ctx)
+            server_msgs_iter = agent_aiter_server_messages(
+                items,
+                session_id=client_msg.session_id,
+                query_msg_id=client_msg.local_msg_id,
+                local_msg_id=client_msg.local_msg_id,
+                run_id=ctx.run_id,
+                log_id=ctx.logid,
+            )
+            try:
+                async for sm in server_msgs_iter:
+                    # 主动检查执行时间，及时中断
+                    if time.time() - start_time > TIMEOUT_SECONDS:
+                        logger.error(f"Agent execution timeout after {TIMEOUT_SECONDS}s for run_id: {ctx.run_id}")
+                        yield create_message_end(
+                            code="TIMEOUT",
+                            message=f"Execution timeout: exceeded {TIMEOUT_SECONDS} seconds",
+                            session_id=client_msg.session_id,
+                            query_msg_id=client_msg.local_msg_id,
+                            log_id=ctx.logid,
+                            time_cost_ms=int((time.time() - start_time) * 1000),
+                            reply_id=getattr(sm, 'reply_id', ''),
+                            sequence_id=last_seq + 1,
+                        )
+                        return
+                    yield sm
+                    last_seq = sm.sequence_id
+            finally:
+                await server_msgs_iter.aclose()
+        except asyncio.CancelledError:
+            # 取消直接在当前任务内传播，LLM 请求随 astream 一并被取消
+            logger.info(f"Stream cancelled for run_id: {ctx.run_id}")
+            raise
+        except Exception as ex:
+            # 使用错误分类器获取错误码
+            err = classify_error(ex, {"node_name": "astream"})
+            yield create_message_end(
+                code=str(err.code),
+                message=err.message,
+                session_id=client_msg.session_id,
+                query_msg_id=client_msg.local_msg_id,
+                log_id=ctx.logid,
+                time_cost_ms=int((time.time() - start_time) * 1000),
+                reply_id="",
+                sequence_id=last_seq + 1,
+            )
+
+    async def _astream_thread(self, graph: "CompiledStateGraph", stream_input: Dict[str, Any], client_msg, run_config: RunnableConfig, ctx=Context) -> AsyncIterable[Any]:
+        # 兜底：仅支持同步流的图，使用后台线程拉取同步流，并通过事件循环安全地推送到异步队列
+        # 有界队列：客户端过慢时按 STREAM_QUEUE_POLICY 阻塞生产者、合并 answer 增量或丢弃客户端
+        q = StreamQueue(coalesce=coalesce_answer_messages)
         context = contextvars.copy_context()
         start_time = time.time()
         # 取消标志，用于通知 producer 线程停止
         cancelled = threading.Event()
+        # 取消后在下一个回调处中断正在执行的节点，producer 线程不必等到节点执行完
+        with_stop_on_cancel(run_config, lambda: cancelled.is_set() or q.closed)
 
         def producer():
             last_seq = 0
@@ -282,7 +605,7 @@ class GraphService:
                     if cancelled.is_set():
                         logger.info(f"Producer cancelled during iteration for run_id: {ctx.run_id}")
                         # 发送取消结束消息
-                        cancel_msg = create_message_end_dict(
+                        cancel_msg = create_message_end(
                             code=MESSAGE_END_CODE_CANCELED,
                             message="Stream cancelled by upstream",
                             session_id=client_msg.session_id,
@@ -292,13 +615,13 @@ class GraphService:
                             reply_id=getattr(sm, 'reply_id', ''),
                             sequence_id=last_seq + 1,
                         )
-                        loop.call_soon_threadsafe(q.put_nowait, cancel_msg)
+                        q.put(cancel_msg)
                         return
 
                     # 主动检查执行时间，及时中断
                     if time.time() - start_time > TIMEOUT_SECONDS:
                         logger.error(f"Agent execution timeout after {TIMEOUT_SECONDS}s for run_id: {ctx.run_id}")
-                        timeout_msg = create_message_end_dict(
+                        timeout_msg = create_message_end(
                             code="TIMEOUT",
                             message=f"Execution timeout: exceeded {TIMEOUT_SECONDS} seconds",
                             session_id=client_msg.session_id,
@@ -308,9 +631,11 @@ class GraphService:
                             reply_id=getattr(sm, 'reply_id', ''),
                             sequence_id=last_seq + 1,
                         )
-                        loop.call_soon_threadsafe(q.put_nowait, timeout_msg)
+                        q.put(timeout_msg)
+                        return
+                    if not q.put(sm):
+                        logger.info(f"Stream queue closed, producer stopping for run_id: {ctx.run_id}")
                         return
-                    loop.call_soon_threadsafe(q.put_nowait, sm.dict())
                     last_seq = sm.sequence_id
             except Exception as ex:
                 # 如果已取消，不再发送错误消息
@@ -319,7 +644,7 @@ class GraphService:
                     return
                 # 使用错误分类器获取错误码
                 err = classify_error(ex, {"node_name": "astream"})
-                end_msg = create_message_end_dict(
+                end_msg = create_message_end(
                     code=str(err.code),
                     message=err.message,
                     session_id=client_msg.session_id,
@@ -329,11 +654,11 @@ class GraphService:
                     reply_id="",
                     sequence_id=last_seq + 1,
                 )
-                loop.call_soon_threadsafe(q.put_nowait, end_msg)
+                q.put(end_msg)
             finally:
-                loop.call_soon_threadsafe(q.put_nowait, None)
+                q.close()
 
-        threading.Thread(target=lambda: context.run(producer), daemon=True).start()
+        self.start_producer(lambda: context.run(producer))
 
         try:
             while True:
@@ -341,22 +666,179 @@ class GraphService:
                 if item is None:
                     break
                 yield item
+            if q.dropped:
+                logger.warning(f"Slow consumer dropped for run_id: {ctx.run_id}, queue stats: {q.stats()}")
+                yield create_message_end(
+                    code=MESSAGE_END_CODE_SLOW_CONSUMER,
+                    message="Stream dropped: client is consuming too slowly",
+                    session_id=client_msg.session_id,
+                    query_msg_id=client_msg.local_msg_id,
+                    log_id=ctx.logid,
+                    time_cost_ms=int((time.time() - start_time) * 1000),
+                )
         except asyncio.CancelledError:
             logger.info(f"Stream cancelled for run_id: {ctx.run_id}, signaling producer to stop")
             # 设置取消标志，通知 producer 线程停止
             cancelled.set()
             raise
+        finally:
+            # 唤醒可能阻塞在满队列上的 producer 线程
+            q.cancel()
+            logger.info(f"Stream queue stats for run_id: {ctx.run_id}: {q.stats()}")
 
 
 service = GraphService()
-app = FastAPI()
+
+
+async def _drain():
+    """停止准入并排空在跑 run"""
+    admission.close()
+    await service.drain(DRAIN_TIMEOUT)
+
+
+_drain_task: Optional[asyncio.Task] = None
+
+
+def _install_drain_signal_handler():
+    """
+    SIGTERM 时先排空再交给原处理器（uvicorn 的退出流程）
+
+    uvicorn 收到 SIGTERM 后会直接关闭监听并等待连接结束，这里先完成排空，
+    保证就绪检查先失败、在跑 run 有机会正常结束。再次收到 SIGTERM 时不重复排空。
+    """
+    loop = asyncio.get_running_loop()
+    previous = signal.getsignal(signal.SIGTERM)
+
+    async def drain_then_exit(signum, frame):
+        try:
+            await _drain()
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+            if callable(previous):
+                previous(signum, frame)
+            elif previous == signal.SIG_DFL:
+                signal.raise_signal(signum)
+
+    def handle_sigterm(signum, frame):
+        global _drain_task
+        if _drain_task is not None:
+            return
+        logger.info("Received SIGTERM, draining before shutdown")
+        _drain_task = loop.create_task(drain_then_exit(signum, frame))
+
+    try:
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except ValueError:
+        # 非主线程（如测试客户端）中无法安装信号处理器
+        logger.info("Not in main thread, SIGTERM drain handler not installed")
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    _install_drain_signal_handler()
+    watcher = None
+    if service.run_registry is not None:
+        watcher = asyncio.create_task(service.watch_remote_cancels())
+    if STARTUP_WARMUP:
+        warmup = asyncio.create_task(asyncio.to_thread(service.warmup))
+        warmup.add_done_callback(
+            lambda t: t.cancelled() or t.exception() is None
+            or logger.error(f"Warmup failed: {t.exception()}")
+        )
+    # 连接预热与 STARTUP_WARMUP 相互独立，由 MODEL_HTTP_WARM_CONNECTIONS 控制（0 关闭）
+    warm_pool = asyncio.create_task(http_pool.warm_connections(os.getenv("COZE_INTEGRATION_MODEL_BASE_URL")))
+    try:
+        yield
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if not warm_pool.done():
+            warm_pool.cancel()
+        await asyncio.gather(warm_pool, return_exceptions=True)
+        if not service.draining:
+            # 非 SIGTERM 的退出（如 Ctrl+C）：连接已由 uvicorn 关闭，取消残留任务并刷新缓冲
+            await service.drain(0)
+        if service.run_registry is not None:
+            # 等待排队中的登记表写入完成后再关闭连接
+            await asyncio.to_thread(service._registry_executor.shutdown, wait=True)
+            service.run_registry.close()
+        if "storage.content_store.content_store" in sys.modules:
+            # 等待归档原文写完，避免 checkpoint 中留下取不回的引用
+            from storage.content_store.content_store import content_store
+            await asyncio.to_thread(content_store.flush, DRAIN_CANCEL_GRACE)
+        await http_pool.close_clients()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # OpenAI 兼容接口处理器
 openai_handler = OpenAIChatHandler(service)
 
+# 准入控制：限制同时执行的 run 数量，超出时排队或快速拒绝
+admission = AdmissionController()
+
+# WebSocket 多路复用处理器，与 HTTP 接口共用准入控制
+ws_handler = WebSocketRunHandler(service, admission)
+
+# /run 结果缓存：Idempotency-Key 去重与按 payload 哈希复用结果
+result_cache = ResultCache()
+
+
+async def _admit(request: Request, ctx: Context) -> Permit:
+    """按请求优先级申请执行名额，未准入时抛出带 Retry-After 的 429/503"""
+    try:
+        return await admission.acquire(request.headers.get(PRIORITY_HEADER))
+    except AdmissionRejected as e:
+        logger.warning(f"Admission rejected for run_id: {ctx.run_id}: [{e.status_code}] {e.reason}")
+        raise HTTPException(status_code=e.status_code, detail=e.reason,
+                            headers={"Retry-After": str(e.retry_after)})
+
+
+def _release_after_response(response: Any, permit: Permit) -> Any:
+    """流式响应在 body 迭代结束后归还名额，其它响应立即归还"""
+    if not isinstance(response, StreamingResponse):
+        permit.release()
+        return response
+
+    body_iterator = response.body_iterator
+
+    async def guarded_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            permit.release()
+
+    response.body_iterator = guarded_body()
+    # 兜底：响应未开始迭代就结束时也能归还名额（release 可重复调用）
+    if response.background is None:
+        response.background = BackgroundTask(permit.release)
+    return response
+
+
+def _result_cache_key(request: Request, payload: Any) -> Optional[tuple]:
+    """
+    返回 (缓存 key, 指纹)，不需要缓存时返回 None
+
+    Idempotency-Key 按调用方指定的 key 去重，指纹只取 payload，发布新版本后重试仍返回原结果；
+    结果缓存按 payload + 图版本寻址。
+    """
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+    if idempotency_key:
+        return f"idem:{idempotency_key}", payload_fingerprint(payload)
+    if RESULT_CACHE_ENABLED:
+        fingerprint = payload_fingerprint(payload, service.graph_version())
+        return f"payload:{fingerprint}", fingerprint
+    return None
+
+
+def _is_cacheable_result(result: Any) -> bool:
+    """取消、超时的结果不缓存"""
+    return not (isinstance(result, dict) and result.get("status") in ("cancelled", "timeout"))
+
 
 @app.post("/run")
-async def http_run(request: Request) -> Dict[str, Any]:
+async def http_run(request: Request, response: Response) -> Dict[str, Any]:
     global result
     raw_body = await request.body()
     try:
@@ -377,33 +859,58 @@ async def http_run(request: Request) -> Dict[str, Any]:
         f"body={body_text}"
     )
 
+    permit: Optional[Permit] = None
     try:
         payload = await request.json()
+        cache_key = _result_cache_key(request, payload)
 
-        # 创建任务并记录 - 这是关键，让我们可以通过run_id取消任务
-        task = asyncio.create_task(service.run(payload, ctx))
-        service.running_tasks[run_id] = task
+        async def execute() -> Any:
+            nonlocal permit
+            permit = await _admit(request, ctx)
+            # 创建任务并记录 - 这是关键，让我们可以通过run_id取消任务
+            task = asyncio.create_task(service.run(payload, ctx))
+            service.register_task(run_id, task)
 
-        try:
-            result = await asyncio.wait_for(task, timeout=float(TIMEOUT_SECONDS))
-        except asyncio.TimeoutError:
-            logger.error(f"Run execution timeout after {TIMEOUT_SECONDS}s for run_id: {run_id}")
-            task.cancel()
             try:
-                result = await task
-            except asyncio.CancelledError:
-                return {
-                    "status": "timeout", 
-                    "run_id": run_id, 
-                    "message": f"Execution timeout: exceeded {TIMEOUT_SECONDS} seconds"
-                }
-
-        if not result:
-            result = {}
-        if isinstance(result, dict):
-            result["run_id"] = run_id
+                result = await asyncio.wait_for(task, timeout=float(TIMEOUT_SECONDS))
+            except asyncio.TimeoutError:
+                logger.error(f"Run execution timeout after {TIMEOUT_SECONDS}s for run_id: {run_id}")
+                task.cancel()
+                try:
+                    result = await task
+                except asyncio.CancelledError:
+                    return {
+                        "status": "timeout",
+                        "run_id": run_id,
+                        "message": f"Execution timeout: exceeded {TIMEOUT_SECONDS} seconds"
+                    }
+
+            if not result:
+                result = {}
+            if isinstance(result, dict):
+                result["run_id"] = run_id
+            # 缓存与响应使用同一份 JSON 兼容结构
+            return jsonable_encoder(result) if cache_key is not None else result
+
+        if cache_key is None:
+            return await execute()
+
+        key, fingerprint = cache_key
+        result, replayed = await result_cache.get_or_run(key, fingerprint, execute, cacheable=_is_cacheable_result)
+        response.headers["X-Result-Cache"] = "hit" if replayed else "miss"
+        if replayed:
+            logger.info(f"Replayed cached result for run_id: {run_id}, key: {key}")
         return result
 
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    except TokenBudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    except HTTPException:
+        raise
+
     except json.JSONDecodeError as e:
         logger.error(f"JSON decode error in http_run: {e}, traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=400, detail=f"Invalid JSON format, {extract_core_stack()}")
@@ -429,7 +936,9 @@ async def http_run(request: Request) -> Dict[str, Any]:
             }
         )
     finally:
-        cozeloop.flush()
+        if permit is not None:
+            permit.release()
+        flush_traces()
 
 
 @app.post("/stream_run")
@@ -463,20 +972,20 @@ async def http_stream_run(request: Request):
         # 将真正的流式任务登记到 running_tasks，确保 /cancel 能定位到它
         task = asyncio.current_task()
         if task:
-            service.running_tasks[run_id] = task
+            service.register_task(run_id, task)
             logger.info(f"Registered streaming task for run_id: {run_id}")
 
         client_msg, _ = to_client_message(payload)
         t0 = time.time()
 
         try:
-            async for chunk in service.stream_sse(payload, ctx):
+            async for chunk in service.stream_sse(payload, ctx, coalesce_ms=coalesce_ms):
                 yield chunk
         except asyncio.CancelledError:
             logger.info(f"Stream cancelled for run_id: {run_id}")
-            end_msg = create_message_end_dict(
+            end_msg = create_message_end(
                 code=MESSAGE_END_CODE_CANCELED,
-                message="Stream cancelled by user",
+                message="Server is shutting down" if service.draining else "Stream cancelled by user",
                 session_id=client_msg.session_id,
                 query_msg_id=client_msg.local_msg_id,
                 log_id=ctx.logid,
@@ -493,7 +1002,7 @@ async def http_stream_run(request: Request):
                 f"Unexpected error in http_stream_run: [{err.code}] {err.message}, "
                 f"traceback: {traceback.format_exc()}"
             )
-            error_msg = create_message_error_dict(
+            error_msg = create_message_error(
                 code=str(err.code),
                 message=str(ex),
                 session_id=client_msg.session_id,
@@ -505,9 +1014,113 @@ async def http_stream_run(request: Request):
             )
             yield service._sse_event(error_msg)
 
+    # 请求级 answer 合并窗口（毫秒），未指定时使用 STREAM_COALESCE_MS
+    coalesce_ms = resolve_coalesce_ms(request.headers.get(COALESCE_HEADER))
+
+    permit = await _admit(request, ctx)
     # 注意：StreamingResponse会在后台运行generator
     response = StreamingResponse(cancellable_stream(), media_type="text/event-stream")
-    return response
+    return _release_after_response(response, permit)
+
+def _parse_batch_payloads(body_text: str) -> list:
+    """解析批量请求体：JSON 数组，或每行一个 JSON 对象的 NDJSON"""
+    stripped = body_text.strip()
+    if stripped.startswith("["):
+        payloads = json.loads(stripped)
+        if not isinstance(payloads, list):
+            raise ValueError("Batch body must be a JSON array or NDJSON")
+        return payloads
+    return [json.loads(line) for line in stripped.splitlines() if line.strip()]
+
+
+async def _run_batch_item(index: int, payload: Any, request: Request) -> Dict[str, Any]:
+    """执行批量中的单个条目，错误按 ErrorClassifier 分类后写入结果行，不中断整批"""
+    ctx = new_context(method="run_batch", headers=request.headers)
+    request_context.set(ctx)
+    run_id = ctx.run_id
+    line: Dict[str, Any] = {"index": index, "run_id": run_id}
+    permit: Optional[Permit] = None
+    try:
+        # 批量任务默认走 batch 队列，不与交互请求争抢名额
+        permit = await admission.acquire(request.headers.get(PRIORITY_HEADER) or PRIORITY_BATCH)
+        task = asyncio.create_task(service.run(payload, ctx))
+        service.register_task(run_id, task)
+        try:
+            result = await asyncio.wait_for(task, timeout=float(TIMEOUT_SECONDS))
+        except asyncio.TimeoutError:
+            logger.error(f"Batch item {index} timeout after {TIMEOUT_SECONDS}s for run_id: {run_id}")
+            line.update(status="timeout", message=f"Execution timeout: exceeded {TIMEOUT_SECONDS} seconds")
+            return line
+        if isinstance(result, dict) and result.get("status") == "cancelled":
+            line.update(status="cancelled", message="Execution was cancelled")
+        else:
+            line.update(status="success", result=result if result else {})
+    except AdmissionRejected as e:
+        line.update(status="rejected", error={
+            "error_code": str(e.status_code),
+            "error_message": e.reason,
+            "retry_after": e.retry_after,
+        })
+    except Exception as e:
+        line.update(status="error", error=service.error_classifier.get_error_response(
+            e, {"node_name": "run_batch", "run_id": run_id}
+        ))
+    finally:
+        if permit is not None:
+            permit.release()
+    return line
+
+
+async def _iter_batch_results(payloads: list, concurrency: int, request: Request) -> AsyncGenerator[str, None]:
+    """按完成顺序输出 NDJSON 结果行，最多同时执行 concurrency 个条目"""
+    results: asyncio.Queue = asyncio.Queue()
+    pending_indexes = iter(range(len(payloads)))
+
+    async def worker():
+        for index in pending_indexes:
+            await results.put(await _run_batch_item(index, payloads[index], request))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(payloads)))]
+    try:
+        for _ in range(len(payloads)):
+            line = await results.get()
+            yield dumps_message(jsonable_encoder(line)) + "\n"
+    finally:
+        # 客户端断开时取消尚未完成的条目
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        flush_traces()
+
+
+@app.post("/run_batch")
+async def http_run_batch(request: Request):
+    raw_body = await request.body()
+    try:
+        payloads = _parse_batch_payloads(raw_body.decode("utf-8"))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch body, expect JSON array or NDJSON: {e}")
+    if len(payloads) > RUN_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Too many batch items: {len(payloads)} > {RUN_BATCH_MAX_ITEMS}")
+
+    try:
+        concurrency = int(request.query_params.get("concurrency", RUN_BATCH_CONCURRENCY))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid concurrency")
+    concurrency = max(1, min(concurrency, RUN_BATCH_MAX_CONCURRENCY))
+
+    logger.info(f"Received request for /run_batch: items={len(payloads)}, concurrency={concurrency}")
+    return StreamingResponse(
+        _iter_batch_results(payloads, concurrency, request),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.websocket("/ws")
+async def ws_run(websocket: WebSocket):
+    """一条连接上多路复用多个流式 run，支持带内取消与按 run 流控，协议见 utils/ws/handler.py"""
+    await ws_handler.handle(websocket)
+
 
 @app.post("/cancel/{run_id}")
 async def http_cancel(run_id: str, request: Request):
@@ -520,7 +1133,7 @@ async def http_cancel(run_id: str, request: Request):
     ctx = new_context(method="cancel", headers=request.headers)
     request_context.set(ctx)
     logger.info(f"Received cancel request for run_id: {run_id}")
-    result = service.cancel_run(run_id, ctx)
+    result = await service.cancel_run(run_id, ctx)
     return result
 
 
@@ -566,7 +1179,7 @@ async def http_node_run(node_id: str, request: Request):
             }
         )
     finally:
-        cozeloop.flush()
+        flush_traces()
 
 
 @app.post("/v1/chat/completions")
@@ -579,12 +1192,31 @@ async def openai_chat_completions(request: Request):
 
     try:
         payload = await request.json()
-        return await openai_handler.handle(payload, ctx)
     except json.JSONDecodeError as e:
         logger.error(f"JSON decode error in openai_chat_completions: {e}")
+        flush_traces()
         raise HTTPException(status_code=400, detail="Invalid JSON format")
+
+    try:
+        permit = await admission.acquire(request.headers.get(PRIORITY_HEADER))
+    except AdmissionRejected as e:
+        logger.warning(f"Admission rejected for run_id: {ctx.run_id}: [{e.status_code}] {e.reason}")
+        response = openai_handler._error_response(
+            message=e.reason,
+            error_type="rate_limit_error" if e.status_code == 429 else "service_unavailable_error",
+            code=str(e.status_code),
+            status_code=e.status_code,
+        )
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+
+    try:
+        return _release_after_response(await openai_handler.handle(payload, ctx), permit)
+    except BaseException:
+        permit.release()
+        raise
     finally:
-        cozeloop.flush()
+        flush_traces()
 
 
 @app.get("/health")
@@ -599,6 +1231,83 @@ async def health_check():
         raise HTTPException(status_code=503, detail=str(e))
 
 
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查：排空中返回 503，负载均衡据此摘除实例"""
+    if service.draining:
+        return JSONResponse(status_code=503, content={"status": "draining", "message": "Service is shutting down"})
+    return {"status": "ok", "message": "Service is ready"}
+
+
+@app.get("/admission")
+async def http_admission():
+    """准入控制指标：在跑数量、各优先级队列深度、排队耗时"""
+    return admission.stats()
+
+
+@app.get("/result_cache")
+async def http_result_cache():
+    """/run 结果缓存指标：条目数、字节数、命中与合并次数"""
+    return result_cache.stats()
+
+
+@app.get("/answer_cache")
+async def http_answer_cache():
+    """错误特征答案缓存指标：条目数、命中与写入次数，以及相似错误索引"""
+    # 相似错误索引依赖 numpy，随 Agent 一起按需加载
+    from utils.build_log.middleware import similarity_index
+    return {**answer_cache.stats(), "similarity": similarity_index.stats()}
+
+
+@app.get("/content/{ref}")
+async def http_content(ref: str):
+    """取回历史压缩时归档的原文（构建日志、图片 data URL 等）"""
+    from storage.content_store.content_store import content_store
+    text = await asyncio.to_thread(content_store.get, ref)
+    if text is None:
+        raise HTTPException(status_code=404, detail=f"Content not found: {ref}")
+    return PlainTextResponse(text)
+
+
+@app.get("/http_pool")
+async def http_pool_stats():
+    """模型网关共享连接池：连接数、空闲/活跃连接、请求数，以及请求对冲指标"""
+    return http_pool.stats()
+
+
+@app.get("/stream_queue")
+async def http_stream_queue():
+    """流式队列指标：已结束的流的高水位最大值与分布，阻塞、合并、丢弃次数"""
+    return stream_queue_stats()
+
+
+@app.get("/image_preprocess")
+async def http_image_preprocess():
+    """截图预处理指标：处理张数、缓存命中、节省字节数、平均耗时"""
+    from utils.file.image_preprocess import image_preprocess_stats
+    return image_preprocess_stats()
+
+
+@app.get("/token_usage")
+async def http_token_usage(session_id: Optional[str] = None, project_id: Optional[str] = None):
+    """会话/项目的累计 token 用量与预算"""
+    from utils.budget.token_budget import budget_status
+    return await asyncio.to_thread(budget_status, session_id, project_id)
+
+
+@app.get("/prompt_cache")
+async def http_prompt_cache():
+    """按提示词前缀哈希统计的服务端前缀缓存命中：调用次数、输入 token、命中 token"""
+    from utils.helper.prompt_prefix import prefix_cache_stats
+    return prefix_cache_stats()
+
+
+@app.get("/workers")
+async def http_workers():
+    """各 worker 当前在跑的 run 数量"""
+    return service.worker_stats()
+
+
 @app.get(path="/graph_parameter")
 async def http_graph_inout_parameter(request: Request):
     return service.graph_inout_schema()
@@ -609,6 +1318,7 @@ def parse_args():
     parser.add_argument("-n", type=str, default="", help="Node ID for single node run")
     parser.add_argument("-p", type=int, default=5000, help="HTTP server port")
     parser.add_argument("-i", type=str, default="", help="Input JSON string for flow/node mode")
+    parser.add_argument("-w", type=int, default=HTTP_WORKERS, help="HTTP worker processes")
     return parser.parse_args()
 
 
@@ -624,19 +1334,23 @@ def parse_input(input_str: str) -> Dict[str, Any]:
         # If not valid JSON, treat as plain text
         return {"text": input_str}
 
-def start_http_server(port):
-    workers = 1
+def start_http_server(port, workers=1):
     reload = False
-    if graph_helper.is_dev_env():
+    if graph_helper.is_dev_env() and workers == 1:
+        # reload 与多 worker 互斥，开发环境仅单 worker 时启用
         reload = True
+    # 子进程重新导入 main:app 时据此启用跨进程 run 登记表
+    os.environ["HTTP_WORKERS"] = str(workers)
 
     logger.info(f"Start HTTP Server, Port: {port}, Workers: {workers}")
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=reload, workers=workers)
+    # 排空结束后仍未关闭的连接在宽限时间后由 uvicorn 强制结束
+    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=reload, workers=workers,
+                timeout_graceful_shutdown=int(DRAIN_CANCEL_GRACE))
 
 if __name__ == "__main__":
     args = parse_args()
     if args.m == "http":
-        start_http_server(args.p)
+        start_http_server(args.p, args.w)
     elif args.m == "flow":
         payload = parse_input(args.i)
         result = asyncio.run(service.run(payload))
@@ -664,4 +1378,4 @@ if __name__ == "__main__":
                 },
                 run_config={"configurable": {"session_id": "1"}}
         ):
-            print(chunk)
\ No newline at end of file
+            print(dumps_message(chunk))
\ No newline at end of file
@@ -0,0 +1,302 @@
+"""
+内容寻址存储
+
+checkpoint 压缩时被替换掉的大段原文（构建日志、base64 图片等）按 sha256 存放，
+引用形如 "sha256:<hex>"，需要时按引用取回。相同内容只存一份。
+
+引用保存在 checkpoint 中，原文必须和 checkpoint 一样持久、跨实例可见：
+- postgres: 与 checkpointer 使用同一个数据库（content_blobs 表）
+- local:    本地目录，仅在显式配置 CONTENT_STORE_DIR（多实例需为共享路径）或没有数据库时使用
+CONTENT_STORE_BACKEND=auto（默认）时，配置了数据库就用 postgres，否则用 local。
+
+保留策略：超过 CONTENT_STORE_TTL 未被写入或读取的内容被清理；local 另有总字节上限，超出时按访问时间淘汰。
+写入在后台线程执行，put 只计算摘要并入队，不阻塞调用方（checkpoint reducer）；
+写入完成前 get 从待写队列中返回。写入失败时按退避重试；Postgres 运行期出错后的冷却期内
+put 抛出 OSError（调用方保留原文不归档），冷却结束后恢复。
+"""
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from storage.database.pg_tier import PgTier
+
+logger = logging.getLogger(__name__)
+
+CONTENT_STORE_BACKEND = os.getenv("CONTENT_STORE_BACKEND", "auto").lower()
+CONTENT_STORE_DIR = os.getenv("CONTENT_STORE_DIR", "")
+# 未被写入或读取超过该时长（秒）的内容被清理，默认 30 天
+CONTENT_STORE_TTL = float(os.getenv("CONTENT_STORE_TTL", str(30 * 86400)))
+# local 后端的总字节上限
+CONTENT_STORE_MAX_BYTES = int(os.getenv("CONTENT_STORE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# 两次清理之间的最小间隔（秒）
+CONTENT_STORE_SWEEP_INTERVAL = float(os.getenv("CONTENT_STORE_SWEEP_INTERVAL", "600"))
+# 写入失败时的重试次数，间隔从 1 秒起翻倍
+CONTENT_STORE_WRITE_RETRIES = int(os.getenv("CONTENT_STORE_WRITE_RETRIES", "2"))
+
+_REF_RE = re.compile(r"^sha256:([0-9a-f]{64})$")
+
+_PG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS content_blobs (
+    digest TEXT PRIMARY KEY,
+    data BYTEA NOT NULL,
+    size BIGINT NOT NULL,
+    accessed_at DOUBLE PRECISION NOT NULL
+)
+"""
+
+
+class _PostgresBackend(PgTier):
+    """Postgres 后端，同步访问；初始化失败后停用，运行期错误冷却后重试"""
+
+    name = "postgres"
+    label = "Content store Postgres backend"
+    schema = _PG_SCHEMA
+
+    def __init__(self, ttl: float):
+        super().__init__()
+        self.ttl = ttl
+
+    def write(self, digest: str, data: bytes):
+        from sqlalchemy import text
+        try:
+            with self._get_engine().begin() as conn:
+                conn.execute(
+                    text(
+                        "INSERT INTO content_blobs (digest, data, size, accessed_at) VALUES (:d, :v, :s, :now) "
+                        "ON CONFLICT (digest) DO UPDATE SET accessed_at = EXCLUDED.accessed_at"
+                    ),
+                    {"d": digest, "v": data, "s": len(data), "now": time.time()},
+                )
+            self._succeeded()
+        except Exception as e:
+            self._failed(e)
+            raise OSError(f"content store write failed: {e}") from e
+
+    def read(self, digest: str) -> Optional[bytes]:
+        from sqlalchemy import text
+        try:
+            with self._get_engine().begin() as conn:
+                row = conn.execute(
+                    text("UPDATE content_blobs SET accessed_at = :now WHERE digest = :d RETURNING data"),
+                    {"d": digest, "now": time.time()},
+                ).first()
+            self._succeeded()
+            return bytes(row[0]) if row else None
+        except Exception as e:
+            self._failed(e)
+            return None
+
+    def sweep(self):
+        from sqlalchemy import text
+        with self._get_engine().begin() as conn:
+            deleted = conn.execute(
+                text("DELETE FROM content_blobs WHERE accessed_at < :cutoff"),
+                {"cutoff": time.time() - self.ttl},
+            ).rowcount
+        if deleted:
+            logger.info(f"Content store swept {deleted} expired blobs")
+
+
+class _LocalBackend:
+    """本地目录后端，文件 mtime 记录最近访问时间"""
+
+    name = "local"
+
+    def __init__(self, root: str, ttl: float, max_bytes: int):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.available = True
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def write(self, digest: str, data: bytes):
+        path = self._path(digest)
+        if os.path.exists(path):
+            os.utime(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 原子写入：先写临时文件再改名
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def read(self, digest: str) -> Optional[bytes]:
+        path = self._path(digest)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def sweep(self):
+        files = []
+        total = 0
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        files.sort()
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for mtime, size, path in files:
+            if mtime >= cutoff and total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        if removed:
+            logger.info(f"Content store swept {removed} blobs, {total} bytes left")
+
+
+def _db_configured() -> bool:
+    try:
+        from storage.database.db import get_db_url
+        return bool((get_db_url() or "").strip())
+    except Exception:
+        return False
+
+
+class ContentStore:
+    def __init__(self, backend: str = CONTENT_STORE_BACKEND, root: str = CONTENT_STORE_DIR,
+                 ttl: float = CONTENT_STORE_TTL, max_bytes: int = CONTENT_STORE_MAX_BYTES):
+        self._backend_name = backend
+        self._root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._backend = None
+        self._backend_lock = threading.Lock()
+        # 已入队、尚未写完的内容：digest -> data
+        self._pending: Dict[str, bytes] = {}
+        self._pending_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="content-store")
+        self._last_sweep = 0.0
+        # 指标
+        self.writes = 0
+        self.write_errors = 0
+
+    @property
+    def backend(self):
+        """首次使用时选择后端（auto 模式需要探测数据库配置）"""
+        if self._backend is None:
+            with self._backend_lock:
+                if self._backend is None:
+                    self._backend = self._create_backend()
+        return self._backend
+
+    def _create_backend(self):
+        name = self._backend_name
+        if name == "auto":
+            name = "local" if self._root or not _db_configured() else "postgres"
+        if name == "postgres":
+            backend = _PostgresBackend(self.ttl)
+        else:
+            root = self._root or os.path.join(tempfile.gettempdir(), "content_store")
+            if not self._root:
+                logger.warning(
+                    f"Content store uses local directory {root}: archived originals are only visible on this host"
+                )
+            backend = _LocalBackend(root, self.ttl, self.max_bytes)
+        logger.info(f"Content store backend: {backend.name}")
+        return backend
+
+    def put(self, text: str) -> str:
+        """保存内容并返回引用；写入在后台完成，后端不可用时抛出 OSError"""
+        backend = self.backend
+        if not backend.available:
+            raise OSError("content store unavailable")
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        with self._pending_lock:
+            if digest in self._pending:
+                return f"sha256:{digest}"
+            self._pending[digest] = data
+        self._executor.submit(self._write, digest, data)
+        return f"sha256:{digest}"
+
+    def _write(self, digest: str, data: bytes):
+        try:
+            for attempt in range(CONTENT_STORE_WRITE_RETRIES + 1):
+                try:
+                    self.backend.write(digest, data)
+                    self.writes += 1
+                    break
+                except Exception as e:
+                    # 引用已经交给调用方，瞬时错误（连接断开、超时）时重试；后端已停用则放弃
+                    if attempt == CONTENT_STORE_WRITE_RETRIES or getattr(self.backend, "disabled", False):
+                        self.write_errors += 1
+                        logger.error(f"Content store failed to persist sha256:{digest}: {e}")
+                        break
+                    time.sleep(2 ** attempt)
+        finally:
+            with self._pending_lock:
+                self._pending.pop(digest, None)
+        self._maybe_sweep()
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep < CONTENT_STORE_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        try:
+            self.backend.sweep()
+        except Exception as e:
+            logger.warning(f"Content store sweep failed: {e}")
+
+    def get(self, ref: str) -> Optional[str]:
+        """按引用取回原文；引用非法或内容不存在时返回 None（可能访问数据库，异步调用方应放到线程中执行）"""
+        m = _REF_RE.match(ref)
+        if m is None:
+            return None
+        digest = m.group(1)
+        with self._pending_lock:
+            data = self._pending.get(digest)
+        if data is None:
+            data = self.backend.read(digest)
+        return data.decode("utf-8") if data is not None else None
+
+    def flush(self, timeout: Optional[float] = None):
+        """等待已入队的内容写完（停机时调用）"""
+        self._executor.submit(lambda: None).result(timeout)
+
+    def stats(self) -> Dict[str, object]:
+        with self._pending_lock:
+            pending = len(self._pending)
+        return {
+            "backend": self._backend.name if self._backend is not None else None,
+            "available": self._backend.available if self._backend is not None else None,
+            "pending": pending,
+            "writes": self.writes,
+            "write_errors": self.write_errors,
+            "ttl": self.ttl,
+        }
+
+
+content_store = ContentStore()
@@ -0,0 +1,76 @@
+"""
+Postgres 缓存/持久层的公共部分
+
+结果缓存、token 用量、内容存储各有一张表，共用同一个数据库引擎。
+- 引擎创建或建表失败：说明没有可用的数据库或权限不足，该层在本进程内停用
+- 运行期错误（连接断开、超时等）：记录日志并进入冷却期，冷却期内调用方走本地路径；
+  连续失败时冷却时间指数增长（上限 PG_TIER_RETRY_MAX），冷却结束后自动重试
+"""
+
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 首次运行期错误后的冷却时间（秒），连续失败时翻倍
+PG_TIER_RETRY_COOLDOWN = float(os.getenv("PG_TIER_RETRY_COOLDOWN", "5"))
+PG_TIER_RETRY_MAX = float(os.getenv("PG_TIER_RETRY_MAX", "300"))
+
+
+class PgTier:
+    """子类设置 label 与 schema，数据库访问通过 _get_engine()，结果通过 _succeeded()/_failed() 上报"""
+
+    label = "Postgres tier"
+    schema = ""
+
+    def __init__(self):
+        self._engine = None
+        self._lock = threading.Lock()
+        # 初始化失败，本进程内不再使用
+        self.disabled = False
+        self._failures = 0
+        self._retry_at = 0.0
+
+    @property
+    def available(self) -> bool:
+        return not self.disabled and time.monotonic() >= self._retry_at
+
+    def _get_engine(self):
+        if self._engine is None:
+            from sqlalchemy import text
+            from storage.database.db import get_engine
+            try:
+                engine = get_engine()
+                with engine.begin() as conn:
+                    conn.execute(text(self.schema))
+            except Exception as e:
+                self.disabled = True
+                logger.warning(f"{self.label} disabled: {e}")
+                raise
+            self._engine = engine
+        return self._engine
+
+    def _succeeded(self):
+        if self._failures:
+            with self._lock:
+                if self._failures:
+                    logger.info(f"{self.label} recovered after {self._failures} failures")
+                self._failures = 0
+
+    def _failed(self, e: Exception):
+        if self.disabled:
+            return
+        with self._lock:
+            self._failures += 1
+            delay = min(PG_TIER_RETRY_COOLDOWN * 2 ** (self._failures - 1), PG_TIER_RETRY_MAX)
+            self._retry_at = time.monotonic() + delay
+        logger.warning(f"{self.label} error, retrying in {delay:g}s: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "disabled": self.disabled,
+            "failures": self._failures,
+            "retry_in": max(0.0, round(self._retry_at - time.monotonic(), 1)),
+        }
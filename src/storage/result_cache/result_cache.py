@@ -0,0 +1,226 @@
+"""
+/run 结果缓存与幂等
+
+调用方在网络抖动时会重试 /run，每次重试都会重新执行整张图（包括 LLM 调用）。
+- 携带 Idempotency-Key 的请求：同一 key 在 TTL 内返回首次执行的结果
+- 开启 RESULT_CACHE_ENABLED 后：按 payload 规范化哈希 + 图版本缓存结果
+- 相同 key 的并发请求等待正在执行的那一次，不重复执行（单进程内）
+
+存储分两层：进程内 LRU（受 TTL 与字节预算约束），可选 Postgres 共享层。
+结果以 JSON 字节存储，命中时反序列化，调用方修改返回值不会污染缓存。
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import orjson
+
+from storage.database.pg_tier import PgTier
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "600"))  # 秒
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# 可选 Postgres 共享层，多 worker / 多实例间共享结果
+RESULT_CACHE_PG_ENABLED = os.getenv("RESULT_CACHE_PG_ENABLED", "false").lower() in ("1", "true", "yes")
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+_PG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS run_result_cache (
+    cache_key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    value BYTEA NOT NULL,
+    expires_at DOUBLE PRECISION NOT NULL
+)
+"""
+
+
+class IdempotencyConflict(Exception):
+    """同一 Idempotency-Key 被用于不同的 payload"""
+
+
+def payload_fingerprint(payload: Any, version: str = "") -> str:
+    """payload 的规范化哈希（键排序、紧凑编码），附带图版本"""
+    canonical = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+    return hashlib.sha256(version.encode("utf-8") + b"\0" + canonical).hexdigest()
+
+
+class _PostgresTier(PgTier):
+    """Postgres 共享层，同步访问，由调用方放到线程中执行；初始化失败后停用，运行期错误冷却后重试"""
+
+    label = "Result cache Postgres tier"
+    schema = _PG_SCHEMA
+
+    def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        from sqlalchemy import text
+        try:
+            with self._get_engine().connect() as conn:
+                row = conn.execute(
+                    text("SELECT fingerprint, value FROM run_result_cache WHERE cache_key = :k AND expires_at > :now"),
+                    {"k": key, "now": time.time()},
+                ).first()
+            self._succeeded()
+            return (row[0], bytes(row[1])) if row else None
+        except Exception as e:
+            self._failed(e)
+            return None
+
+    def put(self, key: str, fingerprint: str, value: bytes, ttl: float):
+        from sqlalchemy import text
+        try:
+            with self._get_engine().begin() as conn:
+                conn.execute(
+                    text(
+                        "INSERT INTO run_result_cache (cache_key, fingerprint, value, expires_at) "
+                        "VALUES (:k, :f, :v, :e) "
+                        "ON CONFLICT (cache_key) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, "
+                        "value = EXCLUDED.value, expires_at = EXCLUDED.expires_at"
+                    ),
+                    {"k": key, "f": fingerprint, "v": value, "e": time.time() + ttl},
+                )
+                # 顺带清理过期条目
+                conn.execute(text("DELETE FROM run_result_cache WHERE expires_at <= :now"), {"now": time.time()})
+            self._succeeded()
+        except Exception as e:
+            self._failed(e)
+
+
+class ResultCache:
+    def __init__(
+        self,
+        ttl: float = RESULT_CACHE_TTL,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        pg_enabled: bool = RESULT_CACHE_PG_ENABLED,
+    ):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # key -> (fingerprint, value, expires_at)
+        self._entries: "OrderedDict[str, Tuple[str, bytes, float]]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self._pg = _PostgresTier() if pg_enabled else None
+        # 指标
+        self.hits = 0
+        self.pg_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    # ---- 进程内 LRU ----
+    def _get_local(self, key: str) -> Optional[Tuple[str, bytes]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        fingerprint, value, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return fingerprint, value
+
+    def _put_local(self, key: str, fingerprint: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (fingerprint, value, time.monotonic() + ttl)
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    async def _lookup(self, key: str) -> Optional[Tuple[str, bytes]]:
+        found = self._get_local(key)
+        if found is not None:
+            self.hits += 1
+            return found
+        if self._pg is not None and self._pg.available:
+            found = await asyncio.to_thread(self._pg.get, key)
+            if found is not None:
+                self.pg_hits += 1
+                # 回填本地层，剩余 TTL 未知时按完整 TTL 计
+                self._put_local(key, found[0], found[1], self.ttl)
+                return found
+        return None
+
+    async def _store(self, key: str, fingerprint: str, value: bytes):
+        self._put_local(key, fingerprint, value, self.ttl)
+        if self._pg is not None and self._pg.available:
+            await asyncio.to_thread(self._pg.put, key, fingerprint, value, self.ttl)
+
+    async def get_or_run(
+        self,
+        key: str,
+        fingerprint: str,
+        runner: Callable[[], Awaitable[Any]],
+        cacheable: Callable[[Any], bool] = lambda _: True,
+    ) -> Tuple[Any, bool]:
+        """
+        返回 (结果, 是否复用)
+
+        命中缓存直接返回；相同 key 正在执行时等待其结果；否则执行 runner，
+        结果满足 cacheable 时写入缓存。同一 key 对应不同 fingerprint 时抛出 IdempotencyConflict。
+        """
+        found = await self._lookup(key)
+        if found is not None:
+            if found[0] != fingerprint:
+                raise IdempotencyConflict(f"Idempotency key '{key}' was already used with a different payload")
+            return orjson.loads(found[1]), True
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            if inflight[0] != fingerprint:
+                raise IdempotencyConflict(f"Idempotency key '{key}' is in use by a different payload")
+            self.coalesced += 1
+            # shield：等待方被取消不影响正在执行的那一次
+            value = await asyncio.shield(inflight[1])
+            return orjson.loads(value), True
+
+        self.misses += 1
+        fut = asyncio.get_running_loop().create_future()
+        # 没有等待方时也要取走异常，避免 "exception was never retrieved"
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = (fingerprint, fut)
+        try:
+            result = await runner()
+            value = orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS, default=str)
+            if cacheable(result):
+                await self._store(key, fingerprint, value)
+            fut.set_result(value)
+            return result, False
+        except BaseException as e:
+            if not fut.done():
+                if isinstance(e, asyncio.CancelledError):
+                    fut.cancel()
+                else:
+                    fut.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "pg_hits": self.pg_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "pg_enabled": self._pg is not None and self._pg.available,
+        }
@@ -0,0 +1,131 @@
+"""
+跨进程运行登记表
+
+多 worker 部署时，/cancel/{run_id} 可能落到不持有该任务的 worker 上。
+各 worker 把自己正在执行的 run_id 登记到同一个本地 SQLite 文件中；
+收到取消请求的 worker 查到归属后写入一条取消指令，由归属 worker 轮询取走并执行取消。
+"""
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+RUN_REGISTRY_PATH = os.getenv("RUN_REGISTRY_PATH", "/tmp/app/run_registry.db")
+RUN_REGISTRY_POLL_INTERVAL = float(os.getenv("RUN_REGISTRY_POLL_INTERVAL", "0.5"))  # 秒
+# SQLite 锁等待超时（秒）
+_BUSY_TIMEOUT = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    worker_id TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_worker ON runs (worker_id);
+CREATE TABLE IF NOT EXISTS cancels (
+    run_id TEXT PRIMARY KEY,
+    worker_id TEXT NOT NULL,
+    requested_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cancels_worker ON cancels (worker_id);
+"""
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RunRegistry:
+    """基于 SQLite 的跨 worker run 登记表（同一主机内共享）"""
+
+    def __init__(self, path: str = RUN_REGISTRY_PATH):
+        self.path = path
+        self.pid = os.getpid()
+        self.worker_id = f"{socket.gethostname()}:{self.pid}"
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=_BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._purge_dead_workers()
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _purge_dead_workers(self):
+        """清理已退出 worker 遗留的登记（同主机上按 pid 判断存活）"""
+        host = socket.gethostname()
+        rows = self._execute("SELECT DISTINCT worker_id, pid FROM runs")
+        for worker_id, pid in rows:
+            if worker_id.startswith(f"{host}:") and not _pid_alive(pid):
+                self._execute("DELETE FROM runs WHERE worker_id = ?", (worker_id,))
+                self._execute("DELETE FROM cancels WHERE worker_id = ?", (worker_id,))
+                logger.info(f"Purged stale runs of dead worker {worker_id}")
+
+    def register(self, run_id: str):
+        self._execute(
+            "INSERT OR REPLACE INTO runs (run_id, worker_id, pid, started_at) VALUES (?, ?, ?, ?)",
+            (run_id, self.worker_id, self.pid, time.time()),
+        )
+
+    def unregister(self, run_id: str):
+        self._execute("DELETE FROM runs WHERE run_id = ? AND worker_id = ?", (run_id, self.worker_id))
+        self._execute("DELETE FROM cancels WHERE run_id = ? AND worker_id = ?", (run_id, self.worker_id))
+
+    def owner_of(self, run_id: str) -> Optional[str]:
+        rows = self._execute("SELECT worker_id FROM runs WHERE run_id = ?", (run_id,))
+        return rows[0][0] if rows else None
+
+    def request_cancel(self, run_id: str) -> Optional[str]:
+        """为其它 worker 持有的 run 写入取消指令，返回归属 worker_id；未登记时返回 None"""
+        owner = self.owner_of(run_id)
+        if owner is None:
+            return None
+        self._execute(
+            "INSERT OR REPLACE INTO cancels (run_id, worker_id, requested_at) VALUES (?, ?, ?)",
+            (run_id, owner, time.time()),
+        )
+        return owner
+
+    def take_cancels(self) -> List[str]:
+        """取走发给当前 worker 的取消指令"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT run_id FROM cancels WHERE worker_id = ?", (self.worker_id,)
+                ).fetchall()
+                if rows:
+                    self._conn.execute("DELETE FROM cancels WHERE worker_id = ?", (self.worker_id,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [r[0] for r in rows]
+
+    def worker_stats(self) -> List[Dict[str, Any]]:
+        """每个 worker 当前在跑的 run 数量"""
+        rows = self._execute(
+            "SELECT worker_id, pid, COUNT(*) FROM runs GROUP BY worker_id, pid ORDER BY worker_id"
+        )
+        return [{"worker_id": w, "pid": pid, "live_runs": n} for w, pid, n in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM runs WHERE worker_id = ?", (self.worker_id,))
+            self._conn.execute("DELETE FROM cancels WHERE worker_id = ?", (self.worker_id,))
+            self._conn.close()
@@ -0,0 +1,173 @@
+"""
+token 用量累计
+
+按会话（thread_id）与项目（project_id）累计模型调用的 token 用量，供 token 预算判断与查询。
+进程内保存最近活跃的条目；开启 TOKEN_USAGE_PG_ENABLED 后以 Postgres 为准：
+- 累加用 INSERT ... ON CONFLICT DO UPDATE ... RETURNING 原子完成，返回的新累计值写回进程内条目
+- 进程内条目超过 TOKEN_USAGE_PG_REFRESH 秒未与 Postgres 同步时，读取前重新查询
+这样多 worker 共用同一份累计值，预算检查能看到其它 worker 的用量。
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from storage.database.pg_tier import PgTier
+
+logger = logging.getLogger(__name__)
+
+TOKEN_USAGE_PG_ENABLED = os.getenv("TOKEN_USAGE_PG_ENABLED", "false").lower() in ("1", "true", "yes")
+# 进程内保留的条目数
+TOKEN_USAGE_MAX_ENTRIES = int(os.getenv("TOKEN_USAGE_MAX_ENTRIES", "100000"))
+# 进程内条目与 Postgres 同步后可直接使用的时长（秒）；0 表示每次读取都查询 Postgres
+TOKEN_USAGE_PG_REFRESH = float(os.getenv("TOKEN_USAGE_PG_REFRESH", "0"))
+
+SCOPE_SESSION = "session"
+SCOPE_PROJECT = "project"
+
+_PG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_usage (
+    scope TEXT NOT NULL,
+    scope_key TEXT NOT NULL,
+    input_tokens BIGINT NOT NULL DEFAULT 0,
+    output_tokens BIGINT NOT NULL DEFAULT 0,
+    total_tokens BIGINT NOT NULL DEFAULT 0,
+    updated_at DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (scope, scope_key)
+)
+"""
+
+UsageKey = Tuple[str, str]
+
+
+def _as_dict(usage: List[int]) -> Dict[str, int]:
+    return {"input_tokens": usage[0], "output_tokens": usage[1], "total_tokens": usage[2]}
+
+
+class _PostgresTier(PgTier):
+    """Postgres 持久层，同步访问；初始化失败后停用，运行期错误冷却后重试"""
+
+    label = "Token usage Postgres tier"
+    schema = _PG_SCHEMA
+
+    def get(self, key: UsageKey) -> Optional[List[int]]:
+        from sqlalchemy import text
+        try:
+            with self._get_engine().connect() as conn:
+                row = conn.execute(
+                    text("SELECT input_tokens, output_tokens, total_tokens FROM token_usage "
+                         "WHERE scope = :s AND scope_key = :k"),
+                    {"s": key[0], "k": key[1]},
+                ).first()
+            self._succeeded()
+            return [int(row[0]), int(row[1]), int(row[2])] if row else None
+        except Exception as e:
+            self._failed(e)
+            return None
+
+    def add(self, keys: List[UsageKey], delta: List[int]) -> Optional[Dict[UsageKey, List[int]]]:
+        """原子累加并返回各条目的新累计值；失败时返回 None"""
+        from sqlalchemy import text
+        totals: Dict[UsageKey, List[int]] = {}
+        try:
+            with self._get_engine().begin() as conn:
+                for scope, scope_key in keys:
+                    row = conn.execute(
+                        text(
+                            "INSERT INTO token_usage (scope, scope_key, input_tokens, output_tokens, total_tokens, updated_at) "
+                            "VALUES (:s, :k, :i, :o, :t, :now) "
+                            "ON CONFLICT (scope, scope_key) DO UPDATE SET "
+                            "input_tokens = token_usage.input_tokens + EXCLUDED.input_tokens, "
+                            "output_tokens = token_usage.output_tokens + EXCLUDED.output_tokens, "
+                            "total_tokens = token_usage.total_tokens + EXCLUDED.total_tokens, "
+                            "updated_at = EXCLUDED.updated_at "
+                            "RETURNING input_tokens, output_tokens, total_tokens"
+                        ),
+                        {"s": scope, "k": scope_key, "i": delta[0], "o": delta[1], "t": delta[2], "now": time.time()},
+                    ).first()
+                    totals[(scope, scope_key)] = [int(row[0]), int(row[1]), int(row[2])]
+            self._succeeded()
+            return totals
+        except Exception as e:
+            self._failed(e)
+            return None
+
+
+class TokenUsageStore:
+    def __init__(self, pg_enabled: bool = TOKEN_USAGE_PG_ENABLED, max_entries: int = TOKEN_USAGE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._usage: "OrderedDict[UsageKey, List[int]]" = OrderedDict()
+        # 条目最近一次与 Postgres 同步的时间（monotonic）
+        self._synced: Dict[UsageKey, float] = {}
+        self._lock = threading.Lock()
+        self._pg = _PostgresTier() if pg_enabled else None
+
+    @property
+    def blocking(self) -> bool:
+        """读写是否会访问数据库（异步调用方应放到线程中执行）"""
+        return self._pg is not None and self._pg.available
+
+    def _fresh(self, key: UsageKey) -> bool:
+        if not self.blocking:
+            return True
+        synced = self._synced.get(key)
+        return synced is not None and time.monotonic() - synced < TOKEN_USAGE_PG_REFRESH
+
+    def _store(self, key: UsageKey, loaded: Optional[List[int]]) -> List[int]:
+        """写入进程内条目（调用方持有 _lock）；loaded 为 Postgres 中的累计值"""
+        usage = self._usage.setdefault(key, [0, 0, 0])
+        self._usage.move_to_end(key)
+        if loaded is not None:
+            usage[:] = loaded
+            self._synced[key] = time.monotonic()
+        while len(self._usage) > self.max_entries:
+            evicted, _ = self._usage.popitem(last=False)
+            self._synced.pop(evicted, None)
+        return usage
+
+    def _load(self, key: UsageKey) -> List[int]:
+        with self._lock:
+            usage = self._usage.get(key)
+            if usage is not None and self._fresh(key):
+                self._usage.move_to_end(key)
+                return usage
+        loaded = self._pg.get(key) if self.blocking else None
+        with self._lock:
+            return self._store(key, loaded)
+
+    def get(self, scope: str, scope_key: str) -> Dict[str, int]:
+        usage = self._load((scope, scope_key))
+        with self._lock:
+            return _as_dict(usage)
+
+    def add(self, session_id: Optional[str], project_id: Optional[str], input_tokens: int, output_tokens: int, total_tokens: int):
+        """把一次模型调用的用量累加到会话与项目"""
+        delta = [input_tokens, output_tokens, total_tokens or input_tokens + output_tokens]
+        if not any(delta):
+            return
+        keys = [(SCOPE_SESSION, session_id)] if session_id else []
+        if project_id:
+            keys.append((SCOPE_PROJECT, project_id))
+        if not keys:
+            return
+        totals = self._pg.add(keys, delta) if self.blocking else None
+        if totals is not None:
+            with self._lock:
+                for key, loaded in totals.items():
+                    self._store(key, loaded)
+            return
+        for key in keys:
+            usage = self._load(key)
+            with self._lock:
+                for i, v in enumerate(delta):
+                    usage[i] += v
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._usage), "pg_enabled": self.blocking}
+
+
+token_usage = TokenUsageStore()
@@ -4,9 +4,13 @@
 """
 import os
 import base64
+import logging
 from typing import Optional
 from langchain.tools import tool, ToolRuntime
 from coze_coding_utils.runtime_ctx.context import new_context
+from utils.file.image_preprocess import preprocess_image
+
+logger = logging.getLogger(__name__)
 
 @tool
 def read_image_file(image_path: str, runtime: ToolRuntime = None) -> str:
@@ -44,7 +48,7 @@ def read_image_file(image_path: str, runtime: ToolRuntime = None) -> str:
     # 读取文件并转换为base64
     try:
         with open(full_path, "rb") as f:
-            image_data = base64.b64encode(f.read()).decode('utf-8')
+            raw = f.read()
         
         # 确定图片格式
         file_ext = os.path.splitext(full_path)[1].lower()
@@ -56,6 +60,16 @@ def read_image_file(image_path: str, runtime: ToolRuntime = None) -> str:
             '.webp': 'image/webp'
         }.get(file_ext, 'image/jpeg')
         
+        # 缩放、重新编码并去除元数据，减小发给视觉模型的数据量
+        processed = preprocess_image(raw, mime_type)
+        if processed.transformed:
+            logger.info(
+                f"Image preprocessed: {os.path.basename(full_path)} {processed.original_bytes} -> "
+                f"{processed.output_bytes} bytes in {processed.elapsed_ms:.1f}ms (cached={processed.cached})"
+            )
+        mime_type = processed.mime_type
+        image_data = base64.b64encode(processed.data).decode('utf-8')
+        
         # 返回data URL
         return f"data:{mime_type};base64,{image_data}"
     
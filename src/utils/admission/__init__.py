@@ -0,0 +1,17 @@
+from utils.admission.limiter import (
+    AdmissionController,
+    AdmissionRejected,
+    Permit,
+    PRIORITY_HEADER,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_BATCH,
+)
+
+__all__ = [
+    "AdmissionController",
+    "AdmissionRejected",
+    "Permit",
+    "PRIORITY_HEADER",
+    "PRIORITY_INTERACTIVE",
+    "PRIORITY_BATCH",
+]
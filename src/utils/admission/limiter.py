@@ -0,0 +1,208 @@
+"""
+准入控制与削峰
+
+在 /run、/stream_run、/v1/chat/completions 之前限制同时执行的 run 数量：
+- 超出并发上限的请求进入按优先级划分的有界等待队列（interactive 优先于 batch）
+- 队列已满立即返回 429，排队超时返回 503，均带 Retry-After
+- 统计在跑数量、各队列深度、排队耗时，供 /admission 查询
+- 停机排空时 close()，新请求与排队中的请求均以 503 拒绝
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH)
+
+# 请求头中指定优先级，缺省为 interactive
+PRIORITY_HEADER = "X-Run-Priority"
+
+# 并发上限，<= 0 表示不限制
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "0"))
+ADMISSION_MAX_QUEUE_INTERACTIVE = int(os.getenv("ADMISSION_MAX_QUEUE_INTERACTIVE", "64"))
+ADMISSION_MAX_QUEUE_BATCH = int(os.getenv("ADMISSION_MAX_QUEUE_BATCH", "256"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))  # 秒
+
+# 平滑系数，用于估算单个 run 的占用时长与排队耗时
+_EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """请求未被准入"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Permit:
+    """一次准入许可，release 可重复调用"""
+
+    def __init__(self, controller: "AdmissionController", priority: str):
+        self._controller = controller
+        self.priority = priority
+        self.acquired_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(self)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+        max_queue: Optional[Dict[str, int]] = None,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue or {
+            PRIORITY_INTERACTIVE: ADMISSION_MAX_QUEUE_INTERACTIVE,
+            PRIORITY_BATCH: ADMISSION_MAX_QUEUE_BATCH,
+        }
+        self.queue_timeout = queue_timeout
+        self.closed = False
+        self.in_flight = 0
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {p: deque() for p in PRIORITIES}
+        # 指标
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.wait_ms_ewma = 0.0
+        self.wait_ms_max = 0.0
+        self.hold_s_ewma = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrency > 0
+
+    @staticmethod
+    def normalize_priority(value: Optional[str]) -> str:
+        value = (value or "").strip().lower()
+        return value if value in PRIORITIES else PRIORITY_INTERACTIVE
+
+    def _retry_after(self) -> int:
+        """按排队长度与单个 run 平均占用时长估算重试间隔（秒）"""
+        queued = sum(len(q) for q in self._waiters.values())
+        per_slot = self.hold_s_ewma or 1.0
+        return max(1, math.ceil(per_slot * (queued + 1) / max(1, self.max_concurrency)))
+
+    async def acquire(self, priority: str = PRIORITY_INTERACTIVE) -> Permit:
+        priority = self.normalize_priority(priority)
+        if self.closed:
+            raise AdmissionRejected(503, "Server is draining", 1)
+        if not self.enabled:
+            return Permit(self, priority)
+
+        t0 = time.monotonic()
+        # 有空闲且没有更高优先级的等待者时直接准入
+        if self.in_flight < self.max_concurrency and not self._has_waiters_before(priority):
+            return self._grant(priority, t0)
+
+        waiters = self._waiters[priority]
+        if len(waiters) >= self.max_queue.get(priority, 0):
+            self.rejected_queue_full += 1
+            raise AdmissionRejected(429, f"Too many queued {priority} runs", self._retry_after())
+
+        fut = asyncio.get_running_loop().create_future()
+        waiters.append(fut)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if self._was_granted(fut):
+                # 超时与被唤醒同时发生：名额已转交给本请求
+                return self._granted(priority, t0)
+            fut.cancel()
+            self._discard(waiters, fut)
+            self.rejected_timeout += 1
+            raise AdmissionRejected(503, f"Timed out waiting for a free {priority} slot", self._retry_after())
+        except asyncio.CancelledError:
+            if self._was_granted(fut):
+                # 已拿到名额但调用方被取消，归还名额
+                self._granted(priority, t0).release()
+            else:
+                fut.cancel()
+                self._discard(waiters, fut)
+            raise
+        return self._granted(priority, t0)
+
+    def close(self):
+        """停止准入：拒绝新请求，并唤醒所有排队者以 503 返回"""
+        self.closed = True
+        for waiters in self._waiters.values():
+            while waiters:
+                fut = waiters.popleft()
+                if not fut.done():
+                    fut.set_exception(AdmissionRejected(503, "Server is draining", 1))
+
+    def _has_waiters_before(self, priority: str) -> bool:
+        for p in PRIORITIES:
+            if self._waiters[p]:
+                return True
+            if p == priority:
+                break
+        return False
+
+    @staticmethod
+    def _was_granted(fut: asyncio.Future) -> bool:
+        return fut.done() and not fut.cancelled() and fut.exception() is None
+
+    @staticmethod
+    def _discard(waiters: Deque[asyncio.Future], fut: asyncio.Future):
+        try:
+            waiters.remove(fut)
+        except ValueError:
+            pass
+
+    def _grant(self, priority: str, t0: float) -> Permit:
+        self.in_flight += 1
+        return self._granted(priority, t0)
+
+    def _granted(self, priority: str, t0: float) -> Permit:
+        """名额已计入 in_flight，记录排队指标并返回许可"""
+        wait_ms = (time.monotonic() - t0) * 1000
+        self.admitted += 1
+        self.wait_ms_ewma = _EWMA_ALPHA * wait_ms + (1 - _EWMA_ALPHA) * self.wait_ms_ewma
+        self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+        return Permit(self, priority)
+
+    def _release(self, permit: Permit):
+        if not self.enabled:
+            return
+        held = time.monotonic() - permit.acquired_at
+        self.hold_s_ewma = _EWMA_ALPHA * held + (1 - _EWMA_ALPHA) * self.hold_s_ewma
+        # 名额直接转交给优先级最高的等待者，in_flight 不变
+        for p in PRIORITIES:
+            waiters = self._waiters[p]
+            while waiters:
+                fut = waiters.popleft()
+                if not fut.done():
+                    fut.set_result(None)
+                    return
+        self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "closed": self.closed,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": {p: len(q) for p, q in self._waiters.items()},
+            "max_queue": dict(self.max_queue),
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_ms_ewma": round(self.wait_ms_ewma, 2),
+            "wait_ms_max": round(self.wait_ms_max, 2),
+            "hold_s_ewma": round(self.hold_s_ewma, 3),
+        }
@@ -0,0 +1,11 @@
+"""token 预算：按会话、按项目限制累计 token 用量；中间件见 utils.budget.token_budget"""
+
+from utils.budget.errors import TokenBudgetExceeded
+from utils.budget.scope import budget_scope, CONFIG_SESSION_KEY, CONFIG_PROJECT_KEY
+
+__all__ = [
+    "TokenBudgetExceeded",
+    "budget_scope",
+    "CONFIG_SESSION_KEY",
+    "CONFIG_PROJECT_KEY",
+]
@@ -0,0 +1,12 @@
+"""token 预算异常"""
+
+
+class TokenBudgetExceeded(Exception):
+    """会话或项目的累计 token 用量超出预算"""
+
+    def __init__(self, scope: str, scope_key: str, used: int, limit: int):
+        self.scope = scope
+        self.scope_key = scope_key
+        self.used = used
+        self.limit = limit
+        super().__init__(f"Token budget exceeded for {scope} '{scope_key}': used {used}, limit {limit}")
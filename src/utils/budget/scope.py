@@ -0,0 +1,24 @@
+"""
+token 预算的计量范围
+
+会话与项目 ID 以请求 payload 中的 session_id / project_id 为准，通过 run_config 的 configurable 传给
+TokenBudgetMiddleware。/run 的 thread_id 是 run_id，不能代表会话；项目 ID 未在 payload 中给出时
+回退到运行时 context（COZE_PROJECT_ID）。
+"""
+
+from typing import Any, Dict
+
+CONFIG_SESSION_KEY = "budget_session_id"
+CONFIG_PROJECT_KEY = "budget_project_id"
+
+
+def budget_scope(payload: Any) -> Dict[str, str]:
+    """从请求 payload 提取计量范围，返回可并入 configurable 的字典"""
+    if not isinstance(payload, dict):
+        return {}
+    scope = {}
+    for key, config_key in (("session_id", CONFIG_SESSION_KEY), ("project_id", CONFIG_PROJECT_KEY)):
+        value = payload.get(key)
+        if value:
+            scope[config_key] = str(value)
+    return scope
@@ -0,0 +1,113 @@
+"""
+token 预算
+
+按会话、按项目限制累计 token 用量。每次模型调用前检查预算，超出时按 TOKEN_BUDGET_ACTION 处理：
+- reject：抛出 TokenBudgetExceeded，本次 run 以预算超限结束
+- downgrade：改用 TOKEN_BUDGET_DOWNGRADE_MODEL 继续（未配置降级模型时按 reject 处理）
+每次模型调用后把响应中的 usage_metadata 计入会话与项目累计值。
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.messages import AIMessage
+
+from storage.token_usage.token_usage import token_usage, SCOPE_SESSION, SCOPE_PROJECT
+from utils.budget.errors import TokenBudgetExceeded
+from utils.budget.scope import CONFIG_SESSION_KEY, CONFIG_PROJECT_KEY
+
+logger = logging.getLogger(__name__)
+
+# 0 表示不限
+TOKEN_BUDGET_SESSION = int(os.getenv("TOKEN_BUDGET_SESSION", "0"))
+TOKEN_BUDGET_PROJECT = int(os.getenv("TOKEN_BUDGET_PROJECT", "0"))
+TOKEN_BUDGET_ACTION = os.getenv("TOKEN_BUDGET_ACTION", "reject").lower()  # reject | downgrade
+TOKEN_BUDGET_DOWNGRADE_MODEL = os.getenv("TOKEN_BUDGET_DOWNGRADE_MODEL", "")
+
+
+def check_budget(session_id: Optional[str], project_id: Optional[str]) -> Optional[TokenBudgetExceeded]:
+    """返回第一个超出的预算，未超出时返回 None"""
+    for scope, scope_key, limit in (
+        (SCOPE_SESSION, session_id, TOKEN_BUDGET_SESSION),
+        (SCOPE_PROJECT, project_id, TOKEN_BUDGET_PROJECT),
+    ):
+        if limit > 0 and scope_key:
+            used = token_usage.get(scope, scope_key)["total_tokens"]
+            if used >= limit:
+                return TokenBudgetExceeded(scope, scope_key, used, limit)
+    return None
+
+
+def budget_status(session_id: Optional[str], project_id: Optional[str]) -> Dict[str, Any]:
+    status: Dict[str, Any] = {"action": TOKEN_BUDGET_ACTION, "downgrade_model": TOKEN_BUDGET_DOWNGRADE_MODEL or None}
+    if session_id:
+        status["session"] = {**token_usage.get(SCOPE_SESSION, session_id), "limit": TOKEN_BUDGET_SESSION}
+    if project_id:
+        status["project"] = {**token_usage.get(SCOPE_PROJECT, project_id), "limit": TOKEN_BUDGET_PROJECT}
+    return status
+
+
+def _scope_ids(request: Any) -> Tuple[Optional[str], Optional[str]]:
+    """会话与项目 ID：优先取 payload 传入的计量范围（见 utils.budget.scope），否则取 thread_id 与运行时 context"""
+    from langgraph.config import get_config
+
+    try:
+        configurable = get_config().get("configurable", {})
+    except RuntimeError:
+        configurable = {}
+    session_id = configurable.get(CONFIG_SESSION_KEY) or configurable.get("thread_id")
+    ctx = getattr(request.runtime, "context", None) if request.runtime else None
+    project_id = configurable.get(CONFIG_PROJECT_KEY) or getattr(ctx, "project_id", None)
+    return session_id or None, project_id or None
+
+
+class TokenBudgetMiddleware(AgentMiddleware):
+    """模型调用前检查 token 预算，调用后累计用量"""
+
+    @staticmethod
+    def _enforce(request: Any, session_id: Optional[str], project_id: Optional[str]) -> Any:
+        violation = check_budget(session_id, project_id)
+        if violation is None:
+            return request
+        if TOKEN_BUDGET_ACTION == "downgrade" and TOKEN_BUDGET_DOWNGRADE_MODEL and hasattr(request.model, "model_name"):
+            if request.model.model_name != TOKEN_BUDGET_DOWNGRADE_MODEL:
+                logger.info(f"{violation}, downgrading to {TOKEN_BUDGET_DOWNGRADE_MODEL}")
+                request.model = request.model.model_copy(update={"model_name": TOKEN_BUDGET_DOWNGRADE_MODEL})
+            return request
+        raise violation
+
+    @staticmethod
+    def _record(response: Any, session_id: Optional[str], project_id: Optional[str]):
+        messages = getattr(response, "result", None)
+        if messages is None:
+            messages = [response]
+        totals = [0, 0, 0]
+        for msg in messages:
+            usage = getattr(msg, "usage_metadata", None) if isinstance(msg, AIMessage) else None
+            if usage:
+                totals[0] += usage.get("input_tokens", 0)
+                totals[1] += usage.get("output_tokens", 0)
+                totals[2] += usage.get("total_tokens", 0)
+        token_usage.add(session_id, project_id, *totals)
+
+    def wrap_model_call(self, request, handler):
+        session_id, project_id = _scope_ids(request)
+        response = handler(self._enforce(request, session_id, project_id))
+        self._record(response, session_id, project_id)
+        return response
+
+    async def awrap_model_call(self, request, handler):
+        session_id, project_id = _scope_ids(request)
+        if token_usage.blocking:
+            request = await asyncio.to_thread(self._enforce, request, session_id, project_id)
+        else:
+            request = self._enforce(request, session_id, project_id)
+        response = await handler(request)
+        if token_usage.blocking:
+            await asyncio.to_thread(self._record, response, session_id, project_id)
+        else:
+            self._record(response, session_id, project_id)
+        return response
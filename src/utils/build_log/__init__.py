@@ -0,0 +1,23 @@
+"""构建日志预处理：在调用 LLM 前提取错误区域"""
+
+from utils.build_log.reducer import (
+    BuildLogReducer,
+    ReducedLog,
+    reduce_build_log,
+    looks_like_build_log,
+    estimate_tokens,
+)
+from utils.build_log.signature import build_log_signature, normalize_error_line
+from utils.build_log.answer_cache import AnswerCache, answer_cache
+
+__all__ = [
+    "BuildLogReducer",
+    "ReducedLog",
+    "reduce_build_log",
+    "looks_like_build_log",
+    "estimate_tokens",
+    "build_log_signature",
+    "normalize_error_line",
+    "AnswerCache",
+    "answer_cache",
+]
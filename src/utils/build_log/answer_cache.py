@@ -0,0 +1,81 @@
+"""
+错误特征答案缓存
+
+CI 中反复出现的同一类失败（KAPT/Room、仓库顺序等）每次都要走一遍数分钟的思考模型调用。
+这里按 (错误特征, 模型, system prompt 哈希, 提问哈希) 缓存已完成的分析结果，TTL 内命中直接返回。
+进程内缓存，多实例之间不共享。默认关闭，设置 ANSWER_CACHE_ENABLED=true 开启。
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))  # 秒
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+# 小于该字符数的消息不走缓存：日志太短时错误特征区分度不够
+ANSWER_CACHE_MIN_CHARS = int(os.getenv("ANSWER_CACHE_MIN_CHARS", "2000"))
+
+AnswerKey = Tuple[str, str, str, str]
+
+
+def answer_key(signature: str, model: str, system_prompt: Optional[str], question: str = "") -> AnswerKey:
+    sp_hash = hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest()[:16]
+    q_hash = hashlib.sha256(question.encode("utf-8")).hexdigest()[:16]
+    return signature, model, sp_hash, q_hash
+
+
+class AnswerCache:
+    """线程安全的 TTL + LRU 缓存；同步与异步模型调用路径共用"""
+
+    def __init__(self, ttl: float = ANSWER_CACHE_TTL, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (answer, expires_at)
+        self._entries: "OrderedDict[AnswerKey, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def get(self, key: AnswerKey) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: AnswerKey, answer: str):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (answer, time.monotonic() + self.ttl)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": ANSWER_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+            }
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,48 @@
+"""
+按内容摘要缓存计算结果
+
+构建日志动辄数 MB，functools.lru_cache 以原文为键会把这些字符串一直留在内存里。
+这里以 sha256(原文) 为键，只保存计算结果（精简后的文本、归一化错误行等），不持有原文。
+"""
+
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class DigestCache(Generic[T]):
+    """线程安全的小型 LRU：键为文本的 sha256 摘要"""
+
+    def __init__(self, func: Callable[[str], T], maxsize: int = 64):
+        self._func = func
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[bytes, T]" = OrderedDict()
+        self._lock = threading.Lock()
+        functools.update_wrapper(self, func)
+
+    def __call__(self, text: str) -> T:
+        key = hashlib.sha256(text.encode("utf-8", "surrogatepass")).digest()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = self._func(text)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def cache_clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def digest_cache(maxsize: int = 64) -> Callable[[Callable[[str], T]], DigestCache[T]]:
+    """装饰器形式的 DigestCache"""
+    return lambda func: DigestCache(func, maxsize)
@@ -0,0 +1,254 @@
+"""
+构建日志中间件
+
+- BuildLogReducerMiddleware：每次模型调用前，把用户消息中的大段构建日志替换为精简后的错误区域。
+  只改写发给模型的请求，checkpoint 中保存的仍是原始消息。
+- ErrorAnswerCacheMiddleware：首轮提问是构建日志时，按错误特征复用已完成的分析结果，跳过模型调用；
+  特征不完全一致时检索相似错误，回放或作为参考上下文。
+"""
+
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Optional, Tuple
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.messages import AIMessage, HumanMessage
+
+from utils.build_log.answer_cache import (
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_MIN_CHARS,
+    AnswerKey,
+    answer_cache,
+    answer_key,
+)
+from utils.build_log.digest_cache import digest_cache
+from utils.build_log.reducer import reduce_build_log, looks_like_build_log
+from utils.build_log.signature import build_log_error_lines, build_log_question, build_log_signature
+from utils.build_log.similarity import SimilarityIndex
+
+logger = logging.getLogger(__name__)
+
+BUILD_LOG_REDUCER_ENABLED = os.getenv("BUILD_LOG_REDUCER_ENABLED", "true").lower() in ("1", "true", "yes")
+# 小于该字符数的消息不做处理
+BUILD_LOG_MIN_CHARS = int(os.getenv("BUILD_LOG_MIN_CHARS", "6000"))
+# 命中时是否按流式逐块输出缓存的答案（false 时一次性返回整条消息）
+ANSWER_CACHE_STREAM = os.getenv("ANSWER_CACHE_STREAM", "true").lower() in ("1", "true", "yes")
+
+# 相似错误的处理方式：context 作为参考交给模型，answer 直接回放，off（默认）关闭；需同时开启 ANSWER_CACHE_ENABLED
+SIMILAR_ANSWER_MODE = os.getenv("SIMILAR_ANSWER_MODE", "off").lower()
+SIMILAR_ANSWER_THRESHOLD = float(os.getenv("SIMILAR_ANSWER_THRESHOLD", "0.85"))
+SIMILAR_ANSWER_TOP_K = int(os.getenv("SIMILAR_ANSWER_TOP_K", "3"))
+
+_CACHED_ANSWER_PREFIX = "> 该构建错误与近期已分析过的错误特征一致，以下为缓存的分析结果。\n\n"
+_SIMILAR_ANSWER_PREFIX = "> 该构建错误与近期已分析过的错误高度相似（相似度 {score:.2f}），以下为该错误的分析结果，请注意核对差异。\n\n"
+_SIMILAR_CONTEXT_TEMPLATE = (
+    "\n\n## 参考：近期相似错误的分析（相似度 {score:.2f}）\n"
+    "以下分析针对一条相似但不完全相同的构建错误，可作为参考，需结合本次日志核对差异：\n{answer}"
+)
+
+similarity_index = SimilarityIndex()
+
+
+def _reduce_text(text: str) -> str:
+    if len(text) < BUILD_LOG_MIN_CHARS:
+        return text
+    reduced = _reduced_build_log(text)
+    return text if reduced is None else reduced
+
+
+@digest_cache(maxsize=64)
+def _reduced_build_log(text: str) -> Optional[str]:
+    """
+    同一条历史消息在后续每轮都会再次发送，按内容摘要缓存精简结果
+
+    不是构建日志或精简无收益时返回 None，缓存中不保留原文。
+    """
+    if not looks_like_build_log(text):
+        return None
+    reduced = reduce_build_log(text)
+    if reduced.saved_tokens <= 0:
+        return None
+    logger.info(
+        f"Build log reduced: lines {reduced.original_lines} -> {reduced.kept_lines}, "
+        f"tokens ~{reduced.original_tokens} -> ~{reduced.reduced_tokens} (saved ~{reduced.saved_tokens})"
+    )
+    header = (
+        f"[构建日志已预处理：原始 {reduced.original_lines} 行，约 {reduced.original_tokens} tokens；"
+        f"仅保留错误区域 {reduced.kept_lines} 行，约 {reduced.reduced_tokens} tokens]\n"
+    )
+    return header + reduced.text
+
+
+def _reduce_message(msg: Any) -> Any:
+    if not isinstance(msg, HumanMessage):
+        return msg
+    content = msg.content
+    if isinstance(content, str):
+        new_content = _reduce_text(content)
+        changed = new_content != content
+    elif isinstance(content, list):
+        new_content = []
+        changed = False
+        for block in content:
+            if isinstance(block, dict) and block.get("type") == "text" and isinstance(block.get("text"), str):
+                text = _reduce_text(block["text"])
+                if text != block["text"]:
+                    block = {**block, "text": text}
+                    changed = True
+            new_content.append(block)
+    else:
+        return msg
+    return msg.model_copy(update={"content": new_content}) if changed else msg
+
+
+class BuildLogReducerMiddleware(AgentMiddleware):
+    """模型调用前精简用户消息中的构建日志"""
+
+    @staticmethod
+    def _with_reduced_logs(request: Any) -> Any:
+        if BUILD_LOG_REDUCER_ENABLED and request.messages:
+            request.messages = [_reduce_message(m) for m in request.messages]
+        return request
+
+    def wrap_model_call(self, request, handler):
+        return handler(self._with_reduced_logs(request))
+
+    async def awrap_model_call(self, request, handler):
+        return await handler(self._with_reduced_logs(request))
+
+
+def _message_text(msg: Any) -> str:
+    content = msg.content
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(
+            block if isinstance(block, str) else block.get("text", "")
+            for block in content
+            if isinstance(block, str) or (isinstance(block, dict) and block.get("type") == "text")
+        )
+    return ""
+
+
+def _final_answer(response: Any) -> Optional[str]:
+    """从模型响应中取出可缓存的最终答案；包含工具调用或为空时不缓存"""
+    messages = getattr(response, "result", None)
+    if messages is None:
+        messages = [response]
+    ai = next((m for m in reversed(messages) if isinstance(m, AIMessage)), None)
+    if ai is None or ai.tool_calls:
+        return None
+    text = _message_text(ai).strip()
+    return text or None
+
+
+@dataclass
+class _AnswerLookup:
+    key: AnswerKey
+    lines: Tuple[str, ...]
+    # 命中时直接回放的答案及其前缀
+    answer: Optional[str] = None
+    prefix: str = _CACHED_ANSWER_PREFIX
+    # 相似错误的历史分析，作为精简上下文附加到 system prompt
+    context: Optional[str] = None
+
+
+def _similar_lookup(lookup: _AnswerLookup):
+    if SIMILAR_ANSWER_MODE not in ("answer", "context"):
+        return
+    matches = similarity_index.search(
+        lookup.key[1:], lookup.lines, top_k=SIMILAR_ANSWER_TOP_K, threshold=SIMILAR_ANSWER_THRESHOLD
+    )
+    if not matches:
+        return
+    best = matches[0]
+    logger.info(f"Similar error found: score={best.score:.3f}, signature={best.signature[:12]}, mode={SIMILAR_ANSWER_MODE}")
+    if SIMILAR_ANSWER_MODE == "answer":
+        lookup.answer = best.answer
+        lookup.prefix = _SIMILAR_ANSWER_PREFIX.format(score=best.score)
+    else:
+        lookup.context = _SIMILAR_CONTEXT_TEMPLATE.format(score=best.score, answer=best.answer)
+
+
+class ErrorAnswerCacheMiddleware(AgentMiddleware):
+    """
+    按错误特征缓存分析结果
+
+    只处理会话首轮（请求中只有一条用户消息且内容是构建日志），追问依赖上下文，不走缓存；
+    短于 ANSWER_CACHE_MIN_CHARS 的消息也不走缓存。缓存键包含日志前后的提问文本，
+    同一份日志配不同的问题各自缓存。
+    特征完全一致时回放缓存答案；否则在相似错误索引中检索，按 SIMILAR_ANSWER_MODE
+    回放最相似的答案，或把它作为参考附加到 system prompt 后照常调用模型。
+    需放在 BuildLogReducerMiddleware 之前，以便基于原始日志计算特征。
+    """
+
+    @staticmethod
+    def _lookup(request: Any) -> Optional[_AnswerLookup]:
+        if not ANSWER_CACHE_ENABLED or not request.messages:
+            return None
+        humans = [m for m in request.messages if isinstance(m, HumanMessage)]
+        if len(humans) != 1 or len(request.messages) != 1:
+            return None
+        text = _message_text(humans[0])
+        if len(text) < ANSWER_CACHE_MIN_CHARS:
+            return None
+        lines = build_log_error_lines(text)
+        if not lines:
+            return None
+        signature = build_log_signature(text)
+        model = getattr(request.model, "model_name", None) or type(request.model).__name__
+        key = answer_key(signature, model, getattr(request, "system_prompt", None), build_log_question(text))
+        lookup = _AnswerLookup(key=key, lines=lines)
+        lookup.answer = answer_cache.get(lookup.key)
+        if lookup.answer is not None:
+            logger.info(f"Error answer cache hit: signature={signature[:12]}, model={model}")
+        else:
+            _similar_lookup(lookup)
+        return lookup
+
+    @staticmethod
+    def _replay_request(request: Any, lookup: _AnswerLookup) -> Any:
+        """把模型替换为回放缓存答案的假模型，走正常的流式输出路径"""
+        from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+
+        request.model = GenericFakeChatModel(messages=iter([AIMessage(content=lookup.prefix + lookup.answer)]))
+        request.model_settings = {}
+        return request
+
+    @staticmethod
+    def _with_context(request: Any, lookup: _AnswerLookup) -> Any:
+        if lookup.context:
+            request.system_prompt = (request.system_prompt or "") + lookup.context
+        return request
+
+    @staticmethod
+    def _store(lookup: _AnswerLookup, response: Any):
+        answer = _final_answer(response)
+        if answer is not None:
+            answer_cache.put(lookup.key, answer)
+            similarity_index.add(lookup.key[1:], lookup.key[0], lookup.lines, answer)
+
+    def wrap_model_call(self, request, handler):
+        lookup = self._lookup(request)
+        if lookup is None:
+            return handler(request)
+        if lookup.answer is not None:
+            if ANSWER_CACHE_STREAM:
+                return handler(self._replay_request(request, lookup))
+            return AIMessage(content=lookup.prefix + lookup.answer)
+        response = handler(self._with_context(request, lookup))
+        self._store(lookup, response)
+        return response
+
+    async def awrap_model_call(self, request, handler):
+        lookup = self._lookup(request)
+        if lookup is None:
+            return await handler(request)
+        if lookup.answer is not None:
+            if ANSWER_CACHE_STREAM:
+                return await handler(self._replay_request(request, lookup))
+            return AIMessage(content=lookup.prefix + lookup.answer)
+        response = await handler(self._with_context(request, lookup))
+        self._store(lookup, response)
+        return response
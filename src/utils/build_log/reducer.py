@@ -0,0 +1,281 @@
+"""
+构建日志预处理
+
+Android/Gradle 构建日志动辄数 MB，大部分是下载进度、任务列表和重复的栈帧。
+这里在调用 LLM 之前逐行扫描日志，只保留错误区域：
+- ERROR / FAILURE / Exception 等错误行及其上下文
+- "* What went wrong:" 整段
+- 连续栈帧只保留前若干帧，已出现过的栈帧与相同的错误/警告行只保留首条并计数
+- 丢弃下载、进度、UP-TO-DATE 任务等噪声
+
+逐行处理，内存占用与输出大小相关，与原始日志大小无关。
+"""
+
+import os
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterable, List, Optional
+
+from utils.error.patterns import ERROR_PATTERNS
+
+BUILD_LOG_CONTEXT_BEFORE = int(os.getenv("BUILD_LOG_CONTEXT_BEFORE", "3"))
+BUILD_LOG_CONTEXT_AFTER = int(os.getenv("BUILD_LOG_CONTEXT_AFTER", "8"))
+# 每段连续栈帧最多保留的帧数
+BUILD_LOG_MAX_FRAMES = int(os.getenv("BUILD_LOG_MAX_FRAMES", "10"))
+# 输出行数上限
+BUILD_LOG_MAX_LINES = int(os.getenv("BUILD_LOG_MAX_LINES", "600"))
+# 日志开头保留的行数（通常是用户的提问）
+BUILD_LOG_HEAD_LINES = int(os.getenv("BUILD_LOG_HEAD_LINES", "3"))
+
+# Gradle / Kotlin / Java 的错误标记
+_ERROR_RE = re.compile(
+    r"\bERROR\b|\bFAILURE\b|\bFAILED\b|What went wrong|Execution failed|Caused by:"
+    r"|\b[\w.$]*(?:Exception|Error)\b|^e: |\berror:|> Could not|Could not (?:resolve|find|get)"
+    r"|Unresolved reference|cannot find symbol|Compilation (?:failed|error)|Duplicate class"
+)
+_WARNING_RE = re.compile(r"^w: |\bwarning:|^WARNING:|\bDeprecated\b", re.IGNORECASE)
+_NOISE_RE = re.compile(
+    r"^(?:Download(?:ing)?|Downloaded|Resolving|Fetching|Unzipping|Extracting)\b"
+    r"|^\s*[<\[(]?[=\-#>.\s]*[\])]?\s*\d{1,3}%"
+    r"|^> Task \S+(?:\s+(?:UP-TO-DATE|NO-SOURCE|FROM-CACHE|SKIPPED))?\s*$"
+    r"|^> (?:IDLE|Configure project|Evaluating settings|Transform )"
+    r"|^(?:Starting a Gradle Daemon|Daemon will be stopped|Welcome to Gradle|To honour the JVM settings)"
+)
+_FRAME_RE = re.compile(r"^\s+at [\w$.<>/]+\(.*\)\s*$|^\s+\.\.\. \d+ more\s*$")
+_SECTION_START = "* What went wrong:"
+_SECTION_END_RE = re.compile(r"^\* (?!What went wrong)|^BUILD FAILED")
+
+# 复用通用错误模式表中的关键词；过短的关键词（如 'display'）在构建日志中误报太多，不使用
+_MIN_PATTERN_KEYWORD_LEN = 10
+_PATTERN_KEYWORDS = sorted({
+    kw for keywords, _, _ in ERROR_PATTERNS for kw in keywords
+    if len(kw) >= _MIN_PATTERN_KEYWORD_LEN and kw.isascii()
+})
+
+_BUILD_LOG_MARKERS = ("> Task :", "BUILD FAILED", "FAILURE:", "What went wrong", "Gradle", "gradle")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：ASCII 约 4 字符 1 个 token，CJK 等多字节字符约 1 字 1 个 token"""
+    wide = (len(text.encode("utf-8")) - len(text)) // 2
+    return (len(text) - wide) // 4 + wide
+
+
+def looks_like_build_log(text: str) -> bool:
+    return any(marker in text for marker in _BUILD_LOG_MARKERS)
+
+
+_GRADLE_LINE_RE = re.compile(r"^(?:> |\* |BUILD |Run with |Get more help|\d+ actionable tasks?)")
+
+
+def is_log_line(line: str) -> bool:
+    """是否像构建日志中的一行（错误、警告、噪声、栈帧或 Gradle 输出）"""
+    return bool(
+        _is_error_line(line) or _WARNING_RE.search(line) or _NOISE_RE.search(line)
+        or _FRAME_RE.match(line) or _GRADLE_LINE_RE.match(line)
+        or any(marker in line for marker in _BUILD_LOG_MARKERS)
+    )
+
+
+def _is_error_line(line: str) -> bool:
+    if _ERROR_RE.search(line):
+        return True
+    low = line.lower()
+    return any(kw in low for kw in _PATTERN_KEYWORDS)
+
+
+@dataclass
+class ReducedLog:
+    text: str
+    original_lines: int
+    kept_lines: int
+    original_tokens: int
+    reduced_tokens: int
+    # 触发保留的错误行（去重，按首次出现顺序），用于计算错误特征
+    error_lines: List[str] = field(default_factory=list)
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.reduced_tokens
+
+
+class BuildLogReducer:
+    """逐行喂入日志，finish() 返回精简结果"""
+
+    def __init__(
+        self,
+        context_before: int = BUILD_LOG_CONTEXT_BEFORE,
+        context_after: int = BUILD_LOG_CONTEXT_AFTER,
+        max_frames: int = BUILD_LOG_MAX_FRAMES,
+        max_lines: int = BUILD_LOG_MAX_LINES,
+        head_lines: int = BUILD_LOG_HEAD_LINES,
+    ):
+        self.context_after = context_after
+        self.max_frames = max_frames
+        self.max_lines = max_lines
+        self.head_lines = head_lines
+
+        self._out: List[str] = []
+        # (行号, 截至该行的空行数, 内容)
+        self._before: Deque[tuple] = deque(maxlen=max(0, context_before))
+        self._after_remaining = 0
+        self._in_section = False
+        self._line_no = 0
+        self._last_emitted = 0
+        # 空行不计入省略行数
+        self._blank_lines = 0
+        self._blank_at_last_emit = 0
+        # 已在别处计数、不应再计入省略行数的行（折叠的栈帧、重复行），按连续行号合并为 [起, 止]
+        self._accounted: Deque[List[int]] = deque()
+        self._non_noise_seen = 0
+        self._truncated = False
+        # 相同错误/警告行：首次输出位置与重复次数
+        self._seen_lines: Dict[str, int] = {}
+        self._error_lines: List[str] = []
+        self._repeats: Dict[int, int] = {}
+        # 栈帧去重
+        self._seen_frames: set = set()
+        self._frame_run = 0
+        self._frames_omitted = 0
+        self.original_tokens = 0
+
+    def feed(self, line: str):
+        line = line.rstrip("\r\n")
+        self._line_no += 1
+        self.original_tokens += estimate_tokens(line) + 1
+
+        if not line.strip():
+            self._blank_lines += 1
+            return
+        if _NOISE_RE.search(line):
+            return
+        self._non_noise_seen += 1
+
+        if _FRAME_RE.match(line):
+            self._feed_frame(line)
+            return
+        self._flush_omitted_frames()
+
+        if line.startswith(_SECTION_START):
+            self._in_section = True
+            self._emit_error(line)
+            return
+        if self._in_section and _SECTION_END_RE.search(line):
+            self._in_section = False
+
+        if self._in_section or _is_error_line(line):
+            self._emit_error(line)
+        elif _WARNING_RE.search(line):
+            self._emit_deduped(line)
+        elif self._after_remaining > 0:
+            self._after_remaining -= 1
+            self._emit(line)
+        elif self._non_noise_seen <= self.head_lines:
+            self._emit(line)
+        else:
+            self._before.append((self._line_no, self._blank_lines, line))
+
+    def _feed_frame(self, line: str):
+        key = line.strip()
+        if self._frame_run < self.max_frames and key not in self._seen_frames:
+            self._seen_frames.add(key)
+            self._frame_run += 1
+            self._emit(line)
+        else:
+            self._frames_omitted += 1
+            self._account()
+        # 栈帧不消耗上下文行数，整段栈都视为错误区域的延续
+        self._after_remaining = max(self._after_remaining, 1)
+
+    def _flush_omitted_frames(self):
+        if self._frames_omitted:
+            self._append(f"\t... (省略 {self._frames_omitted} 个重复或过深的栈帧)")
+        self._frames_omitted = 0
+        self._frame_run = 0
+
+    def _emit_error(self, line: str):
+        for line_no, blank_lines, ctx_line in self._before:
+            self._emit(ctx_line, line_no, blank_lines)
+        self._before.clear()
+        if line.strip() not in self._seen_lines:
+            self._error_lines.append(line.strip())
+        self._emit_deduped(line)
+        self._after_remaining = self.context_after
+
+    def _emit_deduped(self, line: str):
+        key = line.strip()
+        idx = self._seen_lines.get(key)
+        if idx is not None:
+            self._repeats[idx] = self._repeats.get(idx, 1) + 1
+            self._account()
+            return
+        if self._emit(line):
+            self._seen_lines[key] = len(self._out) - 1
+
+    def _emit(self, line: str, line_no: Optional[int] = None, blank_lines: Optional[int] = None) -> bool:
+        """输出一行；line_no/blank_lines 用于回填前置上下文，缺省为当前行"""
+        line_no = line_no or self._line_no
+        blank_lines = self._blank_lines if blank_lines is None else blank_lines
+        if line_no <= self._last_emitted:
+            return False
+        self._append_gap(line_no - 1, blank_lines)
+        self._last_emitted = line_no
+        self._blank_at_last_emit = blank_lines
+        return self._append(line)
+
+    def _account(self):
+        """当前行已由栈帧省略计数或重复次数标记覆盖"""
+        if self._accounted and self._accounted[-1][1] == self._line_no - 1:
+            self._accounted[-1][1] = self._line_no
+        else:
+            self._accounted.append([self._line_no, self._line_no])
+
+    def _append_gap(self, until_line_no: int, blank_lines: int):
+        skipped = until_line_no - self._last_emitted - (blank_lines - self._blank_at_last_emit)
+        # 扣除区间内已计数的行；前置上下文可能先于其后的已计数行输出，只扣到 until_line_no 为止
+        while self._accounted and self._accounted[0][0] <= until_line_no:
+            first, last = self._accounted[0]
+            if first > self._last_emitted:
+                skipped -= min(last, until_line_no) - first + 1
+            if last > until_line_no:
+                self._accounted[0][0] = until_line_no + 1
+                break
+            self._accounted.popleft()
+        if self._out and skipped > 0:
+            self._append(f"... (省略 {skipped} 行)")
+
+    def _append(self, line: str) -> bool:
+        if len(self._out) >= self.max_lines:
+            self._truncated = True
+            return False
+        self._out.append(line)
+        return True
+
+    def finish(self) -> ReducedLog:
+        self._flush_omitted_frames()
+        self._append_gap(self._line_no, self._blank_lines)
+        lines = [
+            f"{line}  [重复 {self._repeats[i]} 次]" if i in self._repeats else line
+            for i, line in enumerate(self._out)
+        ]
+        if self._truncated:
+            lines.append(f"... (已达到 {self.max_lines} 行上限，其余内容省略)")
+        text = "\n".join(lines)
+        return ReducedLog(
+            text=text,
+            original_lines=self._line_no,
+            kept_lines=len(lines),
+            original_tokens=self.original_tokens,
+            reduced_tokens=estimate_tokens(text),
+            error_lines=self._error_lines,
+        )
+
+
+def reduce_build_log(log: "str | Iterable[str]", **kwargs) -> ReducedLog:
+    """精简构建日志；log 可以是整段文本，也可以是逐行迭代器（如打开的文件）"""
+    reducer = BuildLogReducer(**kwargs)
+    lines = log.splitlines() if isinstance(log, str) else log
+    for line in lines:
+        reducer.feed(line)
+    return reducer.finish()
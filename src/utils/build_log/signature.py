@@ -0,0 +1,80 @@
+"""
+构建错误特征
+
+把构建日志中的错误行归一化（去掉路径、时间戳、哈希、行号等与具体环境相关的部分），
+得到稳定的错误特征。同一类失败（如反复出现的 KAPT/Room 问题）在不同的 CI 运行中特征相同。
+"""
+
+import hashlib
+import re
+from typing import List, Optional, Tuple
+
+from utils.build_log.digest_cache import digest_cache
+from utils.build_log.reducer import reduce_build_log, looks_like_build_log, is_log_line
+
+# 参与特征计算的错误行数上限
+_MAX_SIGNATURE_LINES = 40
+
+_NORMALIZERS = [
+    # 时间戳与耗时
+    (re.compile(r"\b\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?"), "<ts>"),
+    (re.compile(r"\b\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?\b"), "<ts>"),
+    (re.compile(r"\bin (?:\d+h )?(?:\d+m )?\d+(?:\.\d+)?m?s\b"), "in <dur>"),
+    # 路径只保留文件名；需在哈希之前处理，否则目录名中的哈希（如构建缓存目录）会把路径截断
+    (re.compile(r"(?:[A-Za-z]:)?(?:[\\/][\w.@+\-]+)+[\\/](?=[\w.@+\-]+)"), "<path>/"),
+    # UUID 与哈希（至少包含一个数字，避免误伤普通单词）
+    (re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", re.IGNORECASE), "<uuid>"),
+    (re.compile(r"\b(?=[0-9a-f]*\d)(?=[0-9a-f]*[a-f])[0-9a-f]{7,64}\b", re.IGNORECASE), "<hash>"),
+    # 行号、列号
+    (re.compile(r"(\.\w+):\d+(?::\d+)?"), r"\1:<n>"),
+    (re.compile(r"\(\d+,\s*\d+\)"), "(<n>)"),
+    (re.compile(r"\bline \d+", re.IGNORECASE), "line <n>"),
+]
+
+
+def normalize_error_line(line: str) -> str:
+    for pattern, repl in _NORMALIZERS:
+        line = pattern.sub(repl, line)
+    return " ".join(line.split())
+
+
+def signature_lines(error_lines: List[str]) -> List[str]:
+    seen = set()
+    result = []
+    for line in error_lines:
+        normalized = normalize_error_line(line)
+        if normalized and normalized not in seen:
+            seen.add(normalized)
+            result.append(normalized)
+            if len(result) >= _MAX_SIGNATURE_LINES:
+                break
+    return result
+
+
+@digest_cache(maxsize=64)
+def build_log_error_lines(text: str) -> Tuple[str, ...]:
+    """构建日志中归一化后的错误行，不是构建日志时返回空元组（按内容摘要缓存，不持有原文）"""
+    if not looks_like_build_log(text):
+        return ()
+    return tuple(signature_lines(reduce_build_log(text).error_lines))
+
+
+def build_log_question(text: str) -> str:
+    """
+    构建日志前后的非日志文本（通常是用户的提问），归一化空白与大小写
+
+    同一份日志配不同的问题（"为什么失败" / "怎么去掉这个警告"）不应复用同一个答案。
+    """
+    lines = text.splitlines()
+    log_idx = [i for i, line in enumerate(lines) if is_log_line(line)]
+    if log_idx:
+        lines = lines[:log_idx[0]] + lines[log_idx[-1] + 1:]
+    return " ".join(" ".join(lines).split()).lower()
+
+
+def build_log_signature(text: str) -> Optional[str]:
+    """计算构建日志的错误特征（sha256），不是构建日志或没有错误行时返回 None"""
+    lines = build_log_error_lines(text)
+    if not lines:
+        return None
+    return hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()
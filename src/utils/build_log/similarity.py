@@ -0,0 +1,125 @@
+"""
+相似错误检索
+
+错误特征要求归一化后的错误行完全一致，模块名、依赖版本稍有不同就无法命中。
+这里对归一化错误行做字符 n-gram 哈希向量化（numpy，无外部服务、无 GPU），
+在进程内索引历史分析结果，按余弦相似度取 top-k，超过阈值视为相似错误。
+"""
+
+import os
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+SIMILAR_INDEX_DIM = int(os.getenv("SIMILAR_INDEX_DIM", "4096"))
+SIMILAR_INDEX_CAPACITY = int(os.getenv("SIMILAR_INDEX_CAPACITY", "2048"))
+SIMILAR_INDEX_TTL = float(os.getenv("SIMILAR_INDEX_TTL", os.getenv("ANSWER_CACHE_TTL", "86400")))  # 秒
+# 字符 n-gram 范围
+_NGRAM_MIN = 3
+_NGRAM_MAX = 5
+
+
+def embed_lines(lines: Sequence[str], dim: int = SIMILAR_INDEX_DIM) -> np.ndarray:
+    """
+    字符 n-gram 哈希向量化，返回 L2 归一化的 float32 向量
+
+    使用 crc32 而不是内置 hash()，保证跨进程结果一致；哈希的最高位决定符号，减小碰撞带来的偏差。
+    """
+    vec = np.zeros(dim, dtype=np.float32)
+    for line in lines:
+        text = f" {line.lower()} "
+        for n in range(_NGRAM_MIN, _NGRAM_MAX + 1):
+            for i in range(len(text) - n + 1):
+                h = zlib.crc32(text[i:i + n].encode("utf-8"))
+                vec[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norm = float(np.linalg.norm(vec))
+    if norm > 0:
+        vec /= norm
+    return vec
+
+
+@dataclass
+class SimilarMatch:
+    score: float
+    answer: str
+    signature: str
+
+
+class SimilarityIndex:
+    """
+    固定容量的环形索引，写满后覆盖最旧的条目
+
+    向量存放在预分配的 (capacity, dim) 矩阵中，查询是一次矩阵-向量乘法。
+    条目按 scope（模型 + system prompt 哈希）隔离，不同模型的答案互不复用。
+    """
+
+    def __init__(self, dim: int = SIMILAR_INDEX_DIM, capacity: int = SIMILAR_INDEX_CAPACITY, ttl: float = SIMILAR_INDEX_TTL):
+        self.dim = dim
+        self.capacity = capacity
+        self.ttl = ttl
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        # 与矩阵行一一对应：(scope, signature, answer, expires_at)
+        self._meta: List[Optional[Tuple[Any, str, str, float]]] = [None] * capacity
+        self._by_signature: Dict[Tuple[Any, str], int] = {}
+        self._next = 0
+        self._size = 0
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.matches = 0
+
+    def add(self, scope: Any, signature: str, lines: Sequence[str], answer: str):
+        vec = embed_lines(lines, self.dim)
+        with self._lock:
+            # 同一特征只保留最新的答案
+            row = self._by_signature.get((scope, signature))
+            if row is None:
+                row = self._next
+                old = self._meta[row]
+                if old is not None:
+                    self._by_signature.pop((old[0], old[1]), None)
+                self._next = (self._next + 1) % self.capacity
+                self._size = min(self._size + 1, self.capacity)
+            self._matrix[row] = vec
+            self._meta[row] = (scope, signature, answer, time.monotonic() + self.ttl)
+            self._by_signature[(scope, signature)] = row
+
+    def search(self, scope: Any, lines: Sequence[str], top_k: int = 3, threshold: float = 0.0) -> List[SimilarMatch]:
+        """返回同一 scope 内相似度不低于 threshold 的前 top_k 条，按相似度降序"""
+        vec = embed_lines(lines, self.dim)
+        now = time.monotonic()
+        with self._lock:
+            self.queries += 1
+            if self._size == 0:
+                return []
+            scores = self._matrix[:self._size] @ vec
+            valid = np.array(
+                [m is not None and m[0] == scope and m[3] > now for m in self._meta[:self._size]],
+                dtype=bool,
+            )
+            scores = np.where(valid & (scores >= threshold), scores, -np.inf)
+            k = min(top_k, self._size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            result = [
+                SimilarMatch(score=float(scores[i]), answer=self._meta[i][2], signature=self._meta[i][1])
+                for i in top
+                if np.isfinite(scores[i])
+            ]
+            if result:
+                self.matches += 1
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": self._size,
+                "capacity": self.capacity,
+                "dim": self.dim,
+                "ttl": self.ttl,
+                "queries": self.queries,
+                "matches": self.matches,
+            }
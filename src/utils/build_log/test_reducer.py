@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+测试脚本：构建日志精简的省略计数
+
+精简结果中保留的行、"省略 N 行"、"省略 N 个…栈帧"、重复次数与空行加起来应等于原始行数，
+同一行不能既被栈帧折叠计数又被计入省略行数。
+
+用法:
+    python -m pytest src/utils/build_log/test_reducer.py
+    python src/utils/build_log/test_reducer.py
+"""
+
+import re
+import sys
+from pathlib import Path
+
+# 添加src目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from utils.build_log.reducer import reduce_build_log
+
+_GAP_RE = re.compile(r"^\.\.\. \(省略 (\d+) 行\)$")
+_FRAMES_RE = re.compile(r"^\t\.\.\. \(省略 (\d+) 个重复或过深的栈帧\)$")
+_REPEAT_RE = re.compile(r"  \[重复 (\d+) 次\]$")
+
+
+def _accounted_lines(log: str) -> int:
+    reduced = reduce_build_log(log, max_frames=3, context_before=2, context_after=2)
+    total = sum(1 for line in log.splitlines() if not line.strip())
+    for line in reduced.text.splitlines():
+        gap = _GAP_RE.match(line) or _FRAMES_RE.match(line)
+        if gap:
+            total += int(gap.group(1))
+            continue
+        repeat = _REPEAT_RE.search(line)
+        total += int(repeat.group(1)) if repeat else 1
+    return total
+
+
+def _stack(exc: str, depth: int) -> list:
+    return [exc] + [f"\tat com.example.Foo.method{i}(Foo.kt:{i})" for i in range(depth)]
+
+
+def test_collapsed_frames_not_counted_twice():
+    lines = ["Why does the build fail?", "> Task :app:preBuild UP-TO-DATE"]
+    lines += [f"Configuring module {i}" for i in range(20)]
+    lines += _stack("java.lang.IllegalStateException: boom", 12)
+    lines += [f"after {i}" for i in range(10)]
+    lines += _stack("java.lang.IllegalStateException: boom again", 12)
+    lines += ["", "BUILD FAILED in 3s"]
+    log = "\n".join(lines)
+    assert _accounted_lines(log) == len(log.splitlines())
+
+
+def test_repeated_lines_and_blanks():
+    lines = ["What is wrong here?"]
+    for i in range(5):
+        lines += [f"step {i}", "w: /a/b/Foo.kt:3:1 Parameter 'x' is never used", "", f"noise {i}"]
+    lines += ["e: /a/b/Foo.kt:7:1 Unresolved reference: Bar"] + [f"tail {i}" for i in range(6)]
+    lines += _stack("Caused by: java.lang.RuntimeException", 8) + ["e: /a/b/Foo.kt:7:1 Unresolved reference: Bar"]
+    log = "\n".join(lines)
+    assert _accounted_lines(log) == len(log.splitlines())
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            fn()
+            print(f"{name}: OK")
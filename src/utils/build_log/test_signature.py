@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+测试脚本：构建错误行归一化
+
+同一错误在不同检出目录、构建目录下应得到相同的归一化结果。
+
+用法:
+    python -m pytest src/utils/build_log/test_signature.py
+    python src/utils/build_log/test_signature.py
+"""
+
+import sys
+from pathlib import Path
+
+# 添加src目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from utils.build_log.signature import normalize_error_line
+
+
+def test_path_keeps_only_file_name():
+    assert normalize_error_line(
+        "e: /home/ci/work/app/src/main/java/com/example/Foo.kt: (12, 5): Unresolved reference: Bar"
+    ) == "e: <path>/Foo.kt: (<n>): Unresolved reference: Bar"
+
+
+def test_hashed_build_dir_does_not_split_path():
+    expected = "e: <path>/Foo.kt:<n> Unresolved reference: Bar"
+    for line in (
+        "e: /home/ci/work/3f9a2b1c0d/build/tmp/kapt3/Foo.kt:12:5 Unresolved reference: Bar",
+        "e: /tmp/checkout-7e1d2c9b8a/build/9c0ffee1234/Foo.kt:40 Unresolved reference: Bar",
+        "e: C:\\agent\\_work\\b7a6f5e4d3c2\\build\\Foo.kt:7 Unresolved reference: Bar",
+    ):
+        assert normalize_error_line(line) == expected, line
+
+
+def test_hash_outside_path():
+    assert normalize_error_line(
+        "Could not resolve com.example:lib:1.0 (commit abc1234f) in 3.2s"
+    ) == "Could not resolve com.example:lib:1.0 (commit <hash>) in <dur>"
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            fn()
+            print(f"{name}: OK")
@@ -6,7 +6,6 @@ from io import BytesIO
 from typing import Literal,Callable, Any, Optional,Union
 from pydantic import BaseModel, Field, field_validator,PrivateAttr
 from urllib.parse import urlparse
-from pptx import Presentation
 
 MAX_FILE_SIZE = 50 * 1024 * 1024
 
@@ -278,7 +277,10 @@ def read_docx(cont_stream) -> str:
     return "\n\n".join(all_parts)
 
 def read_ppt(file_input: Union[str, bytes, BytesIO]) -> str:
-    if not Presentation:
+    # python-pptx 连带加载 lxml/Pillow，仅在解析 PPT 时导入
+    try:
+        from pptx import Presentation
+    except ImportError:
         return "[Error] 未安装 python-pptx 库，无法解析 PPT 文件"
 
     # 1. 统一转换为文件流对象 (BytesIO)
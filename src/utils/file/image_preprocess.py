@@ -0,0 +1,265 @@
+"""
+截图预处理
+
+手机截图原图动辄数 MB 的 PNG，base64 后整体发给视觉模型，而模型端本来就会缩放。
+发送前先在本地：
+- 按 EXIF 方向转正后缩放到最长边不超过 IMAGE_MAX_EDGE
+- 重新编码为 WebP/JPEG（IMAGE_QUALITY），不保留 EXIF/ICC 等元数据
+- 按内容哈希 + 参数缓存编码结果，同一截图只处理一次
+  磁盘缓存超过 IMAGE_CACHE_TTL 未命中的文件被清理，总大小超过 IMAGE_CACHE_MAX_BYTES 时按最近命中时间淘汰；
+  IMAGE_CACHE_DIR 设为空字符串可关闭磁盘缓存
+处理后不比原图小、动图或无法解码时原样发送。
+"""
+
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+IMAGE_PREPROCESS_ENABLED = os.getenv("IMAGE_PREPROCESS_ENABLED", "true").lower() in ("1", "true", "yes")
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1568"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "webp").lower()  # webp | jpeg
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "image_preprocess_cache"))
+# 磁盘缓存总字节上限，默认 512 MiB
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# 超过该时长（秒）未命中的缓存文件被清理，默认 7 天
+IMAGE_CACHE_TTL = float(os.getenv("IMAGE_CACHE_TTL", str(7 * 86400)))
+# 两次清理之间的最小间隔（秒）
+IMAGE_CACHE_SWEEP_INTERVAL = float(os.getenv("IMAGE_CACHE_SWEEP_INTERVAL", "600"))
+
+_MIME_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+@dataclass
+class PreprocessedImage:
+    data: bytes
+    mime_type: str
+    original_bytes: int
+    elapsed_ms: float
+    cached: bool = False
+    # 是否使用了处理结果（False 表示原样发送）
+    transformed: bool = False
+
+    @property
+    def output_bytes(self) -> int:
+        return len(self.data)
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.original_bytes - self.output_bytes
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.cache_hits = 0
+        self.passthrough = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.elapsed_ms = 0.0
+
+    def record(self, result: PreprocessedImage):
+        with self._lock:
+            self.images += 1
+            self.cache_hits += result.cached
+            self.passthrough += not result.transformed
+            self.bytes_in += result.original_bytes
+            self.bytes_out += result.output_bytes
+            self.elapsed_ms += result.elapsed_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": IMAGE_PREPROCESS_ENABLED,
+                "max_edge": IMAGE_MAX_EDGE,
+                "format": IMAGE_FORMAT,
+                "quality": IMAGE_QUALITY,
+                "cache_dir": IMAGE_CACHE_DIR or None,
+                "images": self.images,
+                "cache_hits": self.cache_hits,
+                "passthrough": self.passthrough,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "avg_ms": round(self.elapsed_ms / self.images, 2) if self.images else 0.0,
+            }
+
+
+_stats = _Stats()
+
+
+def image_preprocess_stats() -> Dict[str, Any]:
+    return _stats.snapshot()
+
+
+def _encode(data: bytes, max_edge: int, fmt: str, quality: int) -> Optional[bytes]:
+    """缩放并重新编码；动图或无法解码时返回 None"""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as img:
+        if getattr(img, "is_animated", False):
+            return None
+        img = ImageOps.exif_transpose(img)
+        if max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        if fmt == "jpeg" or not has_alpha:
+            if has_alpha:
+                # JPEG 不支持透明通道，铺白底
+                rgba = img.convert("RGBA")
+                img = Image.new("RGB", rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.getchannel("A"))
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+        elif img.mode != "RGBA":
+            img = img.convert("RGBA")
+        # 不保留 EXIF、ICC、文本块等元数据
+        img.info = {}
+        out = io.BytesIO()
+        if fmt == "jpeg":
+            img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+        else:
+            img.save(out, format="WEBP", quality=quality, method=4)
+        return out.getvalue()
+
+
+def _cache_path(key: str, fmt: str) -> str:
+    return os.path.join(IMAGE_CACHE_DIR, key[:2], f"{key}.{fmt}")
+
+
+def _read_cache(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    try:
+        # mtime 记录最近命中时间，供清理时按 LRU 淘汰
+        os.utime(path)
+    except OSError:
+        pass
+    return data
+
+
+def _write_cache(path: str, data: bytes):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+    except OSError as e:
+        logger.warning(f"Image preprocess cache write failed: {e}")
+        return
+    _maybe_sweep()
+
+
+def _sweep_cache(root: str, ttl: float, max_bytes: int):
+    """清理过期文件，总大小仍超限时按 mtime 从旧到新淘汰"""
+    files = []
+    total = 0
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    files.sort()
+    cutoff = time.time() - ttl
+    removed = 0
+    for mtime, size, path in files:
+        if mtime >= cutoff and total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    if removed:
+        logger.info(f"Image preprocess cache swept {removed} files, {total} bytes left")
+
+
+_sweep_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+def _maybe_sweep():
+    """距上次清理超过 IMAGE_CACHE_SWEEP_INTERVAL 时在后台线程清理磁盘缓存"""
+    global _last_sweep
+    with _sweep_lock:
+        now = time.monotonic()
+        if _last_sweep and now - _last_sweep < IMAGE_CACHE_SWEEP_INTERVAL:
+            return
+        _last_sweep = now
+
+    def run():
+        try:
+            _sweep_cache(IMAGE_CACHE_DIR, IMAGE_CACHE_TTL, IMAGE_CACHE_MAX_BYTES)
+        except OSError as e:
+            logger.warning(f"Image preprocess cache sweep failed: {e}")
+
+    threading.Thread(target=run, name="image-cache-sweep", daemon=True).start()
+
+
+def preprocess_image(
+    data: bytes,
+    original_mime: str,
+    max_edge: int = IMAGE_MAX_EDGE,
+    fmt: str = IMAGE_FORMAT,
+    quality: int = IMAGE_QUALITY,
+) -> PreprocessedImage:
+    """预处理一张图片；未开启、处理失败或没有收益时返回原图"""
+    t0 = time.perf_counter()
+    fmt = fmt if fmt in _MIME_TYPES else "webp"
+
+    def done(out: bytes, mime: str, cached: bool = False, transformed: bool = True) -> PreprocessedImage:
+        result = PreprocessedImage(
+            data=out,
+            mime_type=mime,
+            original_bytes=len(data),
+            elapsed_ms=(time.perf_counter() - t0) * 1000,
+            cached=cached,
+            transformed=transformed,
+        )
+        _stats.record(result)
+        return result
+
+    if not IMAGE_PREPROCESS_ENABLED:
+        return done(data, original_mime, transformed=False)
+
+    path = None
+    if IMAGE_CACHE_DIR:
+        key = hashlib.sha256(data + f"|{max_edge}|{fmt}|{quality}".encode()).hexdigest()
+        path = _cache_path(key, fmt)
+        cached = _read_cache(path)
+        if cached is not None:
+            return done(cached, _MIME_TYPES[fmt], cached=True)
+
+    try:
+        encoded = _encode(data, max_edge, fmt, quality)
+    except Exception as e:
+        logger.warning(f"Image preprocess failed, sending original: {e}")
+        encoded = None
+    if encoded is None or len(encoded) >= len(data):
+        return done(data, original_mime, transformed=False)
+    if path is not None:
+        _write_cache(path, encoded)
+    return done(encoded, _MIME_TYPES[fmt])
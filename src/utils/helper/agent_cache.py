@@ -0,0 +1,92 @@
+"""
+编译后 Agent 的进程级缓存
+
+create_agent 的编译结果与请求无关，只依赖 LLM 配置文件和模型环境变量。
+这里按"配置文件内容哈希 + 模型设置"缓存编译结果；配置文件通过 stat 监测变化，
+修改后下一次请求自动重新编译，无需重启。
+请求级数据（如 default_headers(ctx)）由 RequestHeadersMiddleware 在每次模型调用时注入。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from langchain.agents.middleware import AgentMiddleware
+from coze_coding_utils.runtime_ctx.context import default_headers
+
+logger = logging.getLogger(__name__)
+
+# path -> ((mtime_ns, size), cfg, digest)
+_config_cache: Dict[str, Tuple[Tuple[int, int], Dict[str, Any], str]] = {}
+# name -> (cache_key, agent)
+_agent_cache: Dict[str, Tuple[Hashable, Any]] = {}
+_lock = threading.Lock()
+
+
+def load_llm_config(config_path: str) -> Tuple[Dict[str, Any], str]:
+    """
+    读取 LLM 配置文件，返回 (配置, 内容 sha256)
+
+    文件的 mtime/size 未变化时直接返回缓存，不再读盘和解析。
+    """
+    st = os.stat(config_path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _config_cache.get(config_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1], cached[2]
+
+    with open(config_path, 'rb') as f:
+        raw = f.read()
+    cfg = json.loads(raw.decode('utf-8'))
+    digest = hashlib.sha256(raw).hexdigest()
+    if cached is not None and cached[2] != digest:
+        logger.info(f"LLM config changed: {config_path}, sha256={digest[:12]}")
+    _config_cache[config_path] = (stamp, cfg, digest)
+    return cfg, digest
+
+
+def get_or_build_agent(name: str, cache_key: Hashable, builder: Callable[[], Any]) -> Any:
+    """按 name 缓存编译后的 agent；cache_key 变化（配置或模型设置变更）时重新编译"""
+    cached = _agent_cache.get(name)
+    if cached is not None and cached[0] == cache_key:
+        return cached[1]
+
+    with _lock:
+        cached = _agent_cache.get(name)
+        if cached is not None and cached[0] == cache_key:
+            return cached[1]
+        logger.info(f"Compiling agent '{name}'")
+        agent = builder()
+        _agent_cache[name] = (cache_key, agent)
+        return agent
+
+
+def clear_agent_cache():
+    """清空缓存，下一次请求重新读取配置并编译"""
+    with _lock:
+        _agent_cache.clear()
+        _config_cache.clear()
+
+
+class RequestHeadersMiddleware(AgentMiddleware):
+    """每次模型调用时，从运行时 context 注入请求级 HTTP 头（替代构建 ChatOpenAI 时的 default_headers）"""
+
+    @staticmethod
+    def _with_headers(request: Any) -> Any:
+        ctx: Optional[Any] = getattr(request.runtime, "context", None) if request.runtime else None
+        if ctx is not None:
+            headers = default_headers(ctx)
+            if headers:
+                settings = dict(request.model_settings or {})
+                settings["extra_headers"] = {**settings.get("extra_headers", {}), **headers}
+                request.model_settings = settings
+        return request
+
+    def wrap_model_call(self, request, handler):
+        return handler(self._with_headers(request))
+
+    async def awrap_model_call(self, request, handler):
+        return await handler(self._with_headers(request))
@@ -1,10 +1,11 @@
 import uuid
 import json
 import os
-from typing import Any, Dict, List, Tuple, Iterator
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Iterator
 import time
 from utils.file.file import File, FileOps, infer_file_category
 from utils.error import classify_error
+from utils.budget import TokenBudgetExceeded
 
 from utils.messages.client import (
     ClientMessage,
@@ -25,6 +26,7 @@ from utils.messages.server import (
     MESSAGE_TYPE_MESSAGE_START,
     MESSAGE_TYPE_MESSAGE_END,
     MESSAGE_END_CODE_SUCCESS,
+    MESSAGE_END_CODE_BUDGET_EXCEEDED,
     MESSAGE_TYPE_ANSWER,
     MESSAGE_TYPE_TOOL_REQUEST,
     MESSAGE_TYPE_TOOL_RESPONSE,
@@ -277,32 +279,51 @@ def _item_to_server_messages(
 
     return messages
 
-
-def _iter_body_to_server_messages(
-        items: Iterator[Dict[Any, Dict[str, Any]]],
-        *,
-        session_id: str,
-        query_msg_id: str,
-        reply_id: str,
-        sequence_id_start: int = 1,
-        log_id: str = "",
-) -> Iterator[ServerMessage]:
-    seq = sequence_id_start
-    # Stable msg_id mapping per logical message stream
-    # Keys are derived from meta to keep same msg_id across chunks
-    stable_ids: Dict[Tuple[str, Any], str] = {}
-
-    accumulated_tool_chunks: List[Any] = []
-    accumulated_tool_response_content: Dict[str, str] = {}
-
-    def _flush_tool_chunks(seq_num: int) -> Tuple[List[ServerMessage], int]:
-        nonlocal accumulated_tool_chunks
+class _BodyMessageBuilder:
+    """
+    将 LangGraph messages 流逐条转换为 ServerMessage
+
+    持有跨 chunk 的状态（序号、工具调用累积、稳定 msg_id），
+    同步与异步迭代共用同一套转换逻辑。
+    """
+
+    def __init__(
+            self,
+            *,
+            session_id: str,
+            query_msg_id: str,
+            reply_id: str,
+            sequence_id_start: int = 1,
+            log_id: str = "",
+    ):
+        self.session_id = session_id
+        self.query_msg_id = query_msg_id
+        self.reply_id = reply_id
+        self.log_id = log_id
+        self.seq = sequence_id_start
+        # Stable msg_id mapping per logical message stream
+        # Keys are derived from meta to keep same msg_id across chunks
+        self.stable_ids: Dict[Tuple[str, Any], str] = {}
+        self.accumulated_tool_chunks: List[Any] = []
+        self.accumulated_tool_response_content: Dict[str, str] = {}
+        # 本次 run 各次模型调用的 token 用量累计
+        self.token_cost = TokenCost()
+
+    def _add_usage(self, chunk: Any):
+        usage = getattr(chunk, "usage_metadata", None)
+        if usage:
+            self.token_cost.input_tokens += usage.get("input_tokens", 0)
+            self.token_cost.output_tokens += usage.get("output_tokens", 0)
+            self.token_cost.total_tokens += usage.get("total_tokens", 0)
+            self.token_cost.cached_input_tokens += (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+
+    def _flush_tool_chunks(self, seq_num: int) -> Tuple[List[ServerMessage], int]:
         msgs: List[ServerMessage] = []
-        if not accumulated_tool_chunks:
+        if not self.accumulated_tool_chunks:
             return msgs, seq_num
 
-        merged_tcs = _merge_tool_call_chunks(accumulated_tool_chunks)
-        accumulated_tool_chunks = []
+        merged_tcs = _merge_tool_call_chunks(self.accumulated_tool_chunks)
+        self.accumulated_tool_chunks = []
         for tc in merged_tcs:
             raw_args = tc.get("args", {})
             if isinstance(raw_args, str):
@@ -327,22 +348,23 @@ def _iter_body_to_server_messages(
             msgs.append(
                 ServerMessage(
                     type=MESSAGE_TYPE_TOOL_REQUEST,
-                    session_id=session_id,
-                    query_msg_id=query_msg_id,
-                    reply_id=reply_id,
+                    session_id=self.session_id,
+                    query_msg_id=self.query_msg_id,
+                    reply_id=self.reply_id,
                     msg_id=str(uuid.uuid4()),
                     sequence_id=seq_num,
                     finish=True,
                     content=content,
-                    log_id=log_id,
+                    log_id=self.log_id,
                 )
             )
             seq_num += 1
         return msgs, seq_num
 
-    for item in items:
+    def feed(self, item: Dict[Any, Dict[str, Any]]) -> List[ServerMessage]:
         chunk, meta = item
         chunk_type = chunk.__class__.__name__
+        self._add_usage(chunk)
         is_last = (meta or {}).get("chunk_position") == "last"
         is_streaming = (meta or {}).get("chunk_position") is not None
 
@@ -361,24 +383,24 @@ def _iter_body_to_server_messages(
         # because usually tool calls and text content are either separate or tool calls come first.
         # But let's be safe: only flush on ToolMessage or if is_last=True on AIMessageChunk.
 
-        if chunk_type == "ToolMessage" and accumulated_tool_chunks:
-            f_msgs, seq = _flush_tool_chunks(seq)
+        if chunk_type == "ToolMessage" and self.accumulated_tool_chunks:
+            f_msgs, self.seq = self._flush_tool_chunks(self.seq)
             flushed_msgs.extend(f_msgs)
 
         # 1. Handle AIMessageChunk with tool_call_chunks (Streaming Tool Request)
         if chunk_type == "AIMessageChunk":
             tc_chunks = getattr(chunk, "tool_call_chunks", None)
             if tc_chunks:
-                accumulated_tool_chunks.extend(tc_chunks)
+                self.accumulated_tool_chunks.extend(tc_chunks)
             # If we have accumulated chunks but this chunk has NO tool_call_chunks,
             # it implies the tool definition phase is likely over.
-            elif accumulated_tool_chunks:
-                f_msgs, seq = _flush_tool_chunks(seq)
+            elif self.accumulated_tool_chunks:
+                f_msgs, self.seq = self._flush_tool_chunks(self.seq)
                 flushed_msgs.extend(f_msgs)
 
             # Flush if this is the last chunk
-            if is_last and accumulated_tool_chunks:
-                f_msgs, seq = _flush_tool_chunks(seq)
+            if is_last and self.accumulated_tool_chunks:
+                f_msgs, self.seq = self._flush_tool_chunks(self.seq)
                 flushed_msgs.extend(f_msgs)
 
         # 2. Handle ToolMessage (Tool Response)
@@ -393,12 +415,12 @@ def _iter_body_to_server_messages(
                 full_result = result
                 should_emit = True
             else:
-                if tcid not in accumulated_tool_response_content:
-                    accumulated_tool_response_content[tcid] = ""
-                accumulated_tool_response_content[tcid] += str(result)
+                if tcid not in self.accumulated_tool_response_content:
+                    self.accumulated_tool_response_content[tcid] = ""
+                self.accumulated_tool_response_content[tcid] += str(result)
 
                 if is_last:
-                    full_result = accumulated_tool_response_content.pop(tcid)
+                    full_result = self.accumulated_tool_response_content.pop(tcid)
                     should_emit = True
 
             if should_emit:
@@ -412,49 +434,39 @@ def _iter_body_to_server_messages(
                 msgs_to_yield.append(
                     ServerMessage(
                         type=MESSAGE_TYPE_TOOL_RESPONSE,
-                        session_id=session_id,
-                        query_msg_id=query_msg_id,
-                        reply_id=reply_id,
+                        session_id=self.session_id,
+                        query_msg_id=self.query_msg_id,
+                        reply_id=self.reply_id,
                         msg_id=str(uuid.uuid4()),
-                        sequence_id=seq,
+                        sequence_id=self.seq,
                         finish=True,
                         content=content,
-                        log_id=log_id,
+                        log_id=self.log_id,
                     )
                 )
-                seq += 1
+                self.seq += 1
 
         # 3. Call _item_to_server_messages for everything else
         if chunk_type != "ToolMessage":
             inner_msgs = _item_to_server_messages(
                 item,
-                session_id=session_id,
-                query_msg_id=query_msg_id,
-                reply_id=reply_id,
-                sequence_id_start=seq,
-                log_id=log_id,
+                session_id=self.session_id,
+                query_msg_id=self.query_msg_id,
+                reply_id=self.reply_id,
+                sequence_id_start=self.seq,
+                log_id=self.log_id,
             )
             # Combine: flushed (previous) + inner (current)
             final_msgs = flushed_msgs + inner_msgs
             msgs_to_yield.extend(final_msgs)
-            
+
             if inner_msgs:
-                seq = inner_msgs[-1].sequence_id + 1
+                self.seq = inner_msgs[-1].sequence_id + 1
         else:
             # For ToolMessage, msgs_to_yield already contains the ToolResponse (from block 2).
-            # We need to prepend flushed_msgs (from block 0).
-            # Note: msgs_to_yield might contain ToolResponse or nothing (if not emitted yet).
-            # But flushed_msgs MUST come before whatever is in msgs_to_yield.
-            # However, msgs_to_yield is a list we are appending to.
-            # So we should insert flushed_msgs at the beginning?
-            # Or better, just construct a new list.
-            
-            # Current content of msgs_to_yield comes from block 2 (Tool Response).
-            # flushed_msgs comes from block 0 (Tool Requests flushed).
+            # flushed_msgs (Tool Requests flushed in block 0) MUST come before it.
             # Order: Tool Request -> Tool Response.
-            final_msgs = flushed_msgs + msgs_to_yield
-            msgs_to_yield = final_msgs
-
+            msgs_to_yield = flushed_msgs + msgs_to_yield
 
         for m in msgs_to_yield:
             # Derive a stable grouping base for this item
@@ -481,34 +493,47 @@ def _iter_body_to_server_messages(
             else:
                 key = (m.type, group_base)
 
-            if key not in stable_ids:
-                stable_ids[key] = str(uuid.uuid4())
-            m.msg_id = stable_ids[key]
+            if key not in self.stable_ids:
+                self.stable_ids[key] = str(uuid.uuid4())
+            m.msg_id = self.stable_ids[key]
 
-            yield m
+        return msgs_to_yield
 
 
-def iter_server_messages(
+def _iter_body_to_server_messages(
         items: Iterator[Dict[Any, Dict[str, Any]]],
+        builder: _BodyMessageBuilder,
+) -> Iterator[ServerMessage]:
+    for item in items:
+        yield from builder.feed(item)
+
+
+async def _aiter_body_to_server_messages(
+        items: AsyncIterator[Dict[Any, Dict[str, Any]]],
+        builder: _BodyMessageBuilder,
+) -> AsyncIterator[ServerMessage]:
+    async for item in items:
+        for sm in builder.feed(item):
+            yield sm
+
+
+def _make_start_message(
         *,
         session_id: str,
         query_msg_id: str,
         local_msg_id: str,
         run_id: str,
-        sequence_id_start: int = 1,
+        reply_id: str,
+        sequence_id: int,
         log_id: str,
-) -> Iterator[ServerMessage]:
-    t0 = time.time()
-    reply_id = str(uuid.uuid4())
-    start_msg_id = str(uuid.uuid4())
-    # message_start
-    start_sm = ServerMessage(
+) -> ServerMessage:
+    return ServerMessage(
         type=MESSAGE_TYPE_MESSAGE_START,
         session_id=session_id,
         query_msg_id=query_msg_id,
         reply_id=reply_id,
-        msg_id=start_msg_id,
-        sequence_id=sequence_id_start,
+        msg_id=str(uuid.uuid4()),
+        sequence_id=sequence_id,
         finish=True,
         content=ServerMessageContent(
             message_start=MessageStartDetail(
@@ -517,67 +542,162 @@ def iter_server_messages(
         ),
         log_id=log_id,
     )
-    yield start_sm
+
+
+def _make_end_message(
+        *,
+        code: str,
+        message: str,
+        session_id: str,
+        query_msg_id: str,
+        reply_id: str,
+        sequence_id: int,
+        time_cost_ms: int,
+        log_id: str,
+        token_cost: Optional[TokenCost] = None,
+) -> ServerMessage:
+    return ServerMessage(
+        type=MESSAGE_TYPE_MESSAGE_END,
+        session_id=session_id,
+        query_msg_id=query_msg_id,
+        reply_id=reply_id,
+        msg_id=str(uuid.uuid4()),
+        sequence_id=sequence_id,
+        finish=True,
+        content=ServerMessageContent(
+            message_end=MessageEndDetail(
+                code=code,
+                message=message,
+                token_cost=token_cost or TokenCost(input_tokens=0, output_tokens=0, total_tokens=0),
+                time_cost_ms=time_cost_ms,
+            )
+        ),
+        log_id=log_id,
+    )
+
+
+def iter_server_messages(
+        items: Iterator[Dict[Any, Dict[str, Any]]],
+        *,
+        session_id: str,
+        query_msg_id: str,
+        local_msg_id: str,
+        run_id: str,
+        sequence_id_start: int = 1,
+        log_id: str,
+) -> Iterator[ServerMessage]:
+    t0 = time.time()
+    reply_id = str(uuid.uuid4())
+    # message_start
+    yield _make_start_message(
+        session_id=session_id,
+        query_msg_id=query_msg_id,
+        local_msg_id=local_msg_id,
+        run_id=run_id,
+        reply_id=reply_id,
+        sequence_id=sequence_id_start,
+        log_id=log_id,
+    )
     next_seq = sequence_id_start + 1
     last_seq = sequence_id_start
+    builder = _BodyMessageBuilder(
+        session_id=session_id,
+        query_msg_id=query_msg_id,
+        reply_id=reply_id,
+        sequence_id_start=next_seq,
+        log_id=log_id,
+    )
     try:
         # body stream
-        for sm in _iter_body_to_server_messages(
-                items,
-                session_id=session_id,
-                query_msg_id=query_msg_id,
-                reply_id=reply_id,
-                sequence_id_start=next_seq,
-                log_id=log_id,
-        ):
+        for sm in _iter_body_to_server_messages(items, builder):
             yield sm
             last_seq = sm.sequence_id
 
-        # message_end
-        t_ms = int((time.time() - t0) * 1000)
-        end_sm = ServerMessage(
-            type=MESSAGE_TYPE_MESSAGE_END,
-            session_id=session_id,
-            query_msg_id=query_msg_id,
-            reply_id=reply_id,
-            msg_id=str(uuid.uuid4()),
-            sequence_id=last_seq + 1,
-            finish=True,
-            content=ServerMessageContent(
-                message_end=MessageEndDetail(
-                    code=MESSAGE_END_CODE_SUCCESS,
-                    message="",
-                    token_cost=TokenCost(input_tokens=0, output_tokens=0, total_tokens=0),
-                    time_cost_ms=t_ms,
-                )
-            ),
-            log_id=log_id,
-        )
-        yield end_sm
+        code, message = MESSAGE_END_CODE_SUCCESS, ""
+    except TokenBudgetExceeded as ex:
+        code, message = MESSAGE_END_CODE_BUDGET_EXCEEDED, str(ex)
     except Exception as ex:
         # 使用错误分类器获取错误码
         err = classify_error(ex, {"node_name": "stream"})
-        # message_end
-        t_ms = int((time.time() - t0) * 1000)
-        end_sm = ServerMessage(
-            type=MESSAGE_TYPE_MESSAGE_END,
-            session_id=session_id,
-            query_msg_id=query_msg_id,
-            reply_id=reply_id,
-            msg_id=str(uuid.uuid4()),
-            sequence_id=last_seq + 1,
-            finish=True,
-            content=ServerMessageContent(
-                message_end=MessageEndDetail(
-                    code=str(err.code),
-                    message=err.message,
-                    time_cost_ms=t_ms,
-                    token_cost=TokenCost(input_tokens=0, output_tokens=0, total_tokens=0),
-                )
-            ),
-            log_id=log_id,
-        )
-        yield end_sm
+        code, message = str(err.code), err.message
+
+    # message_end
+    yield _make_end_message(
+        code=code,
+        message=message,
+        session_id=session_id,
+        query_msg_id=query_msg_id,
+        reply_id=reply_id,
+        sequence_id=last_seq + 1,
+        time_cost_ms=int((time.time() - t0) * 1000),
+        log_id=log_id,
+        token_cost=builder.token_cost,
+    )
+
+
+async def aiter_server_messages(
+        items: AsyncIterator[Dict[Any, Dict[str, Any]]],
+        *,
+        session_id: str,
+        query_msg_id: str,
+        local_msg_id: str,
+        run_id: str,
+        sequence_id_start: int = 1,
+        log_id: str,
+) -> AsyncIterator[ServerMessage]:
+    """iter_server_messages 的异步版本，消费 graph.astream 的输出"""
+    t0 = time.time()
+    reply_id = str(uuid.uuid4())
+    # message_start
+    yield _make_start_message(
+        session_id=session_id,
+        query_msg_id=query_msg_id,
+        local_msg_id=local_msg_id,
+        run_id=run_id,
+        reply_id=reply_id,
+        sequence_id=sequence_id_start,
+        log_id=log_id,
+    )
+    next_seq = sequence_id_start + 1
+    last_seq = sequence_id_start
+    builder = _BodyMessageBuilder(
+        session_id=session_id,
+        query_msg_id=query_msg_id,
+        reply_id=reply_id,
+        sequence_id_start=next_seq,
+        log_id=log_id,
+    )
+    try:
+        # body stream
+        async for sm in _aiter_body_to_server_messages(items, builder):
+            yield sm
+            last_seq = sm.sequence_id
+
+        code, message = MESSAGE_END_CODE_SUCCESS, ""
+    except TokenBudgetExceeded as ex:
+        code, message = MESSAGE_END_CODE_BUDGET_EXCEEDED, str(ex)
+    except Exception as ex:
+        # 使用错误分类器获取错误码
+        err = classify_error(ex, {"node_name": "stream"})
+        code, message = str(err.code), err.message
+    finally:
+        # 上游被取消或提前退出时，确保底层 astream 生成器被关闭
+        aclose = getattr(items, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    # message_end
+    yield _make_end_message(
+        code=code,
+        message=message,
+        session_id=session_id,
+        query_msg_id=query_msg_id,
+        reply_id=reply_id,
+        sequence_id=last_seq + 1,
+        time_cost_ms=int((time.time() - t0) * 1000),
+        log_id=log_id,
+        token_cost=builder.token_cost,
+    )
 
 
 def agent_iter_server_messages(
@@ -598,3 +718,23 @@ def agent_iter_server_messages(
         sequence_id_start=1,
         log_id=log_id,
     )
+
+
+def agent_aiter_server_messages(
+        items: AsyncIterator[Dict[Any, Dict[str, Any]]],
+        *,
+        session_id: str,
+        query_msg_id: str,
+        local_msg_id: str,
+        run_id: str,
+        log_id: str,
+) -> AsyncIterator[ServerMessage]:
+    return aiter_server_messages(
+        items,
+        session_id=session_id,
+        query_msg_id=query_msg_id,
+        local_msg_id=local_msg_id,
+        run_id=run_id,
+        sequence_id_start=1,
+        log_id=log_id,
+    )
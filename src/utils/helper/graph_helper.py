@@ -5,11 +5,12 @@ import ast
 import textwrap
 from pydantic import BaseModel
 from typing import get_type_hints,Type,Optional,get_origin,Union,get_args
-from langgraph.graph.state import CompiledStateGraph
-from langgraph.graph import START, END
+from langgraph.constants import START, END
 
 
 def get_graph_instance(module_name):
+    # langgraph.graph 较重，加载图时才导入
+    from langgraph.graph.state import CompiledStateGraph
     module = importlib.import_module(module_name)
     for _, obj in inspect.getmembers(module):
         if isinstance(obj, CompiledStateGraph):
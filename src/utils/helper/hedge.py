@@ -0,0 +1,240 @@
+"""
+模型请求对冲（hedging）
+
+思考模型偶尔在首 token 前卡住数分钟，而多数请求几秒内就开始输出。开启 MODEL_HEDGE_ENABLED 后，
+流式 chat completions 请求的首字节等待时间超过该模型近期 TTFT 的 MODEL_HEDGE_PERCENTILE 分位时，
+再发一个相同的请求，哪个先开始输出就用哪个，另一个立即取消（关闭连接）。
+
+- TTFT 按模型维护滑动窗口，样本数不足 MODEL_HEDGE_MIN_SAMPLES 时不对冲
+- 对冲率上限 MODEL_HEDGE_MAX_RATE：每个请求积累该比例的额度，每次对冲消耗 1，限制额外成本
+- 只对冲已经返回 200 之前的等待阶段；开始输出后不再切换，输出内容只来自一个请求
+
+在 HTTP 层实现，对 ChatOpenAI 与 LangGraph 的回调透明。只作用于共享异步客户端（http_pool）。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+MODEL_HEDGE_ENABLED = os.getenv("MODEL_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+MODEL_HEDGE_PERCENTILE = float(os.getenv("MODEL_HEDGE_PERCENTILE", "95"))
+MODEL_HEDGE_MIN_SAMPLES = int(os.getenv("MODEL_HEDGE_MIN_SAMPLES", "20"))
+MODEL_HEDGE_WINDOW = int(os.getenv("MODEL_HEDGE_WINDOW", "200"))
+# 对冲等待时间下限（秒），避免 TTFT 普遍很短时频繁对冲
+MODEL_HEDGE_MIN_DELAY = float(os.getenv("MODEL_HEDGE_MIN_DELAY", "1.0"))
+# 对冲请求数占总请求数的比例上限
+MODEL_HEDGE_MAX_RATE = float(os.getenv("MODEL_HEDGE_MAX_RATE", "0.05"))
+# 额度上限，允许短时间内的少量突发
+_MAX_CREDIT = 5.0
+
+_Attempt = Tuple[httpx.Response, bytes, AsyncIterator[bytes], float]
+
+
+class _HedgeState:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ttft: Dict[str, Deque[float]] = {}
+        self._credit = 0.0
+        self.requests = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.hedges_skipped = 0
+
+    def observe(self, model: str, ttft: float):
+        with self._lock:
+            samples = self._ttft.get(model)
+            if samples is None:
+                samples = self._ttft[model] = deque(maxlen=MODEL_HEDGE_WINDOW)
+            samples.append(ttft)
+
+    def percentile(self, model: str, pct: float = MODEL_HEDGE_PERCENTILE) -> Optional[float]:
+        with self._lock:
+            samples = self._ttft.get(model)
+            if samples is None or len(samples) < MODEL_HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def admit_request(self):
+        with self._lock:
+            self.requests += 1
+            self._credit = min(_MAX_CREDIT, self._credit + MODEL_HEDGE_MAX_RATE)
+
+    def try_hedge(self) -> bool:
+        with self._lock:
+            if self._credit < 1.0:
+                self.hedges_skipped += 1
+                return False
+            self._credit -= 1.0
+            self.hedges_fired += 1
+            return True
+
+    def won(self):
+        with self._lock:
+            self.hedges_won += 1
+
+    def stats(self) -> Dict[str, Any]:
+        models = list(self._ttft)
+        return {
+            "enabled": MODEL_HEDGE_ENABLED,
+            "percentile": MODEL_HEDGE_PERCENTILE,
+            "max_rate": MODEL_HEDGE_MAX_RATE,
+            "requests": self.requests,
+            "hedges_fired": self.hedges_fired,
+            "hedges_won": self.hedges_won,
+            "hedges_skipped": self.hedges_skipped,
+            "ttft": {
+                m: {
+                    "samples": len(self._ttft[m]),
+                    "p50": self.percentile(m, 50),
+                    f"p{MODEL_HEDGE_PERCENTILE:g}": self.percentile(m),
+                }
+                for m in models
+            },
+        }
+
+
+_state = _HedgeState()
+
+
+def hedge_stats() -> Dict[str, Any]:
+    return _state.stats()
+
+
+class _PrefetchedStream(httpx.AsyncByteStream):
+    """已读出首块的响应流：先返回首块，再接着读剩余部分"""
+
+    def __init__(self, first: bytes, rest: AsyncIterator[bytes], response: httpx.Response):
+        self._first = first
+        self._rest = rest
+        self._response = response
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        if self._first:
+            yield self._first
+        async for chunk in self._rest:
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self._response.aclose()
+
+
+def _hedgeable_model(request: httpx.Request, stream: bool) -> Optional[str]:
+    """流式 chat completions 请求返回模型名，其它请求返回 None"""
+    if not stream or request.method != "POST" or not request.url.path.endswith("/chat/completions"):
+        return None
+    try:
+        body = json.loads(request.content)
+    except (ValueError, httpx.RequestNotRead):
+        return None
+    if not isinstance(body, dict) or not body.get("stream"):
+        return None
+    return str(body.get("model") or "")
+
+
+async def _attempt(client: httpx.AsyncClient, request: httpx.Request, **kwargs) -> _Attempt:
+    """发送请求并读出首块数据，返回 (响应, 首块, 剩余迭代器, TTFT)"""
+    t0 = time.monotonic()
+    response = await client.send(request, stream=True, **kwargs)
+    rest = response.aiter_raw()
+    try:
+        first = await rest.__anext__() if response.status_code == 200 else b""
+    except StopAsyncIteration:
+        first = b""
+    except BaseException:
+        await response.aclose()
+        raise
+    return response, first, rest, time.monotonic() - t0
+
+
+def _wrap(request: httpx.Request, attempt: _Attempt) -> httpx.Response:
+    response, first, rest, _ = attempt
+    if response.status_code != 200:
+        # 错误响应不读取首块，原样返回
+        return response
+    return httpx.Response(
+        status_code=response.status_code,
+        headers=response.headers,
+        stream=_PrefetchedStream(first, rest, response),
+        request=request,
+        extensions=response.extensions,
+    )
+
+
+async def _discard(task: "asyncio.Task[_Attempt]"):
+    """取消落败的请求；已完成的关闭其连接"""
+    if not task.done():
+        task.cancel()
+    try:
+        attempt = await task
+    except BaseException:
+        return
+    await attempt[0].aclose()
+
+
+async def hedged_send(client: httpx.AsyncClient, request: httpx.Request, **kwargs) -> httpx.Response:
+    """发送请求；流式 chat completions 请求首块超时后对冲"""
+    model = _hedgeable_model(request, kwargs.get("stream", False))
+    if model is None:
+        return await client.send(request, **kwargs)
+    kwargs.pop("stream")
+
+    _state.admit_request()
+    t0 = time.monotonic()
+    primary = asyncio.ensure_future(_attempt(client, request, **kwargs))
+    threshold = _state.percentile(model)
+    tasks = {primary}
+    winner: Optional[asyncio.Task] = None
+    try:
+        if threshold is not None:
+            done, _ = await asyncio.wait(tasks, timeout=max(threshold, MODEL_HEDGE_MIN_DELAY))
+            if not done and _state.try_hedge():
+                logger.info(f"Hedging model request: model={model}, waited {max(threshold, MODEL_HEDGE_MIN_DELAY):.1f}s")
+                clone = httpx.Request(
+                    request.method, request.url, headers=request.headers,
+                    content=request.content, extensions=request.extensions,
+                )
+                tasks.add(asyncio.ensure_future(_attempt(client, clone, **kwargs)))
+
+        # 取第一个以 200 开始输出的请求；先完成的出错（异常或 429/5xx 等）时继续等另一个，
+        # 都没有 200 时返回错误响应，没有响应时抛出异常
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        fallback: Optional[asyncio.Task] = None
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = error or task.exception()
+                elif task.result()[0].status_code == 200 and winner is None:
+                    winner = task
+                elif fallback is None:
+                    fallback = task
+        if winner is None:
+            if fallback is None:
+                raise error  # type: ignore[misc]
+            winner = fallback
+            return _wrap(request, fallback.result())
+
+        attempt = winner.result()
+        # TTFT 从主请求发出时算起：对冲请求获胜时也要计入已等待的阈值时间，否则分位数逐渐偏低；
+        # 只统计 200 响应，快速返回的错误不能拉低阈值
+        ttft = time.monotonic() - t0
+        _state.observe(model, ttft)
+        if winner is not primary:
+            _state.won()
+            logger.info(f"Hedged request won: model={model}, ttft {ttft:.1f}s (hedge {attempt[3]:.1f}s)")
+        return _wrap(request, attempt)
+    finally:
+        for task in tasks:
+            if winner is None or task is not winner:
+                await _discard(task)
@@ -0,0 +1,201 @@
+"""
+模型网关共享 HTTP 连接池
+
+每个 ChatOpenAI 默认各自创建 httpx 客户端，连接无法跨实例复用，新建连接都要重新握手。
+这里提供进程级共享的同步/异步 httpx 客户端，注入到所有 ChatOpenAI：
+- keep-alive 连接数、最大连接数、空闲过期时间可配置，可选 HTTP/2（需安装 h2）
+- 启动时可预热到模型网关的连接
+- stats() 导出连接池状态
+
+httpx.AsyncClient 的连接池绑定事件循环。异步客户端按事件循环各建一个连接池，
+注入给 ChatOpenAI 的是一个转发到当前事件循环连接池的代理客户端。
+"""
+
+import asyncio
+import functools
+import importlib.util
+import logging
+import os
+import threading
+import weakref
+from typing import Any, Dict, Optional
+
+import httpx
+
+from utils.helper.hedge import MODEL_HEDGE_ENABLED, hedged_send, hedge_stats
+
+logger = logging.getLogger(__name__)
+
+MODEL_HTTP_MAX_CONNECTIONS = int(os.getenv("MODEL_HTTP_MAX_CONNECTIONS", "100"))
+MODEL_HTTP_MAX_KEEPALIVE = int(os.getenv("MODEL_HTTP_MAX_KEEPALIVE", "20"))
+MODEL_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("MODEL_HTTP_KEEPALIVE_EXPIRY", "60"))  # 秒
+MODEL_HTTP_CONNECT_TIMEOUT = float(os.getenv("MODEL_HTTP_CONNECT_TIMEOUT", "10"))  # 秒
+# 读超时默认值；ChatOpenAI 的 timeout 会按请求覆盖
+MODEL_HTTP_TIMEOUT = float(os.getenv("MODEL_HTTP_TIMEOUT", "600"))  # 秒
+MODEL_HTTP_HTTP2 = os.getenv("MODEL_HTTP_HTTP2", "false").lower() in ("1", "true", "yes")
+# 启动时预热的连接数，0 表示不预热
+MODEL_HTTP_WARM_CONNECTIONS = int(os.getenv("MODEL_HTTP_WARM_CONNECTIONS", "2"))
+
+_lock = threading.Lock()
+_sync_client: Optional[httpx.Client] = None
+_async_proxy: Optional["_LoopBoundAsyncClient"] = None
+_loop_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_requests = {"sync": 0, "async": 0}
+
+
+def _count_request(kind: str):
+    # 同步客户端会在多个工作线程中并发发请求
+    with _lock:
+        _requests[kind] += 1
+
+
+@functools.lru_cache(maxsize=None)
+def _http2_enabled() -> bool:
+    """实际是否启用 HTTP/2（缺少 h2 时回退到 HTTP/1.1，只告警一次）"""
+    if MODEL_HTTP_HTTP2 and importlib.util.find_spec("h2") is None:
+        logger.warning("MODEL_HTTP_HTTP2 is set but the 'h2' package is not installed, falling back to HTTP/1.1")
+        return False
+    return MODEL_HTTP_HTTP2
+
+
+def _client_kwargs() -> Dict[str, Any]:
+    return {
+        "limits": httpx.Limits(
+            max_connections=MODEL_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=MODEL_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=MODEL_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(MODEL_HTTP_TIMEOUT, connect=MODEL_HTTP_CONNECT_TIMEOUT),
+        "http2": _http2_enabled(),
+    }
+
+
+def get_sync_client() -> httpx.Client:
+    """进程级共享的同步客户端"""
+    global _sync_client
+    if _sync_client is None:
+        with _lock:
+            if _sync_client is None:
+                def count(_request):
+                    _count_request("sync")
+                _sync_client = httpx.Client(**_client_kwargs(), event_hooks={"request": [count]})
+    return _sync_client
+
+
+def _loop_client() -> httpx.AsyncClient:
+    """当前事件循环的异步连接池"""
+    loop = asyncio.get_running_loop()
+    client = _loop_clients.get(loop)
+    if client is None:
+        async def count(_request):
+            _count_request("async")
+        client = httpx.AsyncClient(**_client_kwargs(), event_hooks={"request": [count]})
+        _loop_clients[loop] = client
+    return client
+
+
+class _LoopBoundAsyncClient(httpx.AsyncClient):
+    """请求转发到当前事件循环的共享连接池；自身只负责构造请求，不持有连接"""
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        if MODEL_HEDGE_ENABLED:
+            return await hedged_send(_loop_client(), request, **kwargs)
+        return await _loop_client().send(request, **kwargs)
+
+    async def aclose(self) -> None:
+        # 共享连接池由 close_clients() 统一关闭
+        return None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """进程级共享的异步客户端（按事件循环复用连接池）"""
+    global _async_proxy
+    if _async_proxy is None:
+        with _lock:
+            if _async_proxy is None:
+                _async_proxy = _LoopBoundAsyncClient(timeout=httpx.Timeout(MODEL_HTTP_TIMEOUT, connect=MODEL_HTTP_CONNECT_TIMEOUT))
+    return _async_proxy
+
+
+async def warm_connections(base_url: Optional[str], n: int = MODEL_HTTP_WARM_CONNECTIONS):
+    """
+    预先建立到模型网关的连接（DNS、TCP、TLS），同时预热同步与异步连接池
+
+    任意响应（包括 404/401）都说明连接已建立；失败只记录日志。
+    """
+    if not base_url or n <= 0:
+        return
+    url = base_url.rstrip("/") + "/models"
+
+    async def probe_async():
+        try:
+            await _loop_client().get(url, timeout=MODEL_HTTP_CONNECT_TIMEOUT)
+        except httpx.HTTPError as e:
+            logger.warning(f"Model gateway warmup failed: {e}")
+
+    def probe_sync():
+        try:
+            get_sync_client().get(url, timeout=MODEL_HTTP_CONNECT_TIMEOUT)
+        except httpx.HTTPError as e:
+            logger.warning(f"Model gateway warmup failed: {e}")
+
+    # 并发发起请求，才能建立 n 条而不是复用同一条连接
+    await asyncio.gather(
+        *(probe_async() for _ in range(n)),
+        *(asyncio.to_thread(probe_sync) for _ in range(n)),
+    )
+    logger.info(f"Model gateway connections warmed: {n} sync + {n} async to {base_url}")
+
+
+def _pool_stats(client: Any) -> Dict[str, Any]:
+    # httpcore 连接池没有公开的统计接口，尽力读取内部状态
+    try:
+        connections = list(client._transport._pool.connections)
+    except AttributeError:
+        return {}
+    idle = sum(1 for c in connections if c.is_idle())
+    origins: Dict[str, int] = {}
+    for c in connections:
+        try:
+            origin = str(c._origin)
+        except AttributeError:
+            origin = "unknown"
+        origins[origin] = origins.get(origin, 0) + 1
+    return {
+        "connections": len(connections),
+        "idle": idle,
+        "active": len(connections) - idle,
+        "by_origin": origins,
+    }
+
+
+def _requests_snapshot() -> Dict[str, int]:
+    with _lock:
+        return dict(_requests)
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "limits": {
+            "max_connections": MODEL_HTTP_MAX_CONNECTIONS,
+            "max_keepalive": MODEL_HTTP_MAX_KEEPALIVE,
+            "keepalive_expiry": MODEL_HTTP_KEEPALIVE_EXPIRY,
+            "http2": _http2_enabled(),
+        },
+        "requests": _requests_snapshot(),
+        "sync": _pool_stats(_sync_client) if _sync_client is not None else {},
+        "async": [_pool_stats(c) for c in list(_loop_clients.values())],
+        "hedge": hedge_stats(),
+    }
+
+
+async def close_clients():
+    """关闭共享连接池（停机时调用）"""
+    global _sync_client
+    # 其它事件循环创建的连接池无法在当前循环中关闭，随进程退出释放
+    client = _loop_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
@@ -0,0 +1,118 @@
+"""
+稳定的提示词前缀
+
+模型服务端的前缀缓存（KV cache）只在请求开头的字节完全一致时生效。
+Agent 编译时把 system prompt 与工具 schema 预先编译一次：
+- system prompt 统一换行符、去掉首尾空白
+- 工具 schema 转换为 OpenAI 格式后按名称排序，每次模型调用绑定同一份 dict，不再逐次转换
+- 对规范化后的 system prompt + 工具 schema 计算前缀哈希，用于观察不同版本配置的缓存效果
+每次调用后从 usage_metadata.input_token_details.cache_read 记录服务端返回的缓存命中 token 数。
+"""
+
+import hashlib
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.messages import AIMessage
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    system_prompt: str
+    # 按名称排序的 OpenAI 格式工具 schema
+    tool_schemas: Tuple[Dict[str, Any], ...]
+    prefix_hash: str
+
+    @property
+    def tool_names(self) -> Tuple[str, ...]:
+        return tuple(s["function"]["name"] for s in self.tool_schemas)
+
+
+def compile_prompt(system_prompt: Optional[str], tools: Sequence[Any] = ()) -> CompiledPrompt:
+    """规范化 system prompt 与工具 schema，并计算前缀哈希"""
+    sp = (system_prompt or "").replace("\r\n", "\n").strip()
+    schemas = tuple(sorted((convert_to_openai_tool(t) for t in tools), key=lambda s: s["function"]["name"]))
+    canonical = json.dumps(
+        {"system": sp, "tools": schemas}, ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    )
+    prefix_hash = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+    logger.info(f"Prompt prefix compiled: hash={prefix_hash}, system={len(sp)} chars, tools={len(schemas)}")
+    return CompiledPrompt(system_prompt=sp, tool_schemas=schemas, prefix_hash=prefix_hash)
+
+
+class _PrefixCacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # prefix_hash -> [调用次数, 输入 token, 缓存命中 token]
+        self._by_prefix: Dict[str, list] = {}
+
+    def record(self, prefix_hash: str, input_tokens: int, cached_tokens: int):
+        with self._lock:
+            entry = self._by_prefix.setdefault(prefix_hash, [0, 0, 0])
+            entry[0] += 1
+            entry[1] += input_tokens
+            entry[2] += cached_tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                h: {
+                    "calls": calls,
+                    "input_tokens": inp,
+                    "cached_tokens": cached,
+                    "hit_ratio": round(cached / inp, 4) if inp else 0.0,
+                }
+                for h, (calls, inp, cached) in self._by_prefix.items()
+            }
+
+
+_stats = _PrefixCacheStats()
+
+
+def prefix_cache_stats() -> Dict[str, Any]:
+    return _stats.snapshot()
+
+
+class PromptPrefixMiddleware(AgentMiddleware):
+    """模型调用时绑定预编译的工具 schema，并记录前缀缓存命中情况"""
+
+    def __init__(self, compiled: CompiledPrompt):
+        super().__init__()
+        self.compiled = compiled
+        self._schemas_by_name = {s["function"]["name"]: s for s in compiled.tool_schemas}
+
+    def _with_compiled_tools(self, request: Any) -> Any:
+        tools = request.tools or []
+        names = [t.name for t in tools if isinstance(t, BaseTool)]
+        # 只在工具集合与编译时一致时替换，其它中间件动态增减工具时保持原样
+        if names and len(names) == len(tools) and set(names) == set(self._schemas_by_name):
+            request.tools = list(self.compiled.tool_schemas)
+        return request
+
+    def _record(self, response: Any):
+        messages = getattr(response, "result", None)
+        if messages is None:
+            messages = [response]
+        for msg in messages:
+            usage = getattr(msg, "usage_metadata", None) if isinstance(msg, AIMessage) else None
+            if usage:
+                cached = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+                _stats.record(self.compiled.prefix_hash, usage.get("input_tokens", 0), cached)
+
+    def wrap_model_call(self, request, handler):
+        response = handler(self._with_compiled_tools(request))
+        self._record(response)
+        return response
+
+    async def awrap_model_call(self, request, handler):
+        response = await handler(self._with_compiled_tools(request))
+        self._record(response)
+        return response
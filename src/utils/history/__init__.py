@@ -0,0 +1,9 @@
+"""会话历史：checkpoint 中消息的压缩与裁剪"""
+
+from utils.history.compaction import compact_messages, compact_message, COMPACTED_REFS_KEY
+
+__all__ = [
+    "compact_messages",
+    "compact_message",
+    "COMPACTED_REFS_KEY",
+]
@@ -0,0 +1,145 @@
+"""
+checkpoint 历史压缩
+
+AgentState.messages 的 reducer。多 MB 的构建日志、base64 图片留在历史里时，
+每轮都会被重新发送给模型并重新写入 checkpoint。这里：
+- 最近一轮（最后一条用户消息及其之后）原样保留
+- 更早的大段用户/工具消息替换为摘要（构建日志取错误区域，其它文本取首尾，图片只留占位），
+  原文写入内容寻址存储，消息中保留引用，可通过 GET /content/{ref} 取回
+- 按 token 预算而不是固定条数裁剪历史，裁剪从完整的一轮开始，避免留下孤立的工具消息
+"""
+
+import logging
+import os
+from typing import Any, List, Optional
+
+from langchain_core.messages import AnyMessage, HumanMessage, ToolMessage
+from langgraph.graph.message import add_messages
+
+from storage.content_store.content_store import content_store
+from utils.build_log.reducer import reduce_build_log, looks_like_build_log, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 每个会话保留的历史 token 预算（估算值，最近一轮不受限制）
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "64000"))
+# 超过该字符数的历史内容才压缩
+HISTORY_COMPACT_MIN_CHARS = int(os.getenv("HISTORY_COMPACT_MIN_CHARS", "4000"))
+# 构建日志摘要保留的行数
+HISTORY_SUMMARY_LINES = int(os.getenv("HISTORY_SUMMARY_LINES", "60"))
+_EXCERPT_HEAD = 1500
+_EXCERPT_TAIL = 500
+
+# additional_kwargs 中记录已归档原文的引用，同时标记消息已压缩
+COMPACTED_REFS_KEY = "compacted_refs"
+
+
+def _archive_note(ref: str, size: int, kind: str) -> str:
+    return f"[{kind}已归档：共 {size} 字符，引用 {ref}，可通过 GET /content/{ref} 取回原文]"
+
+
+def _summarize_text(text: str, refs: List[str]) -> Optional[str]:
+    try:
+        ref = content_store.put(text)
+    except OSError as e:
+        logger.warning(f"History compaction skipped, content store unavailable: {e}")
+        return None
+    refs.append(ref)
+    if text.startswith("data:"):
+        return _archive_note(ref, len(text), "文件")
+    if looks_like_build_log(text):
+        summary = reduce_build_log(text, max_lines=HISTORY_SUMMARY_LINES).text
+    else:
+        summary = f"{text[:_EXCERPT_HEAD]}\n...\n{text[-_EXCERPT_TAIL:]}"
+    return f"{summary}\n{_archive_note(ref, len(text), '原文')}"
+
+
+def _block_payload(block: dict) -> Optional[str]:
+    """图片/文件类内容块中的大字段（data URL 或 base64）"""
+    image_url = block.get("image_url")
+    if isinstance(image_url, dict):
+        image_url = image_url.get("url")
+    for value in (image_url, block.get("base64"), block.get("data"), block.get("url")):
+        if isinstance(value, str):
+            return value
+    return None
+
+
+def _compact_content(content: Any, refs: List[str]) -> Any:
+    if isinstance(content, str):
+        if len(content) < HISTORY_COMPACT_MIN_CHARS:
+            return content
+        return _summarize_text(content, refs) or content
+    if not isinstance(content, list):
+        return content
+    new_content = []
+    for block in content:
+        if isinstance(block, dict):
+            if block.get("type") == "text" and isinstance(block.get("text"), str):
+                if len(block["text"]) >= HISTORY_COMPACT_MIN_CHARS:
+                    summary = _summarize_text(block["text"], refs)
+                    if summary is not None:
+                        block = {**block, "text": summary}
+            else:
+                payload = _block_payload(block)
+                if payload is not None and len(payload) >= HISTORY_COMPACT_MIN_CHARS:
+                    try:
+                        ref = content_store.put(payload)
+                        refs.append(ref)
+                        block = {"type": "text", "text": _archive_note(ref, len(payload), "图片")}
+                    except OSError as e:
+                        logger.warning(f"History compaction skipped, content store unavailable: {e}")
+        new_content.append(block)
+    return new_content
+
+
+def compact_message(msg: AnyMessage) -> AnyMessage:
+    """压缩单条用户/工具消息，已压缩或无需压缩时原样返回"""
+    if not isinstance(msg, (HumanMessage, ToolMessage)) or COMPACTED_REFS_KEY in msg.additional_kwargs:
+        return msg
+    refs: List[str] = []
+    content = _compact_content(msg.content, refs)
+    if not refs:
+        return msg
+    return msg.model_copy(update={
+        "content": content,
+        "additional_kwargs": {**msg.additional_kwargs, COMPACTED_REFS_KEY: refs},
+    })
+
+
+def message_tokens(msg: AnyMessage) -> int:
+    content = msg.content
+    if isinstance(content, str):
+        return estimate_tokens(content)
+    total = 0
+    for block in content:
+        if isinstance(block, str):
+            total += estimate_tokens(block)
+        elif isinstance(block, dict):
+            if block.get("type") == "text":
+                total += estimate_tokens(block.get("text") or "")
+            else:
+                total += len(_block_payload(block) or "") // 4
+    return total
+
+
+def compact_messages(old: List[AnyMessage], new: Any) -> List[AnyMessage]:
+    """AgentState.messages 的 reducer：合并、压缩较早的大消息、按 token 预算裁剪"""
+    merged = add_messages(old, new)  # type: ignore
+    last_human = next(
+        (i for i in range(len(merged) - 1, -1, -1) if isinstance(merged[i], HumanMessage)),
+        len(merged),
+    )
+    messages = [compact_message(m) if i < last_human else m for i, m in enumerate(merged)]
+
+    # 从最近一轮往前累计，超出预算后从下一轮的开头截断
+    used = 0
+    start = last_human
+    for i in range(last_human - 1, -1, -1):
+        used += message_tokens(messages[i])
+        if used > HISTORY_TOKEN_BUDGET:
+            break
+        start = i
+    while start < last_human and not isinstance(messages[start], HumanMessage):
+        start += 1
+    return messages[start:]
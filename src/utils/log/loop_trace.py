@@ -1,6 +1,5 @@
 import os
-import cozeloop
-from cozeloop.integration.langchain.trace_callback import LoopTracer
+import threading
 from langchain_core.runnables import RunnableConfig
 from utils.log.common import get_execute_mode
 from utils.log.node_log import Logger
@@ -10,28 +9,66 @@ api_token = os.getenv("COZE_LOOP_API_TOKEN", "YOUR_LOOP_API_TOKEN")
 base_url = os.getenv("COZE_LOOP_BASE_URL", "https://api.coze.cn")
 commit_hash = os.getenv("COZE_PROJECT_COMMIT_HASH","") # 发布版本的hash值
 
-cozeloopTracer = cozeloop.new_client(
-    workspace_id=space_id,
-    api_token=api_token,
-    api_base_url=base_url,
-)
-cozeloop.set_default_client(cozeloopTracer)
+# cozeloop 客户端在第一次创建 trace 回调时才导入并构建，缩短服务冷启动耗时
+_cozeloop_client = None
+_cozeloop_lock = threading.Lock()
+
+
+def get_cozeloop_client():
+    global _cozeloop_client
+    if _cozeloop_client is None:
+        with _cozeloop_lock:
+            if _cozeloop_client is None:
+                import cozeloop
+                client = cozeloop.new_client(
+                    workspace_id=space_id,
+                    api_token=api_token,
+                    api_base_url=base_url,
+                )
+                cozeloop.set_default_client(client)
+                _cozeloop_client = client
+    return _cozeloop_client
+
+
+def _loop_callback_handler(**kwargs):
+    from cozeloop.integration.langchain.trace_callback import LoopTracer
+    return LoopTracer.get_callback_handler(get_cozeloop_client(), **kwargs)
+
+
+def flush_traces():
+    """上报缓冲中的 trace；客户端尚未创建时无需处理"""
+    if _cozeloop_client is not None:
+        import cozeloop
+        cozeloop.flush()
+
+
+_base_trace_tags = None
+
+
+def _trace_tags(ctx):
+    """trace 标签：进程级不变部分只计算一次，按请求补充 project_id/log_id"""
+    global _base_trace_tags
+    if _base_trace_tags is None:
+        _base_trace_tags = {
+            "execute_mode": get_execute_mode(),
+            "commit_hash": commit_hash,
+        }
+    return {
+        "project_id": ctx.project_id,
+        "log_id": ctx.logid,
+        **_base_trace_tags,
+    }
 
 
 def init_run_config(graph, ctx):
+    # Logger 复用按图缓存的 LangGraphParser，这里只创建请求级状态
     tracer = Logger(graph, ctx)
     tracer.on_chain_start = tracer.on_chain_start_graph  # 非必须
     tracer.on_chain_end = tracer.on_chain_end_graph
-    trace_callback_handler = LoopTracer.get_callback_handler(
-        cozeloopTracer,
+    trace_callback_handler = _loop_callback_handler(
         add_tags_fn=tracer.get_node_tags,
         modify_name_fn=tracer.get_node_name,
-        tags={
-            "project_id": ctx.project_id,
-            "execute_mode": get_execute_mode(),
-            "log_id": ctx.logid,
-            "commit_hash": commit_hash,
-        }
+        tags=_trace_tags(ctx),
     )
     config = RunnableConfig(
         callbacks=[
@@ -45,14 +82,8 @@ def init_run_config(graph, ctx):
 def init_agent_config(graph, ctx):
     config = RunnableConfig(
         callbacks=[
-            LoopTracer.get_callback_handler(
-                cozeloopTracer,
-                tags={
-                    "project_id": ctx.project_id,
-                    "execute_mode": get_execute_mode(),
-                    "log_id": ctx.logid,
-                    "commit_hash": commit_hash,
-                }
+            _loop_callback_handler(
+                tags=_trace_tags(ctx),
                 )
         ]
     )
@@ -1,7 +1,6 @@
 import time
 import logging
 from uuid import UUID
-from openai import BaseModel
 from utils.log.config import LOG_DIR
 from utils.log.common import get_execute_mode, is_prod
 import uuid
@@ -12,7 +11,7 @@ import sys
 import json
 from typing import Dict, Optional, Any
 from pydantic import BaseModel
-from utils.log.parser import LangGraphParser
+from utils.log.parser import get_graph_parser
 import asyncio
 
 
@@ -234,9 +233,9 @@ class Logger(BaseCallbackHandler):
         self.graph = graph
         self.runtime_ctx = ctx
         self.start_time = time.time()
-        self.parser = LangGraphParser(graph)
-
-    run_id_map: Dict[uuid.UUID, str] = {}
+        # 解析结果按图缓存、只读共享；run_id_map 等运行态按请求独立
+        self.parser = get_graph_parser(graph)
+        self.run_id_map: Dict[uuid.UUID, str] = {}
 
     def on_chain_start_graph(
             self,
@@ -1,8 +1,12 @@
 import inspect
+import threading
+import weakref
 from dataclasses import dataclass
-from typing import Dict, Optional, Any, Callable, cast
-from langgraph.graph.state import CompiledStateGraph
-from langgraph.graph import START, END
+from typing import Dict, Optional, Any, Callable, cast, TYPE_CHECKING
+from langgraph.constants import START, END
+
+if TYPE_CHECKING:
+    from langgraph.graph.state import CompiledStateGraph
 
 
 # return: title, description, integrations
@@ -74,15 +78,15 @@ class NodeInfo:
 
 
 class LangGraphParser:
-    def __init__(self, app: CompiledStateGraph):
+    def __init__(self, app: "CompiledStateGraph"):
         # 从LangGraph中获取图结构
-        self.graph_app = app
+        # 不保留 app 本身：解析器按图实例缓存在 WeakKeyDictionary 中，值强引用键会导致图永远不会被回收
         self.graph = app.get_graph()
         # 从图中构建节点信息
         self.nodes: Dict[str, NodeInfo] = {}  # NodeId -> NodeInfo
         # 构建基础信息 - 优先使用CompiledStateGraph中的信息
         self._build_node_info()
-        self.condition_funcs = self._pre_process_conditional_fork_node_info()  # 跟踪condition节点的判断函数，因为中间会插入哑结点和condition节点
+        self.condition_funcs = self._pre_process_conditional_fork_node_info(app)  # 跟踪condition节点的判断函数，因为中间会插入哑结点和condition节点
 
     def _is_agent_node(self, node_id: str) -> bool:
         """
@@ -199,7 +203,6 @@ class LangGraphParser:
         for node_id, node in self.graph.nodes.items():
             if node_id == START:
                 # 开始节点，构建工作流的入参
-                input_cls = self.graph_app.get_input_schema()
                 self.nodes[node_id] = NodeInfo(
                     node_id=node_id,
                     name=START,
@@ -210,7 +213,6 @@ class LangGraphParser:
 
             if node_id == END:
                 # 结束节点，构建工作流的出参
-                output_cls = self.graph_app.get_output_schema()
                 self.nodes[node_id] = NodeInfo(
                     node_id=node_id,
                     name=END,
@@ -238,14 +240,14 @@ class LangGraphParser:
                         node_type=self.get_node_type(node_id),
                     )
 
-    def _pre_process_conditional_fork_node_info(self):
+    def _pre_process_conditional_fork_node_info(self, app: "CompiledStateGraph"):
         '''
         构建条件节点的主节点信息，主要是描述，后续可扩展输入输出
         原因：LangGraph条件判断函数不是真实节点，而就是一个普通的函数
         '''
 
         '''defaultdict(<class 'dict'>, {'join': {'should_continue_processing': BranchSpec(path=should_continue_processing(tags=None, recurse=True, explode_args=False, func_accepts={}), ends={'中文描述分支1': 'add_item_len', '默认分支': 'add_default_item_len'}, input_schema=<class 'graphs.state.BranchJoinInput'>)}})'''
-        branches = self.graph_app.builder.branches
+        branches = app.builder.branches
 
         conditional_funcs = {}  # parent_id: key : {"func":func,"branch_start_node":}
         for parent_id, check in branches.items():
@@ -253,3 +255,25 @@ class LangGraphParser:
                 conditional_funcs[check_func_name] = {
                     "cond_node_name": "cond_" + parent_id} # 拼成前端的条件节点名
         return conditional_funcs
+
+
+# 编译后的图不可变，解析结果按图实例缓存并只读共享
+_parser_cache: "weakref.WeakKeyDictionary[CompiledStateGraph, LangGraphParser]" = weakref.WeakKeyDictionary()
+_parser_cache_lock = threading.Lock()
+
+
+def get_graph_parser(app: "CompiledStateGraph") -> LangGraphParser:
+    """获取图对应的 LangGraphParser，同一个编译图只解析一次"""
+    try:
+        parser = _parser_cache.get(app)
+    except TypeError:
+        # 不支持弱引用的对象，退化为每次解析
+        return LangGraphParser(app)
+    if parser is not None:
+        return parser
+    with _parser_cache_lock:
+        parser = _parser_cache.get(app)
+        if parser is None:
+            parser = LangGraphParser(app)
+            _parser_cache[app] = parser
+    return parser
@@ -0,0 +1,32 @@
+"""
+ServerMessage 快速序列化
+
+基于 orjson 直接序列化 dataclass，跳过 ServerMessage.dict() 的递归 asdict 拷贝。
+同时兼容 ServerMessage.dict() 等字典形式的消息。
+"""
+
+import json
+from typing import Union
+
+import orjson
+
+from utils.messages.server import ServerMessage
+
+MessageLike = Union[ServerMessage, dict]
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def dumps_message(msg: MessageLike) -> str:
+    """序列化单条消息为 JSON 字符串（非 ASCII 字符不转义）"""
+    try:
+        return orjson.dumps(msg, default=str, option=_ORJSON_OPTIONS).decode("utf-8")
+    except (orjson.JSONEncodeError, TypeError):
+        # orjson 不支持的值（如超过 64 位的整数）退回标准库
+        data = msg.dict() if isinstance(msg, ServerMessage) else msg
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def sse_event(msg: MessageLike) -> str:
+    """格式化为 SSE message 事件"""
+    return f"event: message\ndata: {dumps_message(msg)}\n\n"
@@ -27,6 +27,8 @@ MessageType = Literal[
 # Message End Codes
 MESSAGE_END_CODE_SUCCESS = "0"
 MESSAGE_END_CODE_CANCELED = "1"
+MESSAGE_END_CODE_SLOW_CONSUMER = "2"
+MESSAGE_END_CODE_BUDGET_EXCEEDED = "3"
 
 # Tool Response Codes
 TOOL_RESP_CODE_SUCCESS = "0"
@@ -37,6 +39,7 @@ class TokenCost:
     input_tokens: int = field(default_factory=int)
     output_tokens: int = field(default_factory=int)
     total_tokens: int = field(default_factory=int)
+    cached_input_tokens: int = field(default_factory=int)  # 输入中命中服务端前缀缓存的部分
 
 
 @dataclass
@@ -114,7 +117,7 @@ class ServerMessage:
 
 
 
-def create_message_end_dict(
+def create_message_end(
     code: str,
     message: str,
     session_id: str,
@@ -123,8 +126,8 @@ def create_message_end_dict(
     time_cost_ms: int,
     reply_id: str = '',
     sequence_id: int = 1,
-) -> Dict[str, Any]:
-    """创建 message_end 消息字典，复用现有的 ServerMessage 结构"""
+) -> ServerMessage:
+    """创建 message_end 消息；流式接口与正常消息一样产出 ServerMessage，在输出边界统一序列化"""
     return ServerMessage(
         type=MESSAGE_TYPE_MESSAGE_END,
         session_id=session_id,
@@ -142,10 +145,15 @@ def create_message_end_dict(
             )
         ),
         log_id=log_id,
-    ).dict()
+    )
+
+
+def create_message_end_dict(*args, **kwargs) -> Dict[str, Any]:
+    """创建 message_end 消息字典，复用现有的 ServerMessage 结构"""
+    return create_message_end(*args, **kwargs).dict()
 
 
-def create_message_error_dict(
+def create_message_error(
     code: str,
     message: str,
     session_id: str,
@@ -154,7 +162,7 @@ def create_message_error_dict(
     reply_id: str = '',
     sequence_id: int = 1,
     local_msg_id: str = '',
-) -> Dict[str, Any]:
+) -> ServerMessage:
     return ServerMessage(
         type=MESSAGE_TYPE_ERROR,
         session_id=session_id,
@@ -170,4 +178,8 @@ def create_message_error_dict(
             )
         ),
         log_id=log_id,
-    ).dict()
+    )
+
+
+def create_message_error_dict(*args, **kwargs) -> Dict[str, Any]:
+    return create_message_error(*args, **kwargs).dict()
@@ -2,9 +2,9 @@
 
 import asyncio
 import logging
-import threading
 import contextvars
-from typing import Dict, Any, Union, AsyncGenerator
+import threading
+from typing import Dict, Any, Iterable, Iterator, Optional, Union, AsyncGenerator, Callable
 
 from fastapi.responses import StreamingResponse, JSONResponse
 
@@ -13,9 +13,27 @@ from utils.openai.types.response import OpenAIError, OpenAIErrorResponse
 from utils.openai.converter.request_converter import RequestConverter
 from utils.openai.converter.response_converter import ResponseConverter
 from utils.error import classify_error
+from utils.budget import TokenBudgetExceeded
+from utils.stream import StreamQueue, with_stop_on_cancel
 
 logger = logging.getLogger(__name__)
 
+# 运行被取消（/cancel 或停机排空）时返回给客户端的错误码
+CANCELED_ERROR_CODE = "canceled"
+
+
+def _until(stopped: Callable[[], bool], items: Iterable[Any]) -> Iterator[Any]:
+    """消费者已取消时停止拉取 LangGraph 流，并关闭底层生成器，让生产者线程尽快退出"""
+    try:
+        for item in items:
+            if stopped():
+                return
+            yield item
+    finally:
+        close = getattr(items, "close", None)
+        if close is not None:
+            close()
+
 
 class OpenAIChatHandler:
     """OpenAI Chat Completions 处理器"""
@@ -106,8 +124,8 @@ class OpenAIChatHandler:
 
         async def stream_generator() -> AsyncGenerator[str, None]:
             """异步流式生成器"""
-            loop = asyncio.get_running_loop()
-            queue: asyncio.Queue = asyncio.Queue()
+            # 有界队列：客户端过慢时按 STREAM_QUEUE_POLICY 处理，避免缓冲整段模型输出
+            queue = StreamQueue(coalesce=self._coalesce_sse_chunk)
             context = contextvars.copy_context()
 
             def producer():
@@ -126,35 +144,59 @@ class OpenAIChatHandler:
 
                     run_config["recursion_limit"] = 100
                     run_config["configurable"] = {"thread_id": session_id}
-
-                    # 流式执行 - 直接使用 LangGraph 原始流
-                    items = graph.stream(
-                        stream_input,
-                        stream_mode="messages",
-                        config=run_config,
-                        context=ctx,
+                    # 队列被取消后在下一个回调处中断模型调用，线程不必等到节点执行完
+                    with_stop_on_cancel(run_config, lambda: queue.closed)
+
+                    # 流式执行 - 直接使用 LangGraph 原始流；队列被取消后不再继续拉取
+                    items = _until(
+                        lambda: queue.closed,
+                        graph.stream(
+                            stream_input,
+                            stream_mode="messages",
+                            config=run_config,
+                            context=ctx,
+                        ),
                     )
 
                     # 使用 iter_langgraph_stream 方法，支持工具参数流式输出
                     for sse_data in response_converter.iter_langgraph_stream(items):
                         if sse_data != "data: [DONE]\n\n":  # 不在这里发送 DONE
-                            loop.call_soon_threadsafe(queue.put_nowait, sse_data)
+                            if not queue.put(sse_data):
+                                logger.info(f"Stream queue closed, producer stopping for run_id: {ctx.run_id}")
+                                return
 
                 except Exception as ex:
-                    logger.error(f"Stream producer error: {ex}", exc_info=True)
-                    err = classify_error(ex, {"node_name": "openai_stream"})
-                    error_chunk = self._create_error_sse_chunk(
-                        str(err.code),
-                        str(ex),
-                        response_converter.request_id,
-                    )
-                    loop.call_soon_threadsafe(queue.put_nowait, error_chunk)
+                    if queue.closed:
+                        logger.info(f"Stream producer exception after cancel for run_id: {ctx.run_id}, ignoring: {ex}")
+                        return
+                    if isinstance(ex, TokenBudgetExceeded):
+                        logger.warning(f"Stream rejected for run_id: {ctx.run_id}: {ex}")
+                        error_chunk = self._create_error_sse_chunk(
+                            "429",
+                            str(ex),
+                            response_converter.request_id,
+                            error_type="insufficient_quota",
+                        )
+                    else:
+                        logger.error(f"Stream producer error: {ex}", exc_info=True)
+                        err = classify_error(ex, {"node_name": "openai_stream"})
+                        error_chunk = self._create_error_sse_chunk(
+                            str(err.code),
+                            str(ex),
+                            response_converter.request_id,
+                        )
+                    queue.put(error_chunk)
                 finally:
-                    loop.call_soon_threadsafe(queue.put_nowait, "data: [DONE]\n\n")
-                    loop.call_soon_threadsafe(queue.put_nowait, None)
+                    queue.put("data: [DONE]\n\n")
+                    queue.close()
+
+            # 登记到 running_tasks，/cancel 与停机排空可以定位并取消该流
+            task = asyncio.current_task()
+            if task:
+                self.graph_service.register_task(ctx.run_id, task)
 
             # 启动后台线程
-            threading.Thread(target=lambda: context.run(producer), daemon=True).start()
+            self.graph_service.start_producer(lambda: context.run(producer))
 
             # 从队列消费
             try:
@@ -163,9 +205,31 @@ class OpenAIChatHandler:
                     if item is None:
                         break
                     yield item
+                if queue.dropped:
+                    logger.warning(f"Slow consumer dropped for run_id: {ctx.run_id}, queue stats: {queue.stats()}")
+                    yield self._create_error_sse_chunk(
+                        "slow_consumer",
+                        "Stream dropped: client is consuming too slowly",
+                        response_converter.request_id,
+                    )
+                    yield "data: [DONE]\n\n"
             except asyncio.CancelledError:
                 logger.info(f"Stream cancelled for run_id: {ctx.run_id}")
+                # 先通知 producer 停止，再给客户端发送终止 chunk 与 [DONE]
+                queue.cancel()
+                yield self._create_error_sse_chunk(
+                    CANCELED_ERROR_CODE,
+                    self._cancel_message(),
+                    response_converter.request_id,
+                )
+                yield "data: [DONE]\n\n"
+                # 与 /stream_run 一致，发送终止帧后继续传播取消，停机与排空才能可靠结束该任务
                 raise
+            finally:
+                # 唤醒可能阻塞在满队列上的 producer 线程
+                queue.cancel()
+                self.graph_service.unregister_task(ctx.run_id)
+                logger.info(f"Stream queue stats for run_id: {ctx.run_id}: {queue.stats()}")
 
         return StreamingResponse(
             stream_generator(),
@@ -183,6 +247,8 @@ class OpenAIChatHandler:
         loop = asyncio.get_running_loop()
         context = contextvars.copy_context()
         result_future: asyncio.Future = loop.create_future()
+        # 取消标志，用于通知 producer 线程停止
+        cancelled = threading.Event()
 
         def producer():
             """后台线程生产者"""
@@ -200,40 +266,79 @@ class OpenAIChatHandler:
 
                 run_config["recursion_limit"] = 100
                 run_config["configurable"] = {"thread_id": session_id}
+                with_stop_on_cancel(run_config, cancelled.is_set)
 
-                # 流式执行 - 直接使用 LangGraph 原始流
-                items = graph.stream(
-                    stream_input,
-                    stream_mode="messages",
-                    config=run_config,
-                    context=ctx,
+                # 流式执行 - 直接使用 LangGraph 原始流；请求被取消后不再继续拉取
+                items = _until(
+                    cancelled.is_set,
+                    graph.stream(
+                        stream_input,
+                        stream_mode="messages",
+                        config=run_config,
+                        context=ctx,
+                    ),
                 )
 
                 # 使用 collect_langgraph_to_response 方法收集结果
                 response = response_converter.collect_langgraph_to_response(items)
+                if cancelled.is_set():
+                    return
                 loop.call_soon_threadsafe(
                     result_future.set_result,
                     response.to_dict()
                 )
 
             except Exception as ex:
+                if cancelled.is_set():
+                    logger.info(f"Non-stream producer exception after cancel for run_id: {ctx.run_id}, ignoring: {ex}")
+                    return
                 logger.error(f"Non-stream producer error: {ex}", exc_info=True)
                 loop.call_soon_threadsafe(
                     result_future.set_exception,
                     ex
                 )
 
+        # 登记到 running_tasks，/cancel 与停机排空可以定位并取消该请求
+        task = asyncio.current_task()
+        if task:
+            self.graph_service.register_task(ctx.run_id, task)
+
         # 启动后台线程
-        threading.Thread(target=lambda: context.run(producer), daemon=True).start()
+        self.graph_service.start_producer(lambda: context.run(producer))
 
         try:
             result = await result_future
             return JSONResponse(content=result)
+        except asyncio.CancelledError:
+            logger.info(f"Non-stream request cancelled for run_id: {ctx.run_id}")
+            cancelled.set()
+            return self._error_response(
+                message=self._cancel_message(),
+                error_type="service_unavailable_error" if self.graph_service.draining else "cancelled_error",
+                code=CANCELED_ERROR_CODE,
+                status_code=503 if self.graph_service.draining else 409,
+            )
         except Exception as e:
             return self._handle_error(e)
+        finally:
+            self.graph_service.unregister_task(ctx.run_id)
+
+    def _cancel_message(self) -> str:
+        if self.graph_service.draining:
+            return "Server is shutting down"
+        return "Execution was cancelled"
 
     def _handle_error(self, error: Exception) -> JSONResponse:
         """错误处理，返回 OpenAI 标准错误格式"""
+        if isinstance(error, TokenBudgetExceeded):
+            # 与 /run 一致：预算超限返回 429
+            return self._error_response(
+                message=str(error),
+                error_type="insufficient_quota",
+                code="429",
+                status_code=429,
+            )
+
         err = classify_error(error, {"node_name": "openai_handler"})
 
         error_type = "internal_error"
@@ -278,11 +383,35 @@ class OpenAIChatHandler:
             status_code=status_code,
         )
 
+    @staticmethod
+    def _coalesce_sse_chunk(prev: str, item: str) -> Optional[str]:
+        """合并两个仅含文本增量的 SSE chunk，无法合并时返回 None"""
+        import json
+        prefix = "data: "
+        if not (prev.startswith(prefix) and item.startswith(prefix)):
+            return None
+        try:
+            prev_data = json.loads(prev[len(prefix):])
+            item_data = json.loads(item[len(prefix):])
+            prev_choice = prev_data["choices"][0]
+            item_choice = item_data["choices"][0]
+        except (ValueError, KeyError, IndexError, TypeError):
+            return None
+        if prev_choice.get("finish_reason") or item_choice.get("finish_reason"):
+            return None
+        prev_delta = prev_choice.get("delta") or {}
+        item_delta = item_choice.get("delta") or {}
+        if set(prev_delta) != {"content"} or set(item_delta) != {"content"}:
+            return None
+        prev_delta["content"] += item_delta["content"]
+        return f"data: {json.dumps(prev_data, ensure_ascii=False)}\n\n"
+
     @staticmethod
     def _create_error_sse_chunk(
         code: str,
         message: str,
         request_id: str,
+        error_type: str = "internal_error",
     ) -> str:
         """创建错误 SSE chunk"""
         import json
@@ -291,7 +420,7 @@ class OpenAIChatHandler:
             "object": "chat.completion.chunk",
             "error": {
                 "message": message,
-                "type": "internal_error",
+                "type": error_type,
                 "code": code,
             }
         }
@@ -0,0 +1,21 @@
+from utils.stream.bounded_queue import (
+    StreamQueue,
+    coalesce_answer_messages,
+    stream_queue_stats,
+    POLICY_BLOCK,
+    POLICY_COALESCE,
+    POLICY_DROP,
+)
+from utils.stream.cancel import RunCancelled, StopOnCancel, with_stop_on_cancel
+
+__all__ = [
+    "StreamQueue",
+    "coalesce_answer_messages",
+    "stream_queue_stats",
+    "POLICY_BLOCK",
+    "POLICY_COALESCE",
+    "POLICY_DROP",
+    "RunCancelled",
+    "StopOnCancel",
+    "with_stop_on_cancel",
+]
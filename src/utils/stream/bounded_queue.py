@@ -0,0 +1,232 @@
+"""
+有界流式队列
+
+用于"后台线程生产 → 事件循环消费"的流式桥接。队列深度有上限，
+消费者（客户端）过慢时按策略处理：
+- block:    阻塞生产者，直到消费者取走数据
+- coalesce: 队列已满时，将新的 answer 增量合并进队尾未发送的消息
+- drop:     丢弃该客户端，清空缓冲并终止流
+
+每个流结束时把该队列的指标汇总到进程级统计（stream_queue_stats()），
+包括高水位的最大值与分布、阻塞/合并/丢弃次数，用于调整 STREAM_QUEUE_MAXSIZE 与策略。
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+from utils.messages.server import MESSAGE_TYPE_ANSWER, ServerMessage
+
+POLICY_BLOCK = "block"
+POLICY_COALESCE = "coalesce"
+POLICY_DROP = "drop"
+
+STREAM_QUEUE_MAXSIZE = int(os.getenv("STREAM_QUEUE_MAXSIZE", "256"))
+STREAM_QUEUE_POLICY = os.getenv("STREAM_QUEUE_POLICY", POLICY_BLOCK).lower()
+
+# 阻塞等待时，生产者每隔多久检查一次流是否已被取消（秒）
+_WAIT_INTERVAL = 0.5
+
+CoalesceFunc = Callable[[Any, Any], Optional[Any]]
+
+
+class _QueueStats:
+    """所有已结束的流的队列指标汇总"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.streams = 0
+        self.max_high_water_mark = 0
+        # 高水位分布：上界（2 的幂，最后一档为 maxsize）-> 流数
+        self.high_water_marks: Dict[int, int] = {}
+        self.full = 0
+        self.puts = 0
+        self.blocked_puts = 0
+        self.blocked_s = 0.0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def record(self, queue: "StreamQueue"):
+        bucket = 1
+        while bucket < min(queue.high_water_mark, queue.maxsize):
+            bucket *= 2
+        bucket = min(bucket, queue.maxsize)
+        with self._lock:
+            self.streams += 1
+            self.max_high_water_mark = max(self.max_high_water_mark, queue.high_water_mark)
+            self.high_water_marks[bucket] = self.high_water_marks.get(bucket, 0) + 1
+            self.full += queue.high_water_mark >= queue.maxsize
+            self.puts += queue.put_count
+            self.blocked_puts += queue.blocked_count
+            self.blocked_s += queue.blocked_s
+            self.coalesced += queue.coalesced_count
+            self.dropped += queue.dropped
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "maxsize": STREAM_QUEUE_MAXSIZE,
+                "policy": STREAM_QUEUE_POLICY,
+                "streams": self.streams,
+                "max_high_water_mark": self.max_high_water_mark,
+                "high_water_mark_hist": {f"<={k}": v for k, v in sorted(self.high_water_marks.items())},
+                "full_streams": self.full,
+                "puts": self.puts,
+                "blocked_puts": self.blocked_puts,
+                "blocked_s": round(self.blocked_s, 3),
+                "coalesced": self.coalesced,
+                "dropped_streams": self.dropped,
+            }
+
+
+_stats = _QueueStats()
+
+
+def stream_queue_stats() -> Dict[str, Any]:
+    return _stats.snapshot()
+
+
+class StreamQueue:
+    """
+    线程安全的有界队列：put 在生产者线程调用，get 在事件循环中 await
+
+    put 返回 False 表示流已终止（消费者取消或被 drop），生产者应立即停止。
+    """
+
+    def __init__(
+        self,
+        maxsize: Optional[int] = None,
+        policy: Optional[str] = None,
+        coalesce: Optional[CoalesceFunc] = None,
+    ):
+        self.maxsize = max(1, maxsize or STREAM_QUEUE_MAXSIZE)
+        self.policy = policy or STREAM_QUEUE_POLICY
+        self._coalesce = coalesce
+        self._items: Deque[Any] = deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._loop = asyncio.get_running_loop()
+        self._readable = asyncio.Event()
+        self._eof = False
+        self.closed = False
+        self.dropped = False
+        # 指标
+        self.high_water_mark = 0
+        self.put_count = 0
+        self.coalesced_count = 0
+        # 因队列已满而等待过的 put 次数与累计等待时间
+        self.blocked_count = 0
+        self.blocked_s = 0.0
+        self._recorded = False
+
+    def put(self, item: Any) -> bool:
+        """生产者线程写入，按策略处理队列已满的情况"""
+        with self._not_full:
+            blocked_since: Optional[float] = None
+            while len(self._items) >= self.maxsize and not self.closed:
+                if self.policy == POLICY_COALESCE and self._coalesce is not None and self._items:
+                    merged = self._coalesce(self._items[-1], item)
+                    if merged is not None:
+                        self._items[-1] = merged
+                        self.coalesced_count += 1
+                        self.put_count += 1
+                        return True
+                if self.policy == POLICY_DROP:
+                    self.dropped = True
+                    self.closed = True
+                    self._items.clear()
+                    break
+                # block（coalesce 无法合并时同样退化为阻塞）
+                if blocked_since is None:
+                    blocked_since = time.monotonic()
+                    self.blocked_count += 1
+                self._not_full.wait(timeout=_WAIT_INTERVAL)
+            if blocked_since is not None:
+                self.blocked_s += time.monotonic() - blocked_since
+
+            if self.closed:
+                accepted = False
+            else:
+                self._items.append(item)
+                self.put_count += 1
+                self.high_water_mark = max(self.high_water_mark, len(self._items))
+                accepted = True
+        self._wake()
+        return accepted
+
+    def close(self):
+        """生产者结束写入，消费者取完剩余数据后 get 返回 None"""
+        with self._lock:
+            self._eof = True
+        self._wake()
+
+    def cancel(self):
+        """消费者不再读取（流结束时调用），唤醒并终止可能阻塞中的生产者，并把本队列指标计入汇总"""
+        with self._not_full:
+            self.closed = True
+            self._items.clear()
+            self._not_full.notify_all()
+            recorded, self._recorded = self._recorded, True
+        if not recorded:
+            _stats.record(self)
+
+    async def get(self) -> Any:
+        """取出下一项，流结束时返回 None"""
+        while True:
+            with self._not_full:
+                if self._items:
+                    item = self._items.popleft()
+                    self._not_full.notify()
+                    return item
+                if self._eof or self.closed:
+                    return None
+                self._readable.clear()
+            await self._readable.wait()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "maxsize": self.maxsize,
+            "policy": self.policy,
+            "high_water_mark": self.high_water_mark,
+            "put_count": self.put_count,
+            "coalesced_count": self.coalesced_count,
+            "blocked_count": self.blocked_count,
+            "blocked_s": round(self.blocked_s, 3),
+            "dropped": self.dropped,
+        }
+
+    def _wake(self):
+        try:
+            self._loop.call_soon_threadsafe(self._readable.set)
+        except RuntimeError:
+            # 事件循环已关闭，消费者不会再读取
+            pass
+
+
+def coalesce_answer_messages(prev: Any, item: Any) -> Optional[Any]:
+    """合并同一 msg_id 的两条 answer 消息（ServerMessage 或其字典形式）"""
+    if isinstance(prev, ServerMessage) and isinstance(item, ServerMessage):
+        if prev.type != MESSAGE_TYPE_ANSWER or item.type != MESSAGE_TYPE_ANSWER:
+            return None
+        if prev.msg_id != item.msg_id or prev.finish:
+            return None
+        prev.content.answer = (prev.content.answer or "") + (item.content.answer or "")
+        prev.sequence_id = item.sequence_id
+        prev.finish = item.finish
+        return prev
+    if not isinstance(prev, dict) or not isinstance(item, dict):
+        return None
+    if prev.get("type") != "answer" or item.get("type") != "answer":
+        return None
+    if prev.get("msg_id") != item.get("msg_id") or prev.get("finish"):
+        return None
+    prev_content = prev.get("content") or {}
+    item_content = item.get("content") or {}
+    prev_content["answer"] = (prev_content.get("answer") or "") + (item_content.get("answer") or "")
+    # 取后一条的序号，保证序号单调递增
+    prev["sequence_id"] = item.get("sequence_id", prev.get("sequence_id"))
+    prev["finish"] = item.get("finish", False)
+    return prev
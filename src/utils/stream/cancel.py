@@ -0,0 +1,50 @@
+"""
+同步图执行的取消
+
+后台线程中运行的 graph.stream 无法被 asyncio 取消：关闭生成器只能停止拉取，
+正在执行的节点（通常是模型调用）会一直跑到结束，生产者线程也因此无法退出。
+StopOnCancel 作为回调挂到 run_config 上，取消后在下一个 token、节点或工具回调处抛出
+RunCancelled，中断模型调用与后续节点，让线程尽快退出。
+"""
+
+from typing import Any, Callable
+
+from langchain_core.callbacks import BaseCallbackHandler, BaseCallbackManager
+from langchain_core.runnables import RunnableConfig
+
+
+class RunCancelled(Exception):
+    """运行已被取消（消费者取消或停机排空）"""
+
+
+class StopOnCancel(BaseCallbackHandler):
+    """stopped() 为真时在回调中抛出 RunCancelled"""
+
+    # 回调异常默认只记录日志，这里需要向上抛出以中断执行
+    raise_error = True
+
+    def __init__(self, stopped: Callable[[], bool]):
+        self._stopped = stopped
+
+    def _check(self, *args: Any, **kwargs: Any):
+        if self._stopped():
+            raise RunCancelled("Run cancelled")
+
+    on_llm_new_token = _check
+    on_chat_model_start = _check
+    on_llm_start = _check
+    on_chain_start = _check
+    on_tool_start = _check
+
+
+def with_stop_on_cancel(run_config: RunnableConfig, stopped: Callable[[], bool]) -> RunnableConfig:
+    """在 run_config 的回调列表中追加 StopOnCancel"""
+    callbacks = run_config.get("callbacks")
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        callbacks.add_handler(StopOnCancel(stopped))
+        run_config["callbacks"] = callbacks
+    else:
+        run_config["callbacks"] = [*(callbacks or []), StopOnCancel(stopped)]
+    return run_config
+
@@ -0,0 +1,134 @@
+"""
+answer 增量合并
+
+模型逐 token 输出时，每个 token 都是一条完整的 ServerMessage 信封。
+这里把同一 msg_id 的连续 answer 消息在时间窗口或字节预算内合并为一条，
+减少 SSE 帧数与 JSON 编码量。合并后重新编号 sequence_id，保证连续且单调递增。
+"""
+
+import asyncio
+import os
+from typing import Any, AsyncIterable, AsyncIterator, Optional
+
+from utils.messages.server import MESSAGE_TYPE_ANSWER, ServerMessage
+from utils.stream.bounded_queue import coalesce_answer_messages
+
+# 默认合并窗口（毫秒），0 表示不合并；请求可通过 COALESCE_HEADER 单独指定
+STREAM_COALESCE_MS = int(os.getenv("STREAM_COALESCE_MS", "0"))
+# 单条合并消息的 answer 字节上限，超过后立即发送
+STREAM_COALESCE_MAX_BYTES = int(os.getenv("STREAM_COALESCE_MAX_BYTES", "4096"))
+
+COALESCE_HEADER = "X-Stream-Coalesce-Ms"
+
+# 上游预取深度，读取上游与合并发送解耦，同时保持背压
+_PREFETCH = 64
+
+_END = object()
+
+
+def resolve_coalesce_ms(header_value: Optional[str]) -> int:
+    """解析请求级合并窗口，非法值退回默认配置"""
+    if header_value is None or header_value == "":
+        return STREAM_COALESCE_MS
+    try:
+        return max(0, int(header_value))
+    except ValueError:
+        return STREAM_COALESCE_MS
+
+
+def _is_open_answer(msg: Any) -> bool:
+    if isinstance(msg, ServerMessage):
+        return msg.type == MESSAGE_TYPE_ANSWER and not msg.finish
+    return isinstance(msg, dict) and msg.get("type") == MESSAGE_TYPE_ANSWER and not msg.get("finish")
+
+
+def _is_finished(msg: Any) -> bool:
+    return msg.finish if isinstance(msg, ServerMessage) else bool(msg.get("finish"))
+
+
+def _answer_bytes(msg: Any) -> int:
+    if isinstance(msg, ServerMessage):
+        answer = msg.content.answer
+    else:
+        answer = (msg.get("content") or {}).get("answer")
+    return len((answer or "").encode("utf-8"))
+
+
+async def coalesce_answer_stream(
+    source: AsyncIterable[Any],
+    window_ms: int,
+    max_bytes: int = STREAM_COALESCE_MAX_BYTES,
+) -> AsyncIterator[Any]:
+    """
+    合并 source 中同一 msg_id 的连续 answer 消息
+
+    缓冲的 answer 在以下任一条件满足时发出：窗口到期、超过字节预算、
+    遇到 finish 消息、遇到其它类型或其它 msg_id 的消息、上游结束。
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=_PREFETCH)
+
+    async def pump():
+        # 由单个任务从头到尾驱动上游生成器，保证其上下文一致
+        try:
+            async for item in source:
+                await queue.put(item)
+            await queue.put(_END)
+        except Exception as ex:
+            await queue.put(ex)
+
+    pump_task = asyncio.create_task(pump())
+    pending: Optional[Any] = None
+    deadline = 0.0
+    next_seq: Optional[int] = None
+
+    def renumber(msg: Any) -> Any:
+        nonlocal next_seq
+        is_sm = isinstance(msg, ServerMessage)
+        if next_seq is None:
+            next_seq = (msg.sequence_id if is_sm else msg.get("sequence_id")) or 1
+        if is_sm:
+            msg.sequence_id = next_seq
+        else:
+            msg["sequence_id"] = next_seq
+        next_seq += 1
+        return msg
+
+    try:
+        while True:
+            if pending is not None:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    yield renumber(pending)
+                    pending = None
+                    continue
+            else:
+                item = await queue.get()
+
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            if pending is not None and coalesce_answer_messages(pending, item) is not None:
+                if _is_finished(pending) or _answer_bytes(pending) >= max_bytes:
+                    yield renumber(pending)
+                    pending = None
+                continue
+
+            if pending is not None:
+                yield renumber(pending)
+                pending = None
+            if _is_open_answer(item):
+                pending = item
+                deadline = loop.time() + window_ms / 1000
+            else:
+                yield renumber(item)
+
+        if pending is not None:
+            yield renumber(pending)
+    finally:
+        if not pump_task.done():
+            pump_task.cancel()
+            await asyncio.wait({pump_task})
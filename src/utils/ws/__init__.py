@@ -0,0 +1,5 @@
+"""WebSocket 多路复用传输"""
+
+from utils.ws.handler import WebSocketRunHandler
+
+__all__ = ["WebSocketRunHandler"]
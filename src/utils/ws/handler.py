@@ -0,0 +1,267 @@
+"""
+WebSocket 多路复用处理器
+
+一条 WebSocket 连接上同时运行多个流式 run，消息沿用 ServerMessage 结构，外层加一层信封区分 run。
+
+客户端 → 服务端（JSON 文本帧）:
+    {"type": "run", "id": "<客户端自定的流 id>", "payload": {...}, "window": 64, "coalesce_ms": 0, "priority": "interactive"}
+    {"type": "cancel", "id": "<流 id>"}
+    {"type": "credit", "id": "<流 id>", "n": 32}
+
+服务端 → 客户端:
+    {"type": "run_started", "id": ..., "run_id": ...}
+    {"type": "message", "id": ..., "run_id": ..., "data": <ServerMessage>}
+    {"type": "run_done", "id": ..., "run_id": ...}
+    {"type": "error", "id": ..., "error": {"error_code": ..., "error_message": ...}}
+
+流控：run 帧中 window > 0 时启用按 run 的信用额度，每发送一条 message 消耗 1 个额度，
+额度耗尽后该 run 暂停（反压到图执行），客户端通过 credit 帧补充额度；window 缺省或 <= 0 时不限流。
+暂停期间 run 仍占用准入名额，超过 WS_CREDIT_TIMEOUT 秒未收到额度时以错误结束该 run 并释放名额。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from coze_coding_utils.runtime_ctx.context import new_context
+from utils.admission import AdmissionController, AdmissionRejected, Permit, PRIORITY_HEADER
+from utils.error import classify_error
+from utils.helper.agent_helper import to_client_message
+from utils.log.write_log import request_context
+from utils.messages.serializer import dumps_message
+from utils.messages.server import (
+    MESSAGE_END_CODE_CANCELED,
+    create_message_end,
+    create_message_error,
+)
+from utils.stream.coalesce import resolve_coalesce_ms, COALESCE_HEADER
+
+logger = logging.getLogger(__name__)
+
+# 单连接同时运行的 run 上限
+WS_MAX_RUNS_PER_CONNECTION = int(os.getenv("WS_MAX_RUNS_PER_CONNECTION", "64"))
+# 额度耗尽后等待 credit 帧的最长时间（秒）
+WS_CREDIT_TIMEOUT = float(os.getenv("WS_CREDIT_TIMEOUT", "60"))
+
+
+class CreditTimeout(Exception):
+    """客户端在 WS_CREDIT_TIMEOUT 内没有补充额度"""
+
+
+class _RunChannel:
+    """连接内的一个 run：任务句柄与信用额度"""
+
+    def __init__(self, stream_id: str, run_id: str, window: int):
+        self.stream_id = stream_id
+        self.run_id = run_id
+        self.flow_control = window > 0
+        self.credit = window
+        self._credit_available = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    async def acquire_credit(self, timeout: float = WS_CREDIT_TIMEOUT):
+        if not self.flow_control:
+            return
+        while self.credit <= 0:
+            self._credit_available.clear()
+            try:
+                await asyncio.wait_for(self._credit_available.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise CreditTimeout(f"No credit granted within {timeout:g}s") from None
+        self.credit -= 1
+
+    def grant(self, n: int):
+        self.credit += n
+        self._credit_available.set()
+
+
+class _Connection:
+    """一条 WebSocket 连接，发送加锁保证帧不交错"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.channels: Dict[str, _RunChannel] = {}
+        self.closed = False
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, frame: Dict[str, Any]):
+        if self.closed:
+            return
+        async with self._send_lock:
+            try:
+                await self.websocket.send_text(dumps_message(frame))
+            except Exception:
+                # 连接已断开，后续发送直接丢弃，由接收循环负责清理
+                self.closed = True
+
+    async def send_error(self, stream_id: Optional[str], code: str, message: str):
+        await self.send({"type": "error", "id": stream_id, "error": {"error_code": code, "error_message": message}})
+
+
+class WebSocketRunHandler:
+    """/ws 处理器"""
+
+    def __init__(self, graph_service: Any, admission: AdmissionController):
+        """
+        初始化处理器
+
+        Args:
+            graph_service: GraphService 实例
+            admission: 准入控制器，每个 run 单独申请名额
+        """
+        self.graph_service = graph_service
+        self.admission = admission
+
+    async def handle(self, websocket: WebSocket):
+        await websocket.accept()
+        conn = _Connection(websocket)
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                text = message.get("text")
+                if text is None:
+                    await conn.send_error(None, "400", "Invalid frame: binary frames are not supported")
+                    continue
+                try:
+                    frame = json.loads(text)
+                    if not isinstance(frame, dict):
+                        raise ValueError("frame must be a JSON object")
+                except ValueError as e:
+                    await conn.send_error(None, "400", f"Invalid frame: {e}")
+                    continue
+                await self._dispatch(conn, frame)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            conn.closed = True
+            tasks = [c.task for c in conn.channels.values() if c.task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _dispatch(self, conn: _Connection, frame: Dict[str, Any]):
+        frame_type = frame.get("type")
+        stream_id = frame.get("id")
+        if not isinstance(stream_id, str) or not stream_id:
+            await conn.send_error(None, "400", "Frame 'id' is required")
+            return
+
+        if frame_type == "run":
+            await self._start_run(conn, stream_id, frame)
+        elif frame_type == "cancel":
+            channel = conn.channels.get(stream_id)
+            if channel is None or channel.task is None:
+                await conn.send_error(stream_id, "404", "No active run with this id")
+                return
+            channel.task.cancel()
+        elif frame_type == "credit":
+            channel = conn.channels.get(stream_id)
+            if channel is not None:
+                try:
+                    channel.grant(max(0, int(frame.get("n", 0))))
+                except (TypeError, ValueError):
+                    await conn.send_error(stream_id, "400", "Credit 'n' must be an integer")
+        else:
+            await conn.send_error(stream_id, "400", f"Unknown frame type: {frame_type}")
+
+    async def _start_run(self, conn: _Connection, stream_id: str, frame: Dict[str, Any]):
+        if stream_id in conn.channels:
+            await conn.send_error(stream_id, "409", "A run with this id is already active")
+            return
+        if len(conn.channels) >= WS_MAX_RUNS_PER_CONNECTION:
+            await conn.send_error(
+                stream_id, "429", f"Too many concurrent runs on this connection (max {WS_MAX_RUNS_PER_CONNECTION})"
+            )
+            return
+
+        headers = conn.websocket.headers
+        ctx = new_context(method="ws_run", headers=headers)
+        try:
+            window = int(frame.get("window") or 0)
+        except (TypeError, ValueError):
+            window = 0
+        coalesce_ms = frame.get("coalesce_ms")
+        coalesce_ms = resolve_coalesce_ms(str(coalesce_ms) if coalesce_ms is not None else headers.get(COALESCE_HEADER))
+        priority = frame.get("priority") or headers.get(PRIORITY_HEADER)
+
+        channel = _RunChannel(stream_id, ctx.run_id, window)
+        conn.channels[stream_id] = channel
+        channel.task = asyncio.create_task(self._run(conn, channel, frame.get("payload"), ctx, coalesce_ms, priority))
+        # 登记后 /cancel/{run_id} 同样可以取消
+        self.graph_service.register_task(ctx.run_id, channel.task)
+
+    async def _run(self, conn: _Connection, channel: _RunChannel, payload: Any, ctx, coalesce_ms: int, priority: Optional[str]):
+        request_context.set(ctx)
+        envelope = {"id": channel.stream_id, "run_id": channel.run_id}
+        permit: Optional[Permit] = None
+        client_msg = None
+        t0 = time.time()
+        try:
+            if not isinstance(payload, dict):
+                await conn.send_error(channel.stream_id, "400", "Frame 'payload' must be a JSON object")
+                return
+            client_msg, _ = to_client_message(payload)
+            permit = await self.admission.acquire(priority)
+            await conn.send({"type": "run_started", **envelope})
+            messages = self.graph_service.stream_messages(payload, ctx, coalesce_ms=coalesce_ms)
+            try:
+                async for msg in messages:
+                    await channel.acquire_credit()
+                    await conn.send({"type": "message", **envelope, "data": msg})
+            finally:
+                await messages.aclose()
+        except CreditTimeout as e:
+            # 客户端停止补充额度：结束 run（关闭流即取消图执行），释放准入名额
+            logger.warning(f"WebSocket run stalled without credit for run_id: {channel.run_id}: {e}")
+            await conn.send_error(channel.stream_id, "408", str(e))
+        except AdmissionRejected as e:
+            await conn.send({
+                "type": "error",
+                **envelope,
+                "error": {"error_code": str(e.status_code), "error_message": e.reason, "retry_after": e.retry_after},
+            })
+        except asyncio.CancelledError:
+            logger.info(f"WebSocket run cancelled for run_id: {channel.run_id}")
+            if client_msg is not None:
+                end_msg = create_message_end(
+                    code=MESSAGE_END_CODE_CANCELED,
+                    message="Server is shutting down" if self.graph_service.draining else "Stream cancelled by user",
+                    session_id=client_msg.session_id,
+                    query_msg_id=client_msg.local_msg_id,
+                    log_id=ctx.logid,
+                    time_cost_ms=int((time.time() - t0) * 1000),
+                    reply_id="",
+                    sequence_id=1,
+                )
+                await conn.send({"type": "message", **envelope, "data": end_msg})
+            raise
+        except Exception as ex:
+            err = classify_error(ex, {"node_name": "ws_run", "run_id": channel.run_id})
+            logger.error(f"Unexpected error in ws run: [{err.code}] {err.message}, run_id: {channel.run_id}")
+            if client_msg is None:
+                await conn.send_error(channel.stream_id, str(err.code), str(ex))
+            else:
+                error_msg = create_message_error(
+                    code=str(err.code),
+                    message=str(ex),
+                    session_id=client_msg.session_id,
+                    query_msg_id=client_msg.local_msg_id,
+                    log_id=ctx.logid,
+                    reply_id="",
+                    sequence_id=1,
+                    local_msg_id=client_msg.local_msg_id,
+                )
+                await conn.send({"type": "message", **envelope, "data": error_msg})
+        finally:
+            if permit is not None:
+                permit.release()
+            self.graph_service.unregister_task(channel.run_id)
+            conn.channels.pop(channel.stream_id, None)
+            await conn.send({"type": "run_done", **envelope})